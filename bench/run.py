@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks of the SDK against a local ynote.fakeserver.FakeServer.
+
+usage: python bench/run.py [options] [case ...]
+
+Each case prints the number of operations, the throughput and the p50/p99
+latency of one operation. Run without cases to run them all.
+'''
+
+import json
+import optparse
+import os
+import Queue
+import StringIO
+import sys
+import tempfile
+import time
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ynote
+import ynote.oauth2 as oauth2
+from ynote.asyncclient import AsyncYNoteClient
+from ynote.fakeserver import FakeServer
+from ynote.limiter import AIMDLimiter, TokenBucket
+from ynote.retry import RetryPolicy
+
+
+def _percentile(samples, q):
+    '''get the q-th percentile(0-100) of sorted samples.'''
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+def _report(name, samples, elapsed, nbytes=0, errors=0):
+    '''print one line of results; samples are per-operation seconds.'''
+    samples = sorted(samples)
+    line = '%-16s %7d ops %10.1f ops/s   p50 %8.3f ms   p99 %8.3f ms' % (
+            name, len(samples), len(samples) / elapsed,
+            _percentile(samples, 50) * 1000, _percentile(samples, 99) * 1000)
+    if nbytes:
+        line += '   %8.1f MB/s' % (nbytes / elapsed / (1 << 20))
+    if errors:
+        line += '   %d errors' % errors
+    print line
+
+def _timed(fn, count):
+    '''call fn() "count" times, return (samples, elapsed, errors).'''
+    samples = []
+    errors = 0
+    start = time.time()
+    for i in xrange(count):
+        t = time.time()
+        try:
+            fn()
+        except ynote.YNoteError:
+            errors += 1
+        samples.append(time.time() - t)
+    return samples, time.time() - start, errors
+
+
+def bench_sign(server, client, options):
+    '''cost of building and signing a request, no network.'''
+    params = {'path':'/notebook/note', 'title':'title', 'content':'x' * 1024}
+    url = ynote.BASE_URL + 'yws/open/note/update.json'
+    def sign_legacy():
+        # signing without oauth2.Signer: every request re-keys the HMAC and
+        # escapes and sorts all the parameters again.
+        req_builder = oauth2.RequestBuilder(oauth2.HTTP_POST_URLENCODED, url, params)
+        req_builder._sign(client.consumer, client.access_token)
+        req = urllib2.Request(url, req_builder._get_urlencoded_body())
+        req.add_header('Authorization', req_builder._get_auth_header())
+    def sign():
+        req_builder = oauth2.RequestBuilder(oauth2.HTTP_POST_URLENCODED, url, params)
+        req_builder.build_signed_request(client.consumer, client.access_token)
+    samples, elapsed, errors = _timed(sign_legacy, options.count * 10)
+    _report('sign-legacy', samples, elapsed)
+    samples, elapsed, errors = _timed(sign, options.count * 10)
+    _report('sign', samples, elapsed)
+
+def bench_single(server, client, options):
+    '''sequential get_note calls over a kept-alive connection.'''
+    path = server.add_note(server.default_notebook, 'x' * 1024, title='single')
+    samples, elapsed, errors = _timed(lambda: client.get_note(path), options.count)
+    _report('single', samples, elapsed, errors=errors)
+
+def _bulk_notes(server, options):
+    book = server.add_notebook('bulk')
+    return [server.add_note(book, 'x' * 1024, title='note %d' % i) for i in xrange(options.count)]
+
+def bench_bulk(server, client, options):
+    '''get_notes over a pool of threads.'''
+    paths = _bulk_notes(server, options)
+    samples = []
+    errors = 0
+    # the latency of each request is taken from the instrumentation hook.
+    hook = lambda event: samples.append(event.timings['total'])
+    client.add_hook(hook)
+    try:
+        start = time.time()
+        for path, note, error in client.get_notes(paths, options.workers, False):
+            if error is not None:
+                errors += 1
+        elapsed = time.time() - start
+    finally:
+        client.remove_hook(hook)
+    _report('bulk', samples, elapsed, errors=errors)
+
+def bench_list(server, client, options):
+    '''get_note_paths of a notebook of options.count * 10 notes, decoded as it arrives.'''
+    book = server.add_notebook('list')
+    for i in xrange(options.count * 10):
+        server.add_note(book, '', title='note %d' % i)
+    count = max(options.count / 50, 3)
+    samples, elapsed, errors = _timed(lambda: client.get_note_paths(book), count)
+    _report('list', samples, elapsed, errors=errors)
+
+def bench_async(server, client, options):
+    '''get_note on the asynchronous client, all requests queued at once.'''
+    paths = _bulk_notes(server, options)
+    aclient = AsyncYNoteClient(server.consumer_key, server.consumer_secret, options.workers)
+    aclient.access_token = client.access_token
+    try:
+        # the callbacks may run after result() returns: collect them through a queue.
+        done = Queue.Queue()
+        start = time.time()
+        for path in paths:
+            f = aclient.get_note(path)
+            f.add_done_callback(lambda f, t=time.time(): done.put((time.time() - t, f.exception())))
+        samples = []
+        errors = 0
+        for path in paths:
+            sample, error = done.get()
+            samples.append(sample)
+            errors += error is not None
+        _report('async', samples, time.time() - start, errors=errors)
+    finally:
+        aclient.close()
+
+def bench_upload(server, client, options):
+    '''upload_resource of a file of options.size MB.'''
+    data = os.urandom(options.size << 20)
+    count = max(options.count / 50, 3)
+    samples, elapsed, errors = _timed(lambda: client.upload_resource(StringIO.StringIO(data)), count)
+    _report('upload', samples, elapsed, len(data) * (count - errors), errors)
+
+def bench_download(server, client, options):
+    '''download_resource_to a file, for a resource of options.size MB.'''
+    data = os.urandom(options.size << 20)
+    url = server.add_resource(data)
+    count = max(options.count / 50, 3)
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        samples, elapsed, errors = _timed(lambda: client.download_resource_to(url, path, resume=False), count)
+    finally:
+        os.remove(path)
+    _report('download', samples, elapsed, len(data) * (count - errors), errors)
+
+class _DictNote:
+    '''a note that keeps its fields in __dict__, as the models used to.'''
+
+    def __init__(self, json_dict):
+        for k in ('path', 'title', 'author', 'source', 'size', 'create_time', 'modify_time', 'content'):
+            setattr(self, k, json_dict[k])
+
+def _size(objects):
+    '''
+    get the bytes held by objects, their fields and what those hold in
+    turn, counting shared values once. Functions are not followed.
+    '''
+    seen = set()
+    total = 0
+    values = list(objects)
+    while values:
+        value = values.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            values.extend(value)
+        elif isinstance(value, dict):
+            values.extend(value.keys())
+            values.extend(value.values())
+        elif hasattr(value, '__dict__') and not callable(value):
+            values.append(value.__dict__)
+        elif hasattr(type(value), '__slots__'):
+            values.extend([getattr(value, k) for k in type(value).__slots__ if hasattr(value, k)])
+    return total
+
+def bench_memory(server, client, options):
+    '''bytes per note held in memory, with and without the content.'''
+    books = ['/%d' % i for i in xrange(10)]
+    body = json.dumps([{'path':'%s/%d' % (books[i % 10], i), 'title':u'note %d' % i,
+            'author':u'author', 'source':u'', 'size':1024, 'create_time':1300000000 + i,
+            'modify_time':1300000000 + i, 'content':u'x' * 1024} for i in xrange(options.count)])
+    _load_content = lambda path: client.get_note(path).content
+    for name, make in (('dict', _DictNote), ('slots', ynote.Note),
+                       ('header', lambda d: ynote.Note(d).header(_load_content))):
+        notes = [make(d) for d in json.loads(body)]
+        print '%-16s %7d objs %10.1f bytes/note' % ('memory-' + name, len(notes),
+                float(_size(notes)) / len(notes))
+
+CASES = [
+    ('sign', bench_sign),
+    ('single', bench_single),
+    ('bulk', bench_bulk),
+    ('list', bench_list),
+    ('async', bench_async),
+    ('upload', bench_upload),
+    ('download', bench_download),
+    ('memory', bench_memory),
+]
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [case ...]',
+            description='cases: ' + ', '.join([name for name, fn in CASES]))
+    parser.add_option('-n', '--count', type='int', default=500, help='operations per case')
+    parser.add_option('-w', '--workers', type='int', default=8, help='concurrent requests')
+    parser.add_option('-s', '--size', type='int', default=8, help='MB per upload/download')
+    parser.add_option('-l', '--latency', type='float', default=0.0, help='server latency in ms')
+    parser.add_option('-j', '--jitter', type='float', default=0.0, help='random extra latency in ms')
+    parser.add_option('-f', '--fail-rate', type='float', default=0.0, help='fraction of failed requests')
+    parser.add_option('--server-limit', type='int', help='concurrent requests the server accepts')
+    parser.add_option('-r', '--retries', type='int', default=0, help='retries of a failed request')
+    parser.add_option('--rate', type='float', help='client rate limit in requests per second')
+    parser.add_option('--adaptive', action='store_true', help='adapt the client concurrency')
+    parser.add_option('-z', '--compress', help='server compression: gzip, deflate or raw-deflate')
+    options, args = parser.parse_args()
+
+    cases = dict(CASES)
+    for name in args:
+        if name not in cases:
+            parser.error('unknown case: %s' % name)
+
+    server = FakeServer(latency=options.latency / 1000.0, jitter=options.jitter / 1000.0,
+            fail_rate=options.fail_rate, max_in_flight=options.server_limit,
+            compress=options.compress).start()
+    ynote.BASE_URL = server.base_url
+    client = ynote.YNoteClient(server.consumer_key, server.consumer_secret)
+    if options.retries:
+        client.retry_policy = RetryPolicy(options.retries, backoff=0.01)
+    if options.rate:
+        client.rate_limiter = TokenBucket(options.rate)
+    if options.adaptive:
+        client.concurrency_limiter = AIMDLimiter(options.workers, max_limit=options.workers)
+    client.access_token = server.access_token
+    try:
+        for name, fn in CASES:
+            if not args or name in args:
+                fn(server, client, options)
+        stats = client.pool.stats()
+        if stats['bytes_decoded']:
+            print 'received %d bytes for %d bytes of API responses' % (
+                    stats['bytes_received'], stats['bytes_decoded'])
+    finally:
+        client.pool.close()
+        server.stop()
+
+if __name__ == '__main__':
+    main()
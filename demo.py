@@ -29,7 +29,7 @@ else:
 
 print '\get user info\n---------------------------'
 user = client.get_user()
-print user.__dict__
+print user.to_dict()
 
 print '\nget notebooks\n----------------------------'
 books = client.get_notebooks()
@@ -45,7 +45,7 @@ print 'new_book_path='+bookpath
 
 print '\nget note\n----------------------'
 note = client.get_note(note_paths[0])
-print note.__dict__
+print note.to_dict()
 
 print '\ncreate note\n---------------------'
 new_note = ynote.Note()
@@ -0,0 +1,1192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Tests of the SDK against ynote.fakeserver.
+
+usage: python -m unittest discover -s tests
+'''
+
+import StringIO
+import gc
+import httplib
+import os
+import re
+import tarfile
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import ynote
+from ynote import asyncclient, bulkimport, cache, clientpool, codec, connection, diskcache, fakeserver, instrument, limiter, oauth2, retry, store, sync, uploadcache, writeback
+from ynote.asyncclient import AsyncYNoteClient
+from ynote import export
+from ynote.export import Exporter
+from ynote.fakeserver import FakeServer
+
+
+def _note(path='/book/note', content=u'content'):
+    return ynote.Note({'path':path, 'title':u'title', 'author':u'author', 'source':u'',
+            'size':len(content), 'create_time':1, 'modify_time':2, 'content':content})
+
+def _reachable(obj, skip):
+    '''get the ids of the objects reachable from obj, not going into "skip".'''
+    seen = set()
+    objects = [obj]
+    while objects:
+        obj = objects.pop()
+        if id(obj) in seen or obj is skip:
+            continue
+        seen.add(id(obj))
+        objects.extend(gc.get_referents(obj))
+    return seen
+
+
+class NoteTest(unittest.TestCase):
+
+    def test_header_does_not_keep_content(self):
+        note = _note(content=u'x' * 1024)
+        note.content_hash()
+        loader = lambda path: u'x' * 1024
+        header = note.header(loader)
+        self.assertFalse(id(note.content) in _reachable(header, loader))
+        self.assertFalse(header.is_loaded())
+
+        self.assertEqual(header.content, note.content)
+        self.assertEqual(header.content_hash(), note.content_hash())
+        self.assertEqual(header.changed_fields(), {})
+
+    def test_header_loads_changed_content(self):
+        note = _note()
+        header = note.header(lambda path: u'newer')
+        self.assertEqual(header.content_hash(), _note(content=u'newer').content_hash())
+        self.assertEqual(header.changed_fields(), {'content':u'newer'})
+
+    def test_content_hash_follows_content(self):
+        note = _note()
+        digest = note.content_hash()
+        note.content = u'other'
+        self.assertNotEqual(note.content_hash(), digest)
+        self.assertEqual(note.changed_fields(), {'content':u'other'})
+
+
+class SafeNameTest(unittest.TestCase):
+
+    def test_distinct_paths_get_distinct_names(self):
+        paths = [u'/笔记/1', u'/日记/1', u'/a/b', u'/a_b', u'/a b', u'', u'/']
+        names = [sync._safe_name(p) for p in paths]
+        self.assertEqual(len(set(names)), len(paths))
+        for name in names:
+            self.assertTrue(re.match(r'^[A-Za-z0-9._-]+$', name), name)
+        self.assertEqual(sync._safe_name(u'/a_b'), 'a_b')
+        self.assertEqual(sync._safe_name(u'/笔记/1'), sync._safe_name(u'/笔记/1'.encode('utf-8')))
+
+
+class _Chunked:
+    '''file object that returns "size" bytes at a time, whatever is asked for.'''
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    def read(self, amt=None):
+        data, self.data = self.data[:self.size], self.data[self.size:]
+        return data
+
+
+class CodecTest(unittest.TestCase):
+
+    documents = [
+        '[2.5e3]',
+        '[1, -0.5E-2 ,true,null, 10 ]',
+        '[123456789, 1e10, false]',
+        u'[{"k": [1, 2.0]}, "\u00e9t\u00e9", "笔记", []]'.encode('utf-8'),
+        '[]',
+    ]
+
+    def test_chunk_boundaries(self):
+        for doc in self.documents:
+            expected = json.loads(doc)
+            for size in range(1, len(doc) + 1):
+                self.assertEqual(codec.load_array(_Chunked(doc, size)), expected, (doc, size))
+
+    def test_invalid(self):
+        for doc in ('[1,', '{"a": 1}', '[2.e]'):
+            for size in (1, 3, len(doc)):
+                self.assertRaises(ValueError, codec.load_array, _Chunked(doc, size))
+
+
+class SignerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patched = oauth2._generate_timestamp, oauth2._generate_nonce
+        oauth2._generate_timestamp = lambda: 1400000000
+        oauth2._generate_nonce = lambda: '012345678901234'
+
+    def tearDown(self):
+        oauth2._generate_timestamp, oauth2._generate_nonce = self.patched
+
+    def header_fields(self, header):
+        self.assertTrue(header.startswith('OAuth '))
+        return dict([field.split('=', 1) for field in header[len('OAuth '):].split(', ')])
+
+    def test_same_as_signature_method(self):
+        consumer = oauth2.Consumer('consumer key', u'消费者 secret&')
+        token = oauth2.Token('token/key', 'token secret~+')
+        requests = [
+            (oauth2.HTTP_GET, 'http://example.com/yws/open/user/get.json', {}),
+            (oauth2.HTTP_POST_URLENCODED, 'http://example.com/yws/open/note/get.json?x=1',
+                {'path':'/book/note one', 'title':u'标题 & *', 'tags':['a b', 'c'], 'size':12}),
+            (oauth2.HTTP_POST_MULTIPART, 'https://example.com/yws/open/resource/upload.json',
+                {'file':StringIO.StringIO('data'), 'name':'n'}),
+            (oauth2.HTTP_GET, 'http://example.com/oauth/access_token',
+                {'oauth_verifier':'v 1', 'oauth_callback':'http://cb/?a=b'}),
+        ]
+        for t in (token, None):
+            for request_type, url, params in requests:
+                new = oauth2.RequestBuilder(request_type, url, params)
+                header = oauth2.Signer(consumer, t).sign(new)
+                legacy = oauth2.RequestBuilder(request_type, url, params)
+                legacy._sign(consumer, t)
+                fields = self.header_fields(header)
+                self.assertEqual(fields['oauth_signature'],
+                        '"%s"' % oauth2._escape(legacy['oauth_signature']))
+                self.assertEqual(fields, self.header_fields(legacy._get_auth_header()))
+
+    def test_signer_is_kept_until_the_keys_change(self):
+        consumer = oauth2.Consumer('key', 'secret')
+        token = oauth2.Token('token', 'secret')
+        signer = oauth2.get_signer(consumer, token)
+        self.assertTrue(oauth2.get_signer(consumer, token) is signer)
+        token.secret = 'other'
+        self.assertFalse(oauth2.get_signer(consumer, token) is signer)
+        self.assertTrue(oauth2.get_signer(consumer) is not oauth2.get_signer(consumer, token))
+
+
+class ServerTestCase(unittest.TestCase):
+    '''starts a FakeServer and a client of its access token for each test.'''
+
+    server_options = {}
+
+    def setUp(self):
+        self.base_url = ynote.BASE_URL
+        self.server = FakeServer(**self.server_options).start()
+        ynote.BASE_URL = self.server.base_url
+        self.client = self.new_client()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.client.pool.close()
+        self.server.stop()
+        ynote.BASE_URL = self.base_url
+        shutil.rmtree(self.dir)
+
+    def new_client(self, **kw):
+        client = ynote.YNoteClient(self.server.consumer_key, self.server.consumer_secret, **kw)
+        client.access_token = self.server.access_token
+        return client
+
+
+class ConnectionPoolTest(ServerTestCase):
+
+    def test_reuses_connections(self):
+        for i in range(5):
+            self.client.get_user()
+        stats = self.client.pool.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['idle']), (1, 4, 1))
+
+    def test_retries_on_stale_connection(self):
+        self.client.get_user()
+        # the server drops the connection after the pool found it alive.
+        [(conn, last_used)] = self.client.pool._idle.values()[0]
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        dropped = connection._dropped
+        connection._dropped = lambda conn: False
+        try:
+            self.assertTrue(self.client.get_user().id)
+            path = self.client.create_note_with_attributes(self.server.default_notebook, 'text')
+        finally:
+            connection._dropped = dropped
+        stats = self.client.pool.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (2, 2))
+        self.assertEqual(self.server.requests['yws/open/user/get.json'], 2)
+        self.assertEqual(self.client.get_note_paths(self.server.default_notebook), [path])
+
+    def test_no_duplicate_create_on_timeout(self):
+        book = self.server.default_notebook
+        client = self.new_client(pool=connection.ConnectionPool(timeout=0.3))
+        client.get_user()
+        self.assertEqual(client.pool.stats()['idle'], 1)
+
+        # the create reaches the server on the reused connection, then times out.
+        self.server.latency = 0.5
+        self.assertRaises(socket.timeout, client.create_note_with_attributes, book, 'text')
+        time.sleep(0.5)
+        self.server.latency = 0
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 1)
+        self.assertEqual(len(self.client.get_note_paths(book)), 1)
+        client.pool.close()
+
+
+    def test_dropped_connection(self):
+        class Conn:
+            pass
+        class HighFd:
+            # beyond FD_SETSIZE, which select cannot watch.
+            fileno = lambda self: 1500
+        ours, theirs = socket.socketpair()
+        conn = Conn()
+        try:
+            try:
+                os.dup2(ours.fileno(), 1500)
+            except OSError:
+                self.skipTest('cannot open a descriptor beyond FD_SETSIZE')
+            conn.sock = HighFd()
+            self.assertFalse(connection._dropped(conn))
+            theirs.close()
+            self.assertTrue(connection._dropped(conn))
+            conn.sock = ours
+            self.assertTrue(connection._dropped(conn))
+        finally:
+            ours.close()
+            try:
+                os.close(1500)
+            except OSError:
+                pass
+
+    def test_redirect_loop(self):
+        self.server.fail_next(connection.MAX_REDIRECTS + 1, status=302, endpoint='yws/open/user/get.json')
+        self.assertRaises(connection.RedirectError, self.client.get_user)
+        self.assertEqual(self.server.requests['yws/open/user/get.json'], connection.MAX_REDIRECTS + 1)
+        self.assertTrue(self.client.get_user().id)
+
+    def test_307_sends_body_again(self):
+        self.server.fail_next(1, status=307, endpoint='yws/open/resource/upload.json')
+        resource = self.client.upload_resource(StringIO.StringIO('data'))
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 2)
+        self.assertEqual(self.client.download_resource(resource.url), 'data')
+
+        # a body that cannot be read again is not sent empty.
+        self.server.fail_next(1, status=307, endpoint='yws/open/resource/upload.json')
+        self.assertRaises(connection.RedirectError, self.client.upload_resource,
+                ynote.oauth2.UploadFile(iter(['data']), 4))
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 3)
+
+    def test_async_failed_connect_closes_socket(self):
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret)
+        client.access_token = self.server.access_token
+        try:
+            # a request that cannot be written on the new connection.
+            start = asyncclient._Connection.start
+            asyncclient._Connection.start = lambda conn, job, path: 1 / 0
+            try:
+                self.assertTrue(isinstance(client.get_user().exception(5), ZeroDivisionError))
+            finally:
+                asyncclient._Connection.start = start
+            ynote.BASE_URL = 'http://nonexistent.invalid/'
+            self.assertTrue(isinstance(client.get_user().exception(5), socket.error))
+            conns = [c for c in client._transport.loop.map.values() if isinstance(c, asyncclient._Connection)]
+            self.assertEqual(conns, [])
+        finally:
+            client.close()
+
+    def test_async_redirects(self):
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret)
+        client.access_token = self.server.access_token
+        try:
+            self.server.fail_next(connection.MAX_REDIRECTS + 1, status=302, endpoint='yws/open/user/get.json')
+            self.assertTrue(isinstance(client.get_user().exception(5), connection.RedirectError))
+            self.server.fail_next(1, status=307, endpoint='yws/open/note/create.json')
+            path = client.create_note_with_attributes(self.server.default_notebook, 'text').result(5)
+        finally:
+            client.close()
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 2)
+        self.assertEqual(self.client.get_note_paths(self.server.default_notebook), [path])
+
+
+class UploadTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.data = os.urandom(300000)
+
+    def test_multipart_body(self):
+        body = ynote.oauth2.MultipartBody({'file':StringIO.StringIO(self.data), 'name':u'笔记'}, 'b')
+        first = ''.join(iter(body))
+        self.assertEqual(len(first), len(body))
+        self.assertTrue(self.data in first)
+        self.assertTrue(body.reset())
+        self.assertEqual(body.read(), first)
+
+    def test_upload_streams_file(self):
+        sent = []
+        resource = self.client.upload_resource(ynote.oauth2.UploadFile(_Limited(self.data), len(self.data)),
+                lambda done, total: sent.append((done, total)))
+        self.assertEqual(self.client.download_resource(resource.url), self.data)
+        self.assertTrue(len(sent) > 2)
+        self.assertEqual(sent[-1][0], sent[-1][1])
+
+    def test_upload_rewinds_for_retry(self):
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01))
+        self.server.fail_next(1, status=503, endpoint='yws/open/resource/upload.json')
+        resource = client.upload_resource(StringIO.StringIO(self.data))
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 2)
+        self.assertEqual(client.download_resource(resource.url), self.data)
+        client.pool.close()
+
+    def test_upload_cache(self):
+        self.client.upload_cache = uploadcache.UploadCache()
+        first = self.client.upload_resource(StringIO.StringIO(self.data))
+        again = self.client.upload_resource(StringIO.StringIO(self.data))
+        self.assertEqual(again.url, first.url)
+        other = self.client.upload_resource(StringIO.StringIO(self.data[1:]))
+        self.assertNotEqual(other.url, first.url)
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 2)
+        self.assertEqual((self.client.upload_cache.hits, self.client.upload_cache.misses), (1, 2))
+
+    def test_upload_cache_learns_from_streams(self):
+        self.client.upload_cache = uploadcache.UploadCache()
+        first = self.client.upload_resource(ynote.oauth2.UploadFile(_Limited(self.data), len(self.data)))
+        again = self.client.upload_resource(StringIO.StringIO(self.data))
+        self.assertEqual(again.url, first.url)
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 1)
+
+    def test_upload_cache_checks_old_entries(self):
+        path = os.path.join(self.dir, 'uploads.db')
+        cache = uploadcache.UploadCache(path, max_age=0)
+        self.client.upload_cache = cache
+        first = self.client.upload_resource(StringIO.StringIO(self.data))
+        cache.close()
+        self.client.upload_cache = cache = uploadcache.UploadCache(path, max_age=0)
+        time.sleep(0.01)
+        self.assertEqual(self.client.upload_resource(StringIO.StringIO(self.data)).url, first.url)
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 1)
+        # the resource is gone from the server: upload it again.
+        del self.server._resources[first.url]
+        time.sleep(0.01)
+        again = self.client.upload_resource(StringIO.StringIO(self.data))
+        self.assertNotEqual(again.url, first.url)
+        self.assertEqual(self.client.download_resource(again.url), self.data)
+        self.assertEqual(self.server.requests['yws/open/resource/upload.json'], 2)
+        cache.close()
+
+
+class _Stop(Exception):
+    pass
+
+
+class DownloadTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.data = ''.join([chr(i) for i in range(200)])
+        self.url = self.server.add_resource(self.data)
+        self.dest = os.path.join(self.dir, 'file')
+
+    def write(self, path, data):
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+
+    def read(self, path):
+        return open(path, 'rb').read()
+
+    def interrupt(self, after):
+        """download with 10-byte chunks, stopping once "after" bytes are written."""
+        def progress(done, total):
+            if done >= after:
+                raise _Stop()
+        self.assertRaises(_Stop, self.client.download_resource_to, self.url, self.dest, True, 10, progress)
+        self.assertEqual(self.read(self.dest + '.part'), self.data[:after])
+
+    def downloads(self):
+        return self.server.requests.get('yws/open/resource/download', 0)
+
+    def test_replaces_existing_file(self):
+        for old in ('A' * 100, 'B' * 300):
+            self.write(self.dest, old)
+            self.assertEqual(self.client.download_resource_to(self.url, self.dest), 200)
+            self.assertEqual(self.read(self.dest), self.data)
+        self.assertEqual(os.listdir(self.dir), ['file'])
+
+    def test_resume(self):
+        self.interrupt(50)
+        self.assertEqual(self.client.download_resource_to(self.url, self.dest, resume=True), 200)
+        self.assertEqual(self.read(self.dest), self.data)
+        self.assertEqual(os.listdir(self.dir), ['file'])
+
+    def test_does_not_resume_unknown_part(self):
+        self.write(self.dest + '.part', 'AAAAA')
+        self.assertEqual(self.client.download_resource_to(self.url, self.dest, resume=True), 200)
+        self.assertEqual(self.read(self.dest), self.data)
+
+    def test_resume_complete_part(self):
+        self.interrupt(200)
+        count = self.downloads()
+        self.assertEqual(self.client.download_resource_to(self.url, self.dest, resume=True), 200)
+        self.assertEqual(self.read(self.dest), self.data)
+        # a 416 for the range after the end.
+        self.assertEqual(self.downloads(), count + 1)
+
+    def test_resume_longer_part(self):
+        self.interrupt(200)
+        f = open(self.dest + '.part', 'ab')
+        f.write('C' * 100)
+        f.close()
+        # the 416 gives the real size: the download starts over.
+        self.assertEqual(self.client.download_resource_to(self.url, self.dest, resume=True), 200)
+        self.assertEqual(self.read(self.dest), self.data)
+
+    def test_retried_through_limiters_and_hooks(self):
+        acquired = []
+        bucket = limiter.TokenBucket(rate=1000)
+        acquire = bucket.acquire
+        bucket.acquire = lambda: acquired.append(acquire())
+        events = []
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01), rate_limiter=bucket)
+        client.add_hook(events.append)
+        self.server.fail_next(1, status=503, endpoint='yws/open/resource/download')
+        self.assertEqual(client.download_resource_to(self.url, self.dest), 200)
+        self.assertEqual(''.join(client.iter_resource(self.url, 150, 30)), self.data[150:])
+        self.assertEqual(self.read(self.dest), self.data)
+        self.assertEqual(self.downloads(), 3)
+        self.assertEqual([(e.status, e.retries) for e in events], [(200, 1), (206, 0)])
+        self.assertEqual(len(acquired), 3)
+        client.pool.close()
+
+    def test_not_retried_after_first_byte(self):
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01))
+        def progress(done, total):
+            raise socket.error('broken')
+        self.assertRaises(socket.error, client.download_resource_to, self.url, self.dest, False, 10, progress)
+        self.assertEqual(self.downloads(), 1)
+        client.pool.close()
+
+    def test_resume_changed_resource(self):
+        self.interrupt(50)
+        self.data = 'D' * 120
+        self.server._resources[self.url] = self.data
+        # the range is ignored for another version of the resource.
+        self.assertEqual(self.client.download_resource_to(self.url, self.dest, resume=True), 120)
+        self.assertEqual(self.read(self.dest), self.data)
+
+
+class ResourceCacheTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.cache = diskcache.ResourceCache(os.path.join(self.dir, 'resources'), max_bytes=250)
+        self.client.resource_cache = self.cache
+        self.data = [os.urandom(100) for i in range(3)]
+        self.urls = [self.server.add_resource(data) for data in self.data]
+
+    def download(self, i):
+        # the file times order the cache, keep them apart.
+        time.sleep(0.01)
+        self.assertEqual(self.client.download_resource(self.urls[i]), self.data[i])
+
+    def test_hits_and_evictions(self):
+        self.download(0)
+        self.download(1)
+        self.download(0)
+        self.assertEqual(self.server.requests['yws/open/resource/download'], 2)
+        # the least recently used resource makes room for the third.
+        self.download(2)
+        self.assertEqual(self.cache.stats(), {'hits':1, 'misses':3, 'evictions':1, 'bytes':200})
+        self.assertEqual(self.cache.path(self.urls[1]), None)
+        self.download(0)
+        self.download(1)
+        self.assertEqual(self.server.requests['yws/open/resource/download'], 4)
+
+    def test_shared_directory(self):
+        self.download(0)
+        other = diskcache.ResourceCache(self.cache.directory, max_bytes=250)
+        self.assertEqual(other.stats()['bytes'], 100)
+        view = other.open(self.urls[0])
+        try:
+            self.assertEqual(view[:], self.data[0])
+        finally:
+            view.close()
+        other.put('empty', '')
+        self.assertEqual(self.cache.open('empty'), '')
+        self.assertEqual(self.cache.open('missing'), None)
+
+
+class InstrumentTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.collector = instrument.HistogramCollector()
+        self.client.add_hook(self.collector)
+
+    def test_collects_requests(self):
+        for i in range(3):
+            self.client.get_user()
+        self.assertRaises(ynote.YNoteError, self.client.get_note, self.server.default_notebook + '/missing')
+        summary = self.collector.summary()
+        self.assertEqual(sorted(summary['yws/open/user/get.json'].keys()), sorted(instrument.PHASES))
+        self.assertEqual(summary['yws/open/user/get.json']['total']['count'], 3)
+        self.assertEqual(summary['yws/open/note/get.json']['total']['count'], 1)
+        self.assertTrue(self.collector.percentile('yws/open/user/get.json', 'total', 99) > 0)
+        self.assertEqual(self.collector.percentile('yws/open/user/get.json', 'nothing', 99), None)
+
+        text = self.collector.to_prometheus()
+        self.assertTrue('ynote_requests_total{endpoint="yws/open/user/get.json",status="200"} 3\n' in text)
+        self.assertTrue('ynote_requests_total{endpoint="yws/open/note/get.json",status="500"} 1\n' in text)
+        self.assertTrue('ynote_request_errors_total{endpoint="yws/open/note/get.json"} 1\n' in text)
+        self.assertTrue('ynote_request_seconds_count{endpoint="yws/open/user/get.json",phase="total"} 3\n' in text)
+
+        self.collector.reset()
+        self.assertEqual(self.collector.summary(), {})
+
+    def test_histogram_buckets(self):
+        hist = instrument._Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            hist.observe(value)
+        self.assertEqual(hist.counts, [1, 2, 1])
+        self.assertEqual((hist.percentile(25), hist.percentile(50), hist.percentile(100)), (0.1, 1.0, float('inf')))
+
+
+class RetryTest(ServerTestCase):
+
+    def test_should_retry(self):
+        policy = retry.RetryPolicy(max_retries=2)
+        for status in (429, 503):
+            error = ynote.YNoteError('HTTP_ERROR', status, '')
+            self.assertTrue(policy.should_retry(error, 0, idempotent=False))
+            self.assertFalse(policy.should_retry(error, 2))
+        for error in (ynote.YNoteError('HTTP_ERROR', 502, ''), socket.error(104, 'reset')):
+            self.assertTrue(policy.should_retry(error, 1))
+            self.assertFalse(policy.should_retry(error, 1, idempotent=False))
+        self.assertFalse(policy.should_retry(ynote.YNoteError('API_ERROR', 223, 'no note'), 0))
+
+    def test_delay(self):
+        policy = retry.RetryPolicy(backoff=0.1, max_backoff=0.3, jitter=False)
+        self.assertEqual([policy.delay(n) for n in range(3)], [0.1, 0.2, 0.3])
+        self.assertEqual((policy.delay(0, retry_after=0.25), policy.delay(0, retry_after=60)), (0.25, 0.3))
+
+    def test_reads_are_retried(self):
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01))
+        path = self.server.add_note(self.server.default_notebook, 'note')
+        self.server.fail_next(2, status=502, endpoint='yws/open/note/get.json')
+        self.assertEqual(client.get_note(path).content, 'note')
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 3)
+        client.pool.close()
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01))
+        book = self.server.default_notebook
+        self.server.fail_next(1, status=502, endpoint='yws/open/note/create.json')
+        try:
+            client.create_note_with_attributes(book, 'note')
+        except ynote.YNoteError, e:
+            self.assertEqual(e.error_code, 502)
+        else:
+            self.fail('the gateway error was hidden')
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 1)
+        # a refused request was not handled, so it is sent again.
+        self.server.fail_next(1, status=503, endpoint='yws/open/note/create.json')
+        client.create_note_with_attributes(book, 'note')
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 3)
+        self.assertEqual(len(client.get_note_paths(book)), 1)
+        client.pool.close()
+
+    def test_token_bucket(self):
+        bucket = limiter.TokenBucket(rate=20, burst=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        start = time.time()
+        for i in range(3):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.12)
+
+    def test_429_lowers_aimd_limit(self):
+        aimd = limiter.AIMDLimiter(initial=8)
+        client = self.new_client(retry_policy=retry.RetryPolicy(backoff=0.01), concurrency_limiter=aimd)
+        self.server.fail_next(1, status=429)
+        client.get_user()
+        # halved by the 429, then a little higher after the retry went through.
+        self.assertEqual((aimd.limit, aimd.decreases, aimd.in_flight), (4.25, 1, 0))
+        client.pool.close()
+
+    def test_aimd_limits_concurrency(self):
+        aimd = limiter.AIMDLimiter(initial=2)
+        aimd.acquire()
+        aimd.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (aimd.acquire(), acquired.set()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        aimd.release(0.01)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        aimd.release(0.01)
+        aimd.release(0.01)
+        self.assertEqual(aimd.decreases, 0)
+        # latency far above the lowest seen is congestion.
+        aimd.acquire()
+        aimd.release(1.0)
+        self.assertEqual(aimd.decreases, 1)
+        self.assertTrue(aimd.limit < 2)
+
+
+class DecodingTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.content = 'compressible ' * 10000
+        self.path = self.server.add_note(self.server.default_notebook, self.content)
+
+    def test_decoding_response(self):
+        body = os.urandom(1000) + 'x' * 100000
+        for encoding in ('gzip', 'deflate', 'raw-deflate'):
+            claimed = encoding.split('-')[-1]
+            resp = connection.DecodingResponse(StringIO.StringIO(fakeserver._compress(body, encoding)), claimed)
+            chunks = iter(lambda: resp.read(7000), '')
+            self.assertEqual(''.join(chunks), body)
+            self.assertTrue(resp.compressed_bytes < resp.decoded_bytes == len(body))
+            self.assertEqual(connection.decode_body(fakeserver._compress(body, encoding), claimed), body)
+        # a body that is not compressed after all is passed through.
+        self.assertEqual(connection.DecodingResponse(StringIO.StringIO(body), 'gzip').read(), body)
+        self.assertEqual(connection.decode_body(body, None), body)
+
+    def test_compressed_responses(self):
+        events = []
+        self.client.add_hook(events.append)
+        for encoding in ('gzip', 'deflate', 'raw-deflate'):
+            self.server.compress = encoding
+            self.assertEqual(self.client.get_note(self.path).content, self.content)
+            self.assertEqual(self.client.get_note_paths(self.server.default_notebook), [self.path])
+        self.assertEqual(len(events), 6)
+        for event in events[::2]:
+            self.assertTrue(event.bytes_received * 10 < event.bytes_decoded)
+
+    def test_async_compressed_responses(self):
+        self.server.compress = 'gzip'
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret)
+        client.access_token = self.server.access_token
+        try:
+            self.assertEqual(client.get_note(self.path).result(5).content, self.content)
+        finally:
+            client.close()
+
+
+class SingleFlightTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.path = self.server.add_note(self.server.default_notebook, 'content', title='title')
+        self.server.latency = 0.3
+
+    def test_coalesced_callers_get_own_notes(self):
+        notes = []
+        def get():
+            note = self.client.get_note(self.path)
+            notes.append(note)
+            note.title = u'changed %d' % len(notes)
+        threads = [threading.Thread(target=get) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 1)
+        self.assertEqual(self.client.single_flight.coalesced, 3)
+        self.assertEqual(len(set(map(id, notes))), 4)
+        self.assertEqual(sorted([n.title for n in notes]), [u'changed %d' % i for i in range(1, 5)])
+        for note in notes:
+            self.assertEqual(note.changed_fields(), {'title':note.title})
+
+    def test_async_coalesced_callers_get_own_notes(self):
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret)
+        client.access_token = self.server.access_token
+        try:
+            futures = [client.get_note(self.path) for i in range(3)]
+            notes = [f.result(5) for f in futures]
+        finally:
+            client.close()
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 1)
+        self.assertEqual(len(set(map(id, notes))), 3)
+        notes[0].content = u'changed'
+        self.assertEqual([n.content for n in notes[1:]], ['content', 'content'])
+
+
+class ClientPoolTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.clients = clientpool.ClientPool(self.server.consumer_key, self.server.consumer_secret,
+                max_in_flight=4)
+        self.tokens = [self.server.access_token, self.server.issue_access_token()]
+        self.accounts = [self.clients.client(t.key, t.secret) for t in self.tokens]
+
+    def tearDown(self):
+        self.clients.close()
+        ServerTestCase.tearDown(self)
+
+    def test_account_hooks(self):
+        shared, own = [], []
+        self.clients.add_hook(shared.append)
+        self.accounts[0].add_hook(own.append)
+        for account in self.accounts:
+            account.get_user()
+        self.assertEqual(len(shared), 2)
+        self.assertEqual(len(own), 1)
+        self.assertEqual(self.accounts[1].hooks, [])
+
+    def test_download_holds_account_slot(self):
+        url = self.server.add_resource('x' * 100)
+        running = []
+        def progress(done, total):
+            running.append(self.clients.scheduler._running.get(self.tokens[0].key))
+        path = os.path.join(self.dir, 'file')
+        self.assertEqual(self.accounts[0].download_resource_to(url, path, chunk_size=10, progress=progress), 100)
+        self.assertEqual(running, [1] * 10)
+        self.assertEqual(self.clients.scheduler.in_flight, 0)
+
+    def test_scheduler_takes_tenants_in_turn(self):
+        scheduler = limiter.FairScheduler(limit=1)
+        scheduler.acquire('a')
+        order = []
+        def run(tenant):
+            scheduler.acquire(tenant)
+            order.append(tenant)
+            scheduler.release(tenant)
+        threads = []
+        for i, tenant in enumerate('aaab'):
+            thread = threading.Thread(target=run, args=(tenant,))
+            thread.start()
+            threads.append(thread)
+            while sum(scheduler.waiting().values()) <= i:
+                time.sleep(0.001)
+        self.assertEqual(scheduler.waiting(), {'a':3, 'b':1})
+        scheduler.release('a')
+        for thread in threads:
+            thread.join()
+        # "b" does not wait behind all of "a".
+        self.assertEqual(order, ['a', 'b', 'a', 'a'])
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_scheduler_tenant_limit(self):
+        scheduler = limiter.FairScheduler(limit=4, tenant_limit=1)
+        scheduler.acquire('a')
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (scheduler.acquire('a'), acquired.set()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        scheduler.acquire('b')
+        self.assertEqual((scheduler.in_flight, scheduler.waiting()), (2, {'a':1}))
+        scheduler.release('a')
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        scheduler.release('a')
+        scheduler.release('b')
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_accounts_share_connections(self):
+        for i in range(3):
+            for account in self.accounts:
+                account.get_user()
+        stats = self.clients.pool.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 5))
+
+
+class AsyncClientTest(ServerTestCase):
+
+    # more requests at a time are answered with 429.
+    server_options = {'max_in_flight':2, 'latency':0.05}
+
+    def new_async_client(self, **kw):
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret, **kw)
+        client.access_token = self.server.access_token
+        return client
+
+    def test_bounded_in_flight(self):
+        book = self.server.default_notebook
+        paths = [self.server.add_note(book, 'note %d' % i) for i in range(10)]
+        client = self.new_async_client(max_in_flight=2, coalesce=False)
+        try:
+            notes = [f.result(5) for f in [client.get_note(p) for p in paths]]
+        finally:
+            client.close()
+        self.assertEqual([n.content for n in notes], ['note %d' % i for i in range(10)])
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 10)
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        client = self.new_async_client(timeout=0.1)
+        try:
+            start = time.time()
+            self.assertTrue(isinstance(client.get_user().exception(5), socket.timeout))
+            self.assertTrue(time.time() - start < 0.4)
+        finally:
+            client.close()
+
+
+class NotesTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.books = [self.server.default_notebook, self.server.add_notebook('other')]
+        self.paths = [self.server.add_note(book, '%s %d' % (book, i)) for book in self.books for i in range(5)]
+
+    def test_get_notes(self):
+        paths = self.paths + [self.books[0] + '/missing']
+        results = list(self.client.get_notes(paths, max_workers=3))
+        self.assertEqual([path for path, note, error in results], paths)
+        self.assertEqual([note.path for path, note, error in results[:-1]], self.paths)
+        self.assertEqual([error for path, note, error in results[:-1]], [None] * len(self.paths))
+        path, note, error = results[-1]
+        self.assertEqual(note, None)
+        self.assertTrue(isinstance(error, ynote.YNoteError))
+
+        unordered = list(self.client.get_notes(self.paths, ordered=False))
+        self.assertEqual(sorted([note.path for path, note, error in unordered]), sorted(self.paths))
+
+    def test_iter_all_notes(self):
+        notes = list(self.client.iter_all_notes(prefetch=2))
+        self.assertEqual(sorted([note.path for note in notes]), sorted(self.paths))
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], len(self.paths))
+
+
+class MetadataCacheTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.book = self.server.default_notebook
+        self.paths = [self.server.add_note(self.book, 'note %d' % i) for i in range(3)]
+        self.client.cache = cache.MetadataCache(ttl=0.2)
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        self.assertEqual(lru.set('c', 3), [('b', 2)])
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_hits(self):
+        self.client.get_note_paths(self.book)
+        note = self.client.get_note(self.paths[0])
+        note.content = 'changed by the caller'
+        self.assertEqual(self.client.get_note(self.paths[0]).content, 'note 0')
+        self.assertEqual(self.client.get_note_paths(self.book), self.paths)
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 1)
+        self.assertEqual(self.server.requests['yws/open/notebook/list.json'], 1)
+
+    def test_revalidates_with_notebooks(self):
+        self.client.get_notebooks()
+        self.client.get_note_paths(self.book)
+        self.client.get_note(self.paths[0])
+        time.sleep(0.3)
+        # one notebook list shows the notebook did not change.
+        self.assertEqual(self.client.get_note(self.paths[0]).content, 'note 0')
+        self.assertEqual(self.client.get_note_paths(self.book), self.paths)
+        self.assertEqual(self.server.requests['yws/open/notebook/all.json'], 2)
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 1)
+        self.assertEqual(self.client.cache.stats()['revalidations'], 2)
+
+    def test_modified_notebook_is_fetched_again(self):
+        self.client.get_notebooks()
+        self.client.get_note_paths(self.book)
+        self.client.get_note(self.paths[0])
+        time.sleep(0.3)
+        path = self.server.add_note(self.book, 'new note')
+        self.client.get_note(self.paths[0])
+        self.assertEqual(self.client.get_note_paths(self.book), self.paths + [path])
+        self.assertEqual(self.server.requests['yws/open/note/get.json'], 2)
+        self.assertEqual(self.server.requests['yws/open/notebook/list.json'], 2)
+
+    def test_writes_invalidate(self):
+        note = self.client.get_note(self.paths[0])
+        note.content = 'updated'
+        self.client.update_note(note)
+        self.assertEqual(self.client.get_note(self.paths[0]).content, 'updated')
+        self.client.get_note_paths(self.book)
+        path = self.client.create_note(self.book, ynote.Note())
+        self.assertEqual(self.client.get_note_paths(self.book), self.paths + [path])
+
+
+class UpdateNoteTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.path = self.server.add_note(self.server.default_notebook, 'old content', title='old')
+
+    def test_async_sends_changed_fields(self):
+        client = AsyncYNoteClient(self.server.consumer_key, self.server.consumer_secret)
+        client.access_token = self.server.access_token
+        try:
+            note = client.get_note(self.path).result(5)
+            note.title = u'new'
+            # a change on the server that a full update would overwrite.
+            self.client.update_note_attributes(self.path, content='newer content')
+            self.assertEqual(client.update_note(note).result(5), True)
+            self.assertEqual(client.update_note(note).result(5), False)
+        finally:
+            client.close()
+        note = self.client.get_note(self.path)
+        self.assertEqual((note.title, note.content), ('new', 'newer content'))
+
+    def test_write_queue_keeps_failed_changes(self):
+        queue = writeback.WriteQueue(self.client, delay=0)
+        note = self.client.get_note(self.path)
+        note.title = u'new'
+        self.server.fail_next(1, status=500, endpoint='yws/open/note/update.json')
+        future = queue.update_note(note)
+        self.assertTrue(queue.flush(5))
+        self.assertTrue(isinstance(future.exception(), ynote.YNoteError))
+        self.assertEqual(note.changed_fields(), {'title':u'new'})
+
+        future = queue.update_note(note)
+        note.author = u'someone'
+        queue.close(5)
+        self.assertEqual(future.exception(), None)
+        self.assertEqual(note.changed_fields(), {'author':u'someone'})
+        self.assertEqual(self.client.get_note(self.path).title, 'new')
+
+
+class ResourcesTest(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.urls = [self.server.add_resource('data %d' % i) for i in range(3)]
+        content = ''.join([ynote.Resource({'url':url}).to_resource_tag() for url in self.urls])
+        self.path = self.server.add_note(self.server.default_notebook, content)
+
+        # one download breaks with an error that is not a YNoteError.
+        download_resource_to = self.client.download_resource_to
+        def broken(url, dest, *args, **kw):
+            if url == self.urls[1]:
+                raise httplib.IncompleteRead('partial')
+            return download_resource_to(url, dest, *args, **kw)
+        self.client.download_resource_to = broken
+
+    def test_get_note_with_resources(self):
+        note, files, errors = self.client.get_note_with_resources(self.path, self.dir)
+        self.assertEqual(files.keys(), [self.urls[0], self.urls[2]])
+        self.assertEqual(open(files[self.urls[2]], 'rb').read(), 'data 2')
+        self.assertEqual(errors.keys(), [self.urls[1]])
+        self.assertTrue(isinstance(errors[self.urls[1]], httplib.IncompleteRead))
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted([os.path.basename(f) for f in files.values()]))
+
+    def test_mirror(self):
+        mirror = sync.Mirror(self.client, self.dir)
+        stats = mirror.run()
+        self.assertEqual(stats['errors'].keys(), [self.urls[1]])
+        self.assertEqual((stats['notes_written'], stats['resources_downloaded']), (1, 2))
+        self.assertEqual(stats['notebooks_synced'], 0)
+
+        # the next run fetches only what is missing.
+        del self.client.download_resource_to
+        stats = sync.Mirror(self.client, self.dir).run()
+        self.assertEqual(stats['errors'], {})
+        self.assertEqual((stats['notes_written'], stats['resources_downloaded']), (0, 1))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, 'resources'))),
+                sorted([ynote._resource_name(url) for url in self.urls]))
+
+    def test_mirror_renames_old_files(self):
+        del self.client.download_resource_to
+        book = self.server.default_notebook
+        sync.Mirror(self.client, self.dir).run()
+
+        # a mirror made when the note had another file name.
+        mirror = sync.Mirror(self.client, self.dir)
+        entry = mirror.manifest['notebooks'][book]
+        note_entry = entry['notes'][self.path]
+        new_file = note_entry['file']
+        os.makedirs(os.path.join(self.dir, 'old'))
+        os.rename(os.path.join(self.dir, new_file), os.path.join(self.dir, 'old', 'note.json'))
+        entry['dir'], note_entry['file'] = 'old', os.path.join('old', 'note.json')
+        del entry['stamp']
+
+        stats = mirror.run()
+        self.assertEqual(stats['notes_written'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, new_file)))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'old')))
+
+    def test_export(self):
+        out = StringIO.StringIO()
+        stats = Exporter(self.client).export(out)
+        self.assertEqual((stats['notes'], stats['resources']), (1, 2))
+        self.assertEqual(stats['errors'].keys(), [self.urls[1]])
+        archive = tarfile.open(fileobj=StringIO.StringIO(out.getvalue()))
+        manifest = json.loads(archive.extractfile('manifest.json').read())
+        self.assertEqual(sorted(manifest['resources'].keys()), sorted([self.urls[0], self.urls[2]]))
+        self.assertEqual(archive.extractfile(manifest['resources'][self.urls[0]]).read(), 'data 0')
+
+
+class _Limited:
+    '''file object that refuses to be read in one piece.'''
+
+    def __init__(self, data):
+        self.f = StringIO.StringIO(data)
+
+    def read(self, size=-1):
+        assert 0 < size <= 64 * 1024, size
+        return self.f.read(size)
+
+
+class ZipWriterTest(unittest.TestCase):
+
+    def test_members_are_streamed(self):
+        members = [('a.json', '{"k": "%s"}' % ('v' * 100000)), ('resources/b', os.urandom(200000)),
+                ('empty', '')]
+        out = StringIO.StringIO()
+        archive = export._ZipWriter(out)
+        for name, data in members:
+            archive.add(name, _Limited(data), len(data))
+        archive.close()
+
+        z = zipfile.ZipFile(StringIO.StringIO(out.getvalue()))
+        self.assertEqual(z.testzip(), None)
+        self.assertEqual([(i.filename, i.compress_type) for i in z.infolist()],
+                [('a.json', zipfile.ZIP_DEFLATED), ('resources/b', zipfile.ZIP_STORED), ('empty', zipfile.ZIP_STORED)])
+        for name, data in members:
+            self.assertEqual(z.read(name), data)
+
+
+class NoteStoreTest(ServerTestCase):
+
+    def test_list_notes_after_fetch(self):
+        book = self.server.add_notebook('book')
+        paths = [self.server.add_note(book, 'note %d' % i, title='t%d' % i) for i in range(3)]
+        notes = store.NoteStore()
+        client = self.new_client(store=notes)
+        fetched, errors = client.get_notebook_contents(book)
+        self.assertEqual((len(fetched), errors), (3, {}))
+        self.assertEqual(sorted([n.path for n in notes.list_notes(book)]), sorted(paths))
+        self.assertEqual(sorted([n.path for n in notes.search('note')]), sorted(paths))
+
+        client.delete_notebook(book)
+        self.assertEqual(notes.list_notes(book), [])
+        self.assertEqual([notes.get_note(p) for p in paths], [None] * 3)
+        client.pool.close()
+
+
+class _Unanswered:
+    '''client whose creates reach the server but whose answers are lost.'''
+
+    def __init__(self, client):
+        self.client = client
+
+    def create_note_with_attributes(self, book_path, content, **kw):
+        self.client.create_note_with_attributes(book_path, content, **kw)
+        raise socket.timeout('timed out')
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class ImporterTest(ServerTestCase):
+
+    def test_recover_notes_with_same_content(self):
+        book = self.server.default_notebook
+        checkpoint = os.path.join(self.dir, 'checkpoint')
+        specs = [{'id':'a', 'content':'same'}, {'id':'b', 'content':'same'}, {'id':'c', 'content':'other'}]
+        importer = bulkimport.Importer(_Unanswered(self.client), checkpoint, book)
+        stats = importer.run(specs)
+        importer.close()
+        self.assertEqual(sorted(stats['errors'].keys()), ['a', 'b', 'c'])
+
+        importer = bulkimport.Importer(self.client, checkpoint, book)
+        stats = importer.run(specs)
+        importer.close()
+        self.assertEqual((stats['notes_recovered'], stats['notes_created'], stats['errors']), (3, 0, {}))
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 3)
+        self.assertEqual(len(self.client.get_note_paths(book)), 3)
+
+
+class _Hung:
+    '''client whose creates never return, as if the process stopped while sending.'''
+
+    def __init__(self, client, sent):
+        self.client = client
+        self.sent = sent
+        self.event = threading.Event()
+
+    def create_note_with_attributes(self, book_path, content, **kw):
+        if content in self.sent:
+            self.client.create_note_with_attributes(book_path, content, **kw)
+        self.event.wait()
+        raise RuntimeError('stopped')
+
+
+def _abandon(queue):
+    '''stop the thread of a queue without sending what it holds, as a crash would.'''
+    queue._cond.acquire()
+    try:
+        queue._closed = True
+        queue._cond.notify_all()
+    finally:
+        queue._cond.release()
+    queue._thread.join()
+    queue._pool.shutdown(wait=False)
+    queue._journal.close()
+
+
+class WriteQueueTest(ServerTestCase):
+
+    def test_journal_replay(self):
+        book = self.server.default_notebook
+        path = self.server.add_note(book, 'old', title='old')
+        journal = os.path.join(self.dir, 'journal')
+
+        # a queue that stops before it sends anything.
+        crashed = writeback.WriteQueue(self.client, journal, delay=3600)
+        crashed.create_note_with_attributes(book, 'new', title='new')
+        crashed.update_note_attributes(path, title='first')
+        crashed.update_note_attributes(path, content='second')
+        self.assertEqual(self.server.requests.get('yws/open/note/create.json'), None)
+        _abandon(crashed)
+
+        queue = writeback.WriteQueue(self.client, journal, delay=0)
+        self.assertEqual(queue.pending(), 2)
+        self.assertTrue(queue.close(5))
+
+        note = self.client.get_note(path)
+        self.assertEqual((note.title, note.content), ('first', 'second'))
+        titles = [self.client.get_note(p).title for p in self.client.get_note_paths(book)]
+        self.assertEqual(sorted(titles), ['first', 'new'])
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 1)
+
+        # nothing is sent again by the next queue.
+        queue = writeback.WriteQueue(self.client, journal, delay=0)
+        self.assertEqual(queue.pending(), 0)
+        queue.close()
+
+    def test_journal_replay_of_started_creates(self):
+        book = self.server.default_notebook
+        journal = os.path.join(self.dir, 'journal')
+        hung = _Hung(self.client, ['sent'])
+        crashed = writeback.WriteQueue(hung, journal, delay=0)
+        try:
+            for content in ('sent', 'lost'):
+                crashed.create_note_with_attributes(book, content, title='title')
+            deadline = time.time() + 5
+            while self.server.requests.get('yws/open/note/create.json') != 1 and time.time() < deadline:
+                time.sleep(0.01)
+
+            queue = writeback.WriteQueue(self.client, journal, delay=0)
+            self.assertEqual(queue.pending(), 2)
+            self.assertTrue(queue.close(5))
+        finally:
+            hung.event.set()
+            crashed.close(5)
+        self.assertEqual((queue.recovered, queue.sent, queue.errors), (1, 1, 0))
+        self.assertEqual(self.server.requests['yws/open/note/create.json'], 2)
+        contents = [self.client.get_note(p).content for p in self.client.get_note_paths(book)]
+        self.assertEqual(sorted(contents), ['lost', 'sent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
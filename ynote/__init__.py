@@ -8,16 +8,14 @@ __author__ = "Li Chuan (daniellee0219@gmail.com)"
 Python client SDK for Youdao Note API using OAuth 2.
 '''
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
-import urllib2, oauth2, time
+import urllib2, oauth2, time, os, collections, re, hashlib
+import connection, futures, cache, instrument, retry, limiter, codec
 
 ENCODING = 'utf-8'
 BASE_URL = 'http://sandbox.note.youdao.com/'
 OPTIONAL_BASE_URL = 'http://note.youdao.com/'
+# ask for compressed API responses.
+COMPRESS = True
 
 def _fix_url(url):
     if url.startswith(BASE_URL):
@@ -26,9 +24,58 @@ def _fix_url(url):
         return url.replace(OPTIONAL_BASE_URL, BASE_URL)
 
 
-class User:
+# strings held by many objects, such as notebook paths, are shared through
+# this table. It stops growing at _INTERN_LIMIT entries.
+_interned = {}
+_INTERN_LIMIT = 10000
+
+def _intern(s):
+    '''get the shared copy of a string.'''
+    shared = _interned.get(s)
+    if shared is not None:
+        return shared
+    if len(_interned) < _INTERN_LIMIT:
+        _interned[s] = s
+    return s
+
+
+class _Model(object):
+    '''base of the model classes, which keep their fields in __slots__.'''
+
+    __slots__ = ()
+
+    # public fields, in order.
+    _fields = ()
+
+    def to_dict(self):
+        '''get the fields as a dictionary.'''
+        return dict([(k, getattr(self, k)) for k in self._fields])
+
+    def copy(self):
+        '''get a copy that can be changed without changing this object.'''
+        other = self.__class__.__new__(self.__class__)
+        for cls in self.__class__.__mro__:
+            for k in getattr(cls, '__slots__', ()):
+                if hasattr(self, k):
+                    setattr(other, k, getattr(self, k))
+        return other
+
+
+def _copy_result(result):
+    '''copy the models in a result shared by coalesced reads, for each caller.'''
+    if isinstance(result, _Model):
+        return result.copy()
+    if isinstance(result, list):
+        return [_copy_result(x) for x in result]
+    return result
+
+
+class User(_Model):
     """User class that represents a ynote user."""
 
+    __slots__ = _fields = ('id', 'user_name', 'total_size', 'used_size', 'register_time',
+            'last_login_time', 'last_modify_time', 'default_notebook')
+
     def __init__(self, json_dict=None):
         '''init with the data from a dictionary.'''
         if json_dict:
@@ -39,7 +86,7 @@ class User:
             self.register_time = int(json_dict['register_time'])
             self.last_login_time = int(json_dict['last_login_time'])
             self.last_modify_time = int(json_dict['last_modify_time'])
-            self.default_notebook = json_dict['default_notebook']
+            self.default_notebook = _intern(json_dict['default_notebook'])
         else:
             self.id = ""
             self.user_name = ""
@@ -51,13 +98,15 @@ class User:
             self.default_notebook = ""
 
 
-class Notebook:
+class Notebook(_Model):
     """Notebook class that represents a ynote notebook."""
 
+    __slots__ = _fields = ('path', 'name', 'notes_num', 'create_time', 'modify_time')
+
     def __init__(self, json_dict=None):
         '''init with the data from a dictionary.'''
         if json_dict:
-            self.path = json_dict['path']
+            self.path = _intern(json_dict['path'])
             self.name = json_dict['name']
             self.notes_num = int(json_dict['notes_num'])
             self.create_time = int(json_dict['create_time'])
@@ -70,20 +119,37 @@ class Notebook:
             self.modify_time = 0
     
 
-class Note:
-    """Note class that represents a ynote note."""
+def _content_hash(content):
+    '''get the sha1 hex digest of note content.'''
+    data = content.encode('utf-8') if isinstance(content, unicode) else content or ''
+    return hashlib.sha1(data).hexdigest()
+
+
+class Note(_Model):
+    """
+    Note class that represents a ynote note. A note header is a Note
+    whose content is loaded only when it is first used.
+    """
+
+    __slots__ = ('path', 'title', 'author', 'source', 'size', 'create_time', 'modify_time',
+            '_content', '_loader', '_content_digest', '_saved')
+    _fields = ('path', 'title', 'author', 'source', 'size', 'create_time', 'modify_time', 'content')
     
-    def __init__(self, json_dict=None):
-        '''init with the data from a dictionary.'''
+    def __init__(self, json_dict=None, loader=None):
+        '''
+        init with the data from a dictionary. If it has no content, the
+        note is a header and loader(path) is called to get the content when
+        it is first used.
+        '''
         if json_dict:
             self.path = json_dict['path']
             self.title = json_dict['title']
-            self.author = json_dict['author']
+            self.author = _intern(json_dict['author'])
             self.source = json_dict['source']
             self.size = int(json_dict['size'])
             self.create_time = int(json_dict['create_time'])
             self.modify_time = int(json_dict['modify_time'])
-            self.content = json_dict['content']
+            self._content = json_dict.get('content')
         else:
             self.path = ""
             self.title = ""
@@ -92,12 +158,102 @@ class Note:
             self.size = 0
             self.create_time = -1
             self.modify_time = -1
-            self.content = ""
-           
+            self._content = ""
+        self._loader = loader
+        self._content_digest = None
+        if json_dict:
+            self.mark_clean()
+        else:
+            # a note made locally: every field counts as changed.
+            self._saved = None
+
+    def _get_content(self):
+        if self._content is None:
+            if self._loader is None:
+                return ""
+            self._content = self._loader(self.path)
+            self._loader = None
+            if self._saved is not None and self._saved[3] is None:
+                # the loaded content is the saved one.
+                self._saved = self._saved[:3] + (self.content_hash(),)
+        return self._content
+
+    def _set_content(self, content):
+        self._content = content
+        self._loader = None
+        self._content_digest = None
 
-class Resource:
+    content = property(_get_content, _set_content)
+
+    def is_loaded(self):
+        '''return False for a header whose content has not been loaded.'''
+        return self._content is not None
+
+    def header(self, loader=None):
+        '''
+        get a copy of the note without its content, which is loaded with
+        loader(path) when it is first used.
+        '''
+        header = Note.__new__(Note)
+        for k in ('path', 'title', 'author', 'source', 'size', 'create_time', 'modify_time', '_saved'):
+            setattr(header, k, getattr(self, k))
+        # the loaded content may differ, so its digest is computed again.
+        header._content = None
+        header._content_digest = None
+        header._loader = loader
+        return header
+
+    def content_hash(self):
+        '''get the sha1 hex digest of the content.'''
+        if self._content_digest is None:
+            # only the digest is kept: setting the content clears it.
+            self._content_digest = _content_hash(self.content)
+        return self._content_digest
+
+    def mark_clean(self, fields=None):
+        '''
+        take the current fields as saved, so they no longer count as
+        changed. If "fields" is given, a dictionary from changed_fields
+        that has been sent, only the values in it are taken as saved, so
+        changes made since then still count.
+        '''
+        if fields is None:
+            digest = self.content_hash() if self.is_loaded() else None
+            self._saved = (self.source, self.author, self.title, digest)
+            return
+        saved = list(self._saved or (None, None, None, None))
+        for i, name in enumerate(('source', 'author', 'title')):
+            if name in fields:
+                saved[i] = fields[name]
+        if 'content' in fields:
+            saved[3] = _content_hash(fields['content'])
+        self._saved = tuple(saved)
+
+    def changed_fields(self):
+        '''
+        get the fields changed since the note was loaded or saved, as a
+        dictionary for update_note_attributes. All the fields are changed
+        in a note that was not loaded from the server, and the content of a
+        header is unchanged until it is loaded.
+        '''
+        fields = {}
+        saved = self._saved or (None, None, None, None)
+        if self.source != saved[0]:
+            fields['source'] = self.source
+        if self.author != saved[1]:
+            fields['author'] = self.author
+        if self.title != saved[2]:
+            fields['title'] = self.title
+        if self._saved is None or (self.is_loaded() and self.content_hash() != saved[3]):
+            fields['content'] = self.content
+        return fields
+
+
+class Resource(_Model):
     """Resource class that represents a resource in a note."""
 
+    __slots__ = _fields = ('url', 'icon')
+
     def __init__(self, json_dict):
         '''init with the data from a dictionary.'''
         if json_dict:
@@ -118,11 +274,85 @@ class Resource:
             return "<img src=\"%s\" />" % self.url
     
 
+_IMG_TAG_RE = re.compile(r'<img\b[^>]*>', re.I)
+_IMG_PATH_RE = re.compile(r'\bpath\s*=\s*"([^"]*)"', re.I)
+_IMG_SRC_RE = re.compile(r'\bsrc\s*=\s*"([^"]*)"', re.I)
+
+def _iter_resource_urls(content):
+    '''
+    yield the urls of the resources embedded in note content, in order and
+    each once, as they are found.
+    '''
+    seen = set()
+    for match in _IMG_TAG_RE.finditer(content or ''):
+        tag = match.group()
+        # an attachment has its url in "path" and its icon in "src".
+        attr = _IMG_PATH_RE.search(tag) or _IMG_SRC_RE.search(tag)
+        if attr is None:
+            continue
+        url = attr.group(1)
+        if not (url.startswith(BASE_URL) or url.startswith(OPTIONAL_BASE_URL)):
+            continue
+        url = _fix_url(url)
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+def _find_resource_urls(content):
+    '''find the urls of the resources embedded in note content, in order.'''
+    return list(_iter_resource_urls(content))
+
+def _resource_name(resource_url):
+    '''get the file name a resource is saved under: the sha1 hex digest of its url.'''
+    if isinstance(resource_url, unicode):
+        resource_url = resource_url.encode('utf-8')
+    return hashlib.sha1(resource_url).hexdigest()
+
+def _resource_validator(headers):
+    '''
+    get what identifies the version of a downloaded resource for If-Range:
+    its strong ETag, or else its Last-Modified date, None if it has neither.
+    '''
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified')
+
+def _read_part_state(path):
+    '''read the state file of a partial download, None if it is missing or broken.'''
+    try:
+        f = open(path, 'rb')
+        try:
+            return codec.loads(f.read())
+        finally:
+            f.close()
+    except (EnvironmentError, ValueError):
+        return None
+
+def _write_part_state(path, state):
+    '''write the state file of a partial download, or remove it if "state" is None.'''
+    if state is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    f = open(path, 'wb')
+    try:
+        f.write(codec.dumps(state))
+    finally:
+        f.close()
+
+
 class YNoteError(StandardError):
     '''
     SDK error class that represents API error as well as http error
     '''
 
+    # seconds the server asked to wait before retrying, if it did.
+    retry_after = None
+
+    # the Content-Range header of an http error, if it had one.
+    content_range = None
+
     def __init__(self, error_type, error_code, message):
         '''init with error code and message.'''
         self.error_msg = message
@@ -137,12 +367,22 @@ class YNoteError(StandardError):
 
 def _parse_api_error(body):
     '''parse an YNote API error to YNoteError object'''
-    json_obj = json.loads(body)
+    json_obj = codec.loads(body)
     return YNoteError('API_ERROR', int(json_obj['error']), json_obj['message'])
 
 def _parse_http_error(e):
     '''parse an urllib2.HTTPError object to YNoteError object'''
-    return YNoteError('HTTP_ERROR', e.code, e.reason)
+    error = YNoteError('HTTP_ERROR', e.code, e.reason)
+    error.retry_after = _parse_retry_after(e.info().get('retry-after'))
+    error.content_range = e.info().get('content-range')
+    return error
+
+def _parse_retry_after(value):
+    '''parse a Retry-After header given in seconds, None if it is not.'''
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
 
 def _parse_urlencoded(body):
     '''parse an urlencoded string to dictionary'''
@@ -150,60 +390,366 @@ def _parse_urlencoded(body):
     return dict([tuple(part.split('=')) for part in parts])
 
 
-def _do_http(request):
-    '''initiate an http request.'''
+def _open_http(request, pool=None, compress=False, idempotent=True):
+    '''
+    initiate an http request, through "pool" if it is given, return
+    (status, headers, response) with the response body left unread. If
+    "compress" is set, a compressed body is asked for and decompressed as
+    it is read; the headers are those of the compressed body. A request
+    that is not "idempotent" is never sent twice by the pool.
+    '''
+    if pool is None:
+        if compress:
+            request.add_header('Accept-encoding', connection.ACCEPT_ENCODING)
+        try:
+            resp = urllib2.urlopen(request)
+            if compress:
+                resp = connection.DecodingResponse(resp, resp.info().get('content-encoding'))
+            return resp.getcode(), dict(resp.info().items()), resp
+        except urllib2.HTTPError, e:
+            if e.code == 500:
+                if compress:
+                    e = connection.DecodingResponse(e, e.info().get('content-encoding'))
+                raise _parse_api_error(e.read())
+            else:
+                raise _parse_http_error(e)
+
+    resp = pool.urlopen(request.get_method(), request.get_full_url(),
+            request.get_data(), dict(request.header_items()), compress=compress, idempotent=idempotent)
+    if resp.status == 500:
+        raise _parse_api_error(resp.read())
+    elif resp.status >= 400:
+        resp.read()
+        error = YNoteError('HTTP_ERROR', resp.status, resp.reason)
+        error.retry_after = _parse_retry_after(resp.getheader('retry-after'))
+        error.content_range = resp.getheader('content-range')
+        raise error
+    return resp.status, dict(resp.getheaders()), resp
+
+def _do_http(request, pool=None, compress=False, idempotent=True):
+    '''initiate an http request, through "pool" if it is given.'''
+    status, headers, resp = _open_http(request, pool, compress, idempotent)
+    return resp.read()
+
+def _parse_content_range(value):
+    '''parse a Content-Range header to (first_byte, total_size), None if unknown.'''
+    try:
+        unit, spec = value.split(' ', 1)
+        span, total = spec.split('/')
+        first = int(span.split('-')[0]) if span != '*' else None
+        return first, (int(total) if total != '*' else None)
+    except (AttributeError, ValueError):
+        return None, None
+
+class _ResponseReader:
+    '''
+    file-like wrapper of a response that counts the bytes read, with the
+    status and headers of the response.
+    '''
+
+    def __init__(self, status, headers, resp):
+        self.status = status
+        self.headers = headers
+        self.resp = resp
+        self.count = 0
+
+    def read(self, amt=None):
+        if self.resp is None:
+            return ''
+        data = self.resp.read(amt) if amt is not None else self.resp.read()
+        self.count += len(data)
+        return data
+
+    def close(self):
+        if self.resp is not None:
+            self.resp.close()
+
+    def detach(self):
+        '''take the response out, to read the rest of the body after the request returned.'''
+        resp, self.resp = self.resp, None
+        return resp
+
+def _read_stream(resp, stream):
+    '''return stream(resp), then read what it left of the body.'''
+    try:
+        res = stream(resp)
+        resp.read()
+    except:
+        resp.close()
+        raise
+    return res
+
+def _do_request(request_type, url, params, consumer, token, pool=None, progress=None, event=None,
+                stream=None, idempotent=True, headers=None):
+    '''
+    initiate a signed http request with the extra "headers", return result
+    as a string or raise error. If "stream" is given, the result is
+    stream(reader) instead, where the reader is a _ResponseReader of the
+    body. Timings, sizes and status are recorded in "event" if it is given.
+    '''
+    req_builder = oauth2.RequestBuilder(request_type, url, params)
+    req_builder.progress = progress
+    if event is None:
+        req = req_builder.build_signed_request(consumer, token)
+        for k, v in (headers or {}).items():
+            req.add_header(k, v)
+        if stream is None:
+            return _do_http(req, pool, COMPRESS, idempotent)
+        return _read_stream(_ResponseReader(*_open_http(req, pool, COMPRESS, idempotent)), stream)
+
+    req_builder.timings = event.timings
+    req = req_builder.build_signed_request(consumer, token)
+    for k, v in (headers or {}).items():
+        req.add_header(k, v)
+    body = req.get_data()
+    event.bytes_sent = len(body) if body is not None else 0
+    start = time.time()
     try:
-        resp = urllib2.urlopen(request)
-        return resp.read()
-    except urllib2.HTTPError, e:
-        if e.code == 500:
-            raise _parse_api_error(e.read())
+        event.status, resp_headers, resp = _open_http(req, pool, COMPRESS, idempotent)
+        if stream is None:
+            res = resp.read()
+            event.bytes_decoded = len(res)
         else:
-            raise _parse_http_error(e)
+            # the body is decoded as it arrives: the time counts as network.
+            reader = _ResponseReader(event.status, resp_headers, resp)
+            try:
+                res = _read_stream(reader, stream)
+            finally:
+                event.bytes_decoded = reader.count
+        event.bytes_received = getattr(resp, 'compressed_bytes', event.bytes_decoded)
+    except YNoteError, e:
+        event.status = e.error_code if e.error_type == 'HTTP_ERROR' else 500
+        raise
+    finally:
+        event.timings['network'] = time.time() - start
+    return res
 
-def _do_get(url, params, consumer, token):
+def _do_get(url, params, consumer, token, pool=None):
     '''
     initiate an http GET request, return result as a string or raise error.
     '''
-    req_builder = oauth2.RequestBuilder(oauth2.HTTP_GET, url, params)
-    req = req_builder.build_signed_request(consumer, token)
-    return _do_http(req)
+    return _do_request(oauth2.HTTP_GET, url, params, consumer, token, pool)
 
-def _do_post(url, params, consumer, token):
+def _do_post(url, params, consumer, token, pool=None):
     '''
     initiate an http POST request with urlencoded content,
     return result as string or raise error.
     '''
-    return _do_post_urlencoded(url, params, consumer, token)
+    return _do_post_urlencoded(url, params, consumer, token, pool)
 
-def _do_post_urlencoded(url, params, consumer, token):
+def _do_post_urlencoded(url, params, consumer, token, pool=None):
     '''
     initiate an http POST request with urlencoded content,
     return result as string or raise error.
     '''
-    req_builder = oauth2.RequestBuilder(oauth2.HTTP_POST_URLENCODED, url, params)
-    req = req_builder.build_signed_request(consumer, token)
-    return _do_http(req)
+    return _do_request(oauth2.HTTP_POST_URLENCODED, url, params, consumer, token, pool)
 
-def _do_post_multipart(url, params, consumer, token):
+def _do_post_multipart(url, params, consumer, token, pool=None, progress=None):
     '''
-    initiate an http POST request with multipart content,
-    return result as string or raise error.
+    initiate an http POST request with multipart content streamed from the
+    params, return result as string or raise error.
+    '''
+    return _do_request(oauth2.HTTP_POST_MULTIPART, url, params, consumer, token, pool, progress)
+
+def _rewind_params(params):
+    '''get the files in request params ready to be sent again, return False if impossible.'''
+    for v in (params or {}).values():
+        if isinstance(v, oauth2.UploadFile) and not v.rewind():
+            return False
+    return True
+
+def _rewind_stream(stream):
+    '''tell whether a stream callback may be given the body of another attempt.'''
+    rewind = getattr(stream, 'rewind', None)
+    return rewind is None or rewind()
+
+class _ResourceStream:
+    '''
+    stream callback of a request for a resource from byte "offset": calls
+    consume(reader, start, total, validator) where "start" is the offset
+    the body really starts at, "total" is the size of the whole
+    resource(None if unknown) and "validator" identifies its version(None
+    if the server did not). The request may be retried only until consume
+    has read the first byte of the body.
     '''
-    req_builder = oauth2.RequestBuilder(oauth2.HTTP_POST_MULTIPART, url, params)
-    req = req_builder.build_signed_request(consumer, token)
-    return _do_http(req)
+
+    def __init__(self, offset, consume):
+        self.offset = offset
+        self.consume = consume
+        self.reader = None
+        self.opened = None
+
+    def __call__(self, reader):
+        self.reader = reader
+        self.opened = time.time()
+        headers = reader.headers
+        length = headers.get('content-length')
+        length = int(length) if length else None
+        if reader.status == 206:
+            start, total = _parse_content_range(headers.get('content-range'))
+            if start is None:
+                start = self.offset
+            if total is None and length is not None:
+                total = start + length
+        else:
+            start, total = 0, length
+        return self.consume(reader, start, total, _resource_validator(headers))
+
+    def rewind(self):
+        return self.reader is None or not self.reader.count
+
+def _parse_path(body):
+    '''get the path from a json response.'''
+    return codec.loads(body)['path']
 
 
 class YNoteClient:
     """API client for Youdao Note."""
 
-    def __init__(self, consumer_key, consumer_secret):
-        '''init with consumer key and consumer secret.'''
+    def __init__(self, consumer_key, consumer_secret, pool=None, cache=None, store=None,
+                 upload_cache=None, resource_cache=None, retry_policy=None, rate_limiter=None,
+                 concurrency_limiter=None, coalesce=True):
+        '''
+        init with consumer key and consumer secret. "pool" is the
+        connection.ConnectionPool shared by all requests, a new one is
+        created if it is not given. "cache" is an optional
+        cache.MetadataCache for notebooks and notes, "store" an optional
+        store.NoteStore that saves what the client fetches, and
+        "upload_cache" an optional uploadcache.UploadCache that skips
+        uploading the same data twice. "resource_cache" is an optional
+        diskcache.ResourceCache used by download_resource.
+
+        "retry_policy" is an optional retry.RetryPolicy for failed requests,
+        "rate_limiter" an optional limiter.TokenBucket and
+        "concurrency_limiter" an optional limiter.AIMDLimiter that every
+        request goes through; share them between clients to limit them
+        together.
+
+        If "coalesce" is set, concurrent identical reads share one request
+        and each get their own copy of its objects; self.single_flight.coalesced
+        counts the calls that were served that way.
+        '''
         self.consumer = oauth2.Consumer(consumer_key, consumer_secret)
+        self.pool = pool if pool is not None else connection.ConnectionPool()
+        self.cache = cache
+        self.store = store
+        self.upload_cache = upload_cache
+        self.resource_cache = resource_cache
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.single_flight = futures.SingleFlight(_copy_result) if coalesce else None
+        self.hooks = []
         self.access_token = None
         self.request_token = None
 
+    def add_hook(self, hook):
+        '''call hook(event) with an instrument.RequestEvent after every request.'''
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        '''stop calling a hook.'''
+        self.hooks.remove(hook)
+
+    def _hooks(self):
+        '''get the hooks to call after a request.'''
+        return list(self.hooks)
+
+    def _request(self, request_type, url, params, parse, token, progress=None, idempotent=True,
+                 stream=False, headers=None):
+        '''
+        sign and send a request with "token" and the extra "headers",
+        return parse(body), or the body if "parse" is None. If "stream" is
+        set, "parse" gets a _ResponseReader of the body rather than a
+        string, so it can decode the body as it arrives. "idempotent" is
+        False for requests that must not be repeated when it is unknown
+        whether they were handled. The registered hooks get a RequestEvent.
+        '''
+        stream_parse = None
+        if stream:
+            stream_parse, parse = parse, None
+        hooks = self._hooks()
+        if (not hooks and self.retry_policy is None and self.rate_limiter is None
+                and self.concurrency_limiter is None):
+            res = _do_request(request_type, url, params, self.consumer, token, self.pool, progress,
+                    stream=stream_parse, idempotent=idempotent, headers=headers)
+            if parse is None:
+                return res
+            return parse(res)
+
+        event = None
+        if hooks:
+            event = instrument.RequestEvent(oauth2._get_method(request_type), url)
+        try:
+            res = self._send(request_type, url, params, token, progress, idempotent, event, stream_parse,
+                    headers)
+            if parse is not None:
+                start = time.time()
+                res = parse(res)
+                if event is not None:
+                    event.timings['parse'] = time.time() - start
+            return res
+        except Exception, e:
+            if event is not None:
+                event.error = e
+            raise
+        finally:
+            if event is not None:
+                event.finish()
+                for hook in hooks:
+                    try:
+                        hook(event)
+                    except Exception:
+                        pass
+
+    def _send(self, request_type, url, params, token, progress, idempotent, event, stream=None,
+              headers=None):
+        '''
+        send a request through the limiters, retrying it as the retry policy
+        allows, return the body, or stream(reader) if "stream" is given. A
+        stream with a rewind method is retried only while it returns True;
+        the latency is measured up to its "opened" time if it has one.
+        '''
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            concurrency_limiter = self.concurrency_limiter
+            if concurrency_limiter is not None:
+                concurrency_limiter.acquire()
+            start = time.time()
+            try:
+                res = _do_request(request_type, url, params, self.consumer, token, self.pool, progress,
+                        event, stream, idempotent, headers)
+            except Exception, e:
+                if concurrency_limiter is not None:
+                    concurrency_limiter.release(time.time() - start, retry.is_overload(e))
+                policy = self.retry_policy
+                if (policy is None or not policy.should_retry(e, attempt, idempotent)
+                        or not _rewind_params(params) or not _rewind_stream(stream)):
+                    raise
+                time.sleep(policy.delay(attempt, getattr(e, 'retry_after', None)))
+                attempt += 1
+                if event is not None:
+                    event.retries = attempt
+                continue
+
+            if concurrency_limiter is not None:
+                # a long download is not a slow server.
+                concurrency_limiter.release((getattr(stream, 'opened', None) or time.time()) - start)
+            return res
+
+    def _read(self, key, fn, *args):
+        '''call fn(*args), sharing the call with concurrent reads of the same key.'''
+        if self.single_flight is None:
+            return fn(*args)
+        return self.single_flight.do(key, fn, *args)
+
+    def _forget_reads(self):
+        '''after a write, let later reads make new requests instead of joining running ones.'''
+        if self.single_flight is not None:
+            self.single_flight.forget()
+
     def grant_request_token(self, callback_url):
         '''get request token(store in self.request_token), return authorization url.'''
         if callback_url:
@@ -211,8 +757,8 @@ class YNoteClient:
         else:
             params = {'oauth_callback':'oob'}
 
-        res = _do_get(BASE_URL+'oauth/request_token', params, self.consumer, None)
-        res_dict = _parse_urlencoded(res)
+        res_dict = self._request(oauth2.HTTP_GET, BASE_URL+'oauth/request_token', params,
+                _parse_urlencoded, None)
         self.request_token = oauth2.Token(res_dict['oauth_token'], res_dict['oauth_token_secret'])
 
         auth_url = BASE_URL + 'oauth/authorize?oauth_token=' + self.request_token.key
@@ -228,8 +774,8 @@ class YNoteClient:
             'oauth_verifier':verifier
         }
 
-        res = _do_get(BASE_URL+'oauth/access_token', params, self.consumer, self.request_token)
-        res_dict = _parse_urlencoded(res)
+        res_dict = self._request(oauth2.HTTP_GET, BASE_URL+'oauth/access_token', params,
+                _parse_urlencoded, self.request_token)
         self.access_token = oauth2.Token(res_dict['oauth_token'], res_dict['oauth_token_secret'])
     
     def set_access_token(self, token_key, token_secret):
@@ -245,19 +791,56 @@ class YNoteClient:
 
     def get_user(self):
         '''get user information, return as a User object.'''
-        res = _do_get(BASE_URL+'yws/open/user/get.json', None, self.consumer, self.access_token)
-        return User(json.loads(res))
+        return self._read(('user',), self._request, oauth2.HTTP_GET, BASE_URL+'yws/open/user/get.json',
+                None, lambda res: User(codec.loads(res)), self.access_token)
 
     def get_notebooks(self):
         '''get all notebooks, return as a list of Notebook objects.'''
-        res = _do_post(BASE_URL+'yws/open/notebook/all.json', None, self.consumer, self.access_token)
-        return [Notebook(d) for d in json.loads(res)]
+        if self.cache is not None:
+            books = self.cache.get_notebooks()
+            if books is not None:
+                return books
+        return self._read(('notebooks',), self._fetch_notebooks)
+
+    def _fetch_notebooks(self):
+        '''get all notebooks from the server.'''
+        books = self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/notebook/all.json', None,
+                lambda res: codec.load_array(res, Notebook), self.access_token, stream=True)
+        if self.cache is not None:
+            self.cache.put_notebooks(books)
+        if self.store is not None:
+            self.store.put_notebooks(books)
+        return books
+
+    def _cache_lookup(self, lookup, key):
+        '''
+        look up the cache, refreshing the notebooks once if the entry has
+        expired but may be revalidated by them.
+        '''
+        value, state = lookup(key)
+        if state == cache.STALE:
+            self.get_notebooks()
+            value, state = lookup(key)
+        return value
 
     def get_note_paths(self, book_path):
         '''get path of all notes in a notebook, return as a list of path strings.'''
+        if self.cache is not None:
+            paths = self._cache_lookup(self.cache.get_note_paths, book_path)
+            if paths is not None:
+                return paths
+        return self._read(('note_paths', book_path), self._fetch_note_paths, book_path)
+
+    def _fetch_note_paths(self, book_path):
+        '''get path of all notes in a notebook from the server.'''
         params = {'notebook':book_path}
-        res = _do_post(BASE_URL+'yws/open/notebook/list.json', params, self.consumer, self.access_token)
-        return json.loads(res)
+        paths = self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/notebook/list.json', params,
+                codec.load_array, self.access_token, stream=True)
+        if self.cache is not None:
+            self.cache.put_note_paths(book_path, paths)
+        if self.store is not None:
+            self.store.put_note_paths(book_path, paths)
+        return paths
     
     def create_notebook(self, name, create_time=None):
         '''create a notebook with specified name.'''
@@ -265,20 +848,106 @@ class YNoteClient:
         if create_time:
             params['create_time'] = create_time
 
-        res = _do_post(BASE_URL+'yws/open/notebook/create.json', params, self.consumer, self.access_token)
-        return json.loads(res)['path']
+        path = self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/notebook/create.json', params,
+                _parse_path, self.access_token, idempotent=False)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_notebooks()
+        return path
     
     def delete_notebook(self, path):
         '''delete a notebook with specified path.'''
         params = {'notebook':path}
-        res = _do_post(BASE_URL+'yws/open/notebook/delete.json', params, self.consumer, self.access_token)
+        self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/notebook/delete.json', params,
+                None, self.access_token)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_book(path)
+        if self.store is not None:
+            self.store.delete_notebook(path)
 
     def get_note(self, path):
         '''get a note with specified path, return as a Note object.'''
+        if self.cache is not None:
+            note = self._cache_lookup(self.cache.get_note, path)
+            if note is not None:
+                return note
+        return self._read(('note', path), self._fetch_note, path)
+
+    def _fetch_note(self, path):
+        '''get a note from the server.'''
         params = {'path':path}
-        res = _do_post(BASE_URL+'yws/open/note/get.json', params, self.consumer, self.access_token)
-        return Note(json.loads(res))
+        note = self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/note/get.json', params,
+                lambda res: Note(codec.loads(res)), self.access_token)
+        if self.cache is not None:
+            self.cache.put_note(note)
+        if self.store is not None:
+            self.store.put_note(note)
+        return note
     
+    def _get_note_or_error(self, path):
+        '''get a note, return (path, note, error) instead of raising.'''
+        try:
+            return path, self.get_note(path), None
+        except Exception, e:
+            return path, None, e
+
+    def get_notes(self, paths, max_workers=8, ordered=True):
+        '''
+        get the notes with specified paths on "max_workers" threads, yield
+        (path, note, error) for each path in the order of "paths", or as the
+        notes arrive if "ordered" is False. "note" is None if the fetch
+        failed with "error", which does not stop the other fetches.
+        '''
+        pool = futures.WorkerPool(max_workers)
+        try:
+            fs = [pool.submit(self._get_note_or_error, path) for path in paths]
+            if not ordered:
+                fs = futures.as_completed(fs)
+            for f in fs:
+                yield f.result()
+        finally:
+            pool.shutdown(wait=False, cancel=True)
+
+    def get_notebook_contents(self, book_path, max_workers=8):
+        '''
+        get all notes in a notebook, return (notes, errors) where "notes" is
+        a list of Note objects and "errors" maps the paths that failed to
+        their errors.
+        '''
+        notes = []
+        errors = {}
+        for path, note, error in self.get_notes(self.get_note_paths(book_path), max_workers):
+            if error is None:
+                notes.append(note)
+            else:
+                errors[path] = error
+        return notes, errors
+
+    def iter_note_paths(self):
+        '''yield the path of every note in the account, one notebook at a time.'''
+        for book in self.get_notebooks():
+            for path in self.get_note_paths(book.path):
+                yield path
+
+    def iter_all_notes(self, prefetch=4):
+        '''
+        yield every note in the account as a Note object. The next
+        "prefetch" notes are fetched in the background while the caller
+        works on the current one, so at most prefetch+1 notes are held.
+        '''
+        pool = futures.WorkerPool(max(prefetch, 1))
+        window = collections.deque()
+        try:
+            for path in self.iter_note_paths():
+                window.append(pool.submit(self.get_note, path))
+                if len(window) > prefetch:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            pool.shutdown(wait=False, cancel=True)
+
     def create_note(self, book_path, note):
         '''create a note in a notebook with information specified in "note".'''
         params = {
@@ -288,8 +957,14 @@ class YNoteClient:
             'content':note.content,
             'notebook':book_path
         }
-        res = _do_post_multipart(BASE_URL+'yws/open/note/create.json', params, self.consumer, self.access_token)
-        return json.loads(res)['path']
+        path = self._request(oauth2.HTTP_POST_MULTIPART, BASE_URL+'yws/open/note/create.json', params,
+                _parse_path, self.access_token, idempotent=False)
+        # the server has these fields now: later updates send only changes.
+        note.mark_clean()
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_book(book_path)
+        return path
 
     def create_note_with_attributes(self, book_path, content, **kw):
         '''create a note with attributes given by parameters'''
@@ -307,22 +982,28 @@ class YNoteClient:
         if 'create_time' in kw.keys():
             params['create_time'] = kw['create_time']
         
-        res = _do_post_multipart(BASE_URL+'yws/open/note/create.json', params, self.consumer, self.access_token)
-        return json.loads(res)['path']
+        path = self._request(oauth2.HTTP_POST_MULTIPART, BASE_URL+'yws/open/note/create.json', params,
+                _parse_path, self.access_token, idempotent=False)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_book(book_path)
+        return path
     
     def update_note(self, note, modify_time=None):
-        '''update the note with information in "note".'''
-        params = {
-            'path':note.path,
-            'source':note.source,
-            'author':note.author,
-            'title':note.title,
-            'content':note.content,
-        }
+        '''
+        update the note with information in "note". Only the fields changed
+        since the note was loaded are sent, and nothing at all if none has
+        changed. return True if the note was sent.
+        '''
+        fields = note.changed_fields()
+        if not fields:
+            return False
         if modify_time:
-            params['modify_time'] = modify_time
-            
-        _do_post_multipart(BASE_URL+'yws/open/note/update.json', params, self.consumer, self.access_token)
+            fields['modify_time'] = modify_time
+
+        self.update_note_attributes(note.path, **fields)
+        note.mark_clean(fields)
+        return True
 
     def update_note_attributes(self, note_path, **kw):
         '''update the some attributes(given by kw) of the note.'''
@@ -343,7 +1024,13 @@ class YNoteClient:
         if 'modify_time' in kw.keys():
             params['modify_time'] = kw['modify_time']
         
-        _do_post_multipart(BASE_URL+'yws/open/note/update.json', params, self.consumer, self.access_token)
+        self._request(oauth2.HTTP_POST_MULTIPART, BASE_URL+'yws/open/note/update.json', params,
+                None, self.access_token)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_note(note_path)
+        if self.store is not None:
+            self.store.update_note_attributes(note_path, **kw)
 
     def move_note(self, note_path, book_path):
         '''move note to the notebook with path denoted by "book_path".'''
@@ -351,27 +1038,242 @@ class YNoteClient:
             'path':note_path,
             'notebook':book_path
         }
-        res = _do_post(BASE_URL+'yws/open/note/move.json', params, self.consumer, self.access_token)
-        return json.loads(res)['path']
+        new_path = self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/note/move.json', params,
+                _parse_path, self.access_token, idempotent=False)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_note(note_path, True)
+            self.cache.invalidate_book(book_path)
+        if self.store is not None:
+            self.store.move_note(note_path, new_path, book_path)
+        return new_path
     
     def delete_note(self, note_path):
         '''delete a note with specified path.'''
         params = {'path':note_path}
-        res = _do_post(BASE_URL+'yws/open/note/delete.json', params, self.consumer, self.access_token)
+        self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/note/delete.json', params,
+                None, self.access_token)
+        self._forget_reads()
+        if self.cache is not None:
+            self.cache.invalidate_note(note_path, True)
+        if self.store is not None:
+            self.store.delete_note(note_path)
     
     def share_note(self, note_path):
         '''share a note with specified path, return shared url.'''
         params = {'path':note_path}
-        res = _do_post(BASE_URL+'yws/open/share/publish.json', params, self.consumer, self.access_token)
-        return _fix_url(json.loads(res)['url'])
+        return self._request(oauth2.HTTP_POST_URLENCODED, BASE_URL+'yws/open/share/publish.json', params,
+                lambda res: _fix_url(codec.loads(res)['url']), self.access_token)
+
+    def upload_resource(self, res_file, progress=None):
+        '''
+        upload a file as a resource. "res_file" is a file-like object or an
+        oauth2.UploadFile, it is streamed in chunks rather than read into
+        memory. "progress" is called as progress(bytes_sent, total_bytes).
+        '''
+        if self.upload_cache is not None:
+            return self.upload_cache.upload(self, res_file, progress)
+        return self._upload_resource(res_file, progress)
 
-    def upload_resource(self, res_file):
-        '''upload a file as a resource.'''
+    def _upload_resource(self, res_file, progress):
+        '''upload a file as a resource, bypassing the upload cache.'''
+        if not isinstance(res_file, oauth2.UploadFile):
+            # wrapped once, so a retry can rewind the file.
+            res_file = oauth2.UploadFile(res_file)
         params = {'file':res_file}
-        res = _do_post_multipart(BASE_URL+'yws/open/resource/upload.json', params, self.consumer, self.access_token)
-        return Resource(json.loads(res))
+        resource = self._request(oauth2.HTTP_POST_MULTIPART, BASE_URL+'yws/open/resource/upload.json', params,
+                lambda res: Resource(codec.loads(res)), self.access_token, progress, False)
+        if self.store is not None:
+            self.store.put_resource(resource)
+        return resource
     
+    def _open_resource(self, resource_url, consume, offset=0, end=None, validator=None):
+        '''
+        request a resource from byte "offset" up to byte "end", return
+        consume(reader, start, total, validator) as _ResourceStream calls
+        it. If "validator" is given, only the version it names is sent in
+        part: another is sent whole. The request goes through the limiters,
+        the retry policy and the hooks like the others, and is retried
+        until consume has read the first byte of the body.
+        '''
+        headers = {}
+        if end is not None:
+            headers['Range'] = 'bytes=%d-%d' % (offset, end)
+        elif offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        if validator is not None and headers:
+            headers['If-Range'] = validator
+        return self._request(oauth2.HTTP_GET, resource_url, None, _ResourceStream(offset, consume),
+                self.access_token, stream=True, headers=headers)
+
+    def _resource_exists(self, resource_url):
+        '''check that a resource can still be downloaded.'''
+        try:
+            self._open_resource(resource_url, lambda reader, start, total, validator: None, 0, 0)
+        except YNoteError:
+            return False
+        return True
+
+    def iter_resource(self, resource_url, offset=0, chunk_size=oauth2.CHUNK_SIZE):
+        '''
+        download a resource with specified url, yield its content in chunks
+        of at most "chunk_size" bytes, beginning at byte "offset". The
+        limiters and hooks see the request until its first chunk arrives.
+        '''
+        def first_chunk(reader, start, total, validator):
+            # skip what the server sent although we did not ask for it.
+            skip = offset - start
+            while skip > 0:
+                data = reader.read(min(skip, chunk_size))
+                if not data:
+                    return None, ''
+                skip -= len(data)
+            data = reader.read(chunk_size)
+            return reader.detach(), data
+        resp, data = self._open_resource(resource_url, first_chunk, offset)
+        if resp is None:
+            return
+        try:
+            while data:
+                yield data
+                data = resp.read(chunk_size)
+        finally:
+            resp.close()
+
+    def download_resource_to(self, resource_url, dest, resume=False,
+                             chunk_size=oauth2.CHUNK_SIZE, progress=None):
+        '''
+        download a resource with specified url to "dest", a path or a
+        writable file object, without holding it in memory. A path is
+        written as "dest.part" and renamed to "dest" once complete, so a
+        file already there is replaced only by a whole download. If
+        "resume" is set, a "dest.part" left by an earlier download of the
+        same url is completed with a Range request, provided the server
+        identified the version of the resource, which must not have
+        changed since. "progress" is called as progress(bytes_done,
+        total_bytes). return the size of the downloaded resource.
+        '''
+        if not isinstance(dest, basestring):
+            return self._download_to_file(resource_url, dest, 0, None, chunk_size, progress)
+
+        part = dest + '.part'
+        state_path = part + '.json'
+        offset, validator = 0, None
+        if resume and os.path.exists(part):
+            state = _read_part_state(state_path)
+            if state is not None and state.get('url') == resource_url and state.get('validator'):
+                offset, validator = os.path.getsize(part), state['validator']
+
+        def opened(validator):
+            # only a download whose version is known can be resumed.
+            _write_part_state(state_path, validator and {'url':resource_url, 'validator':validator})
+
+        f = open(part, 'r+b' if offset else 'wb')
+        try:
+            size = self._download_to_file(resource_url, f, offset, validator, chunk_size, progress, opened)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(dest):
+            os.remove(dest)
+        os.rename(part, dest)
+        _write_part_state(state_path, None)
+        return size
+
+    def _download_to_file(self, resource_url, f, offset, validator, chunk_size, progress, opened=None):
+        '''
+        download a resource into file "f" which already holds "offset"
+        bytes of the version named by "validator". opened(validator) is
+        called once the response has started.
+        '''
+        def consume(reader, start, total, new_validator):
+            # the file is left alone until the request can no longer be retried.
+            data = reader.read(chunk_size)
+            if start != offset:
+                # the server ignored the range, or the resource has changed: start over.
+                f.seek(start)
+                f.truncate()
+            elif offset:
+                f.seek(offset)
+            if opened is not None:
+                opened(new_validator or (validator if start else None))
+
+            done = start
+            while data:
+                f.write(data)
+                done += len(data)
+                if progress:
+                    progress(done, total)
+                data = reader.read(chunk_size)
+
+            if total is not None and done != total:
+                raise YNoteError('SIZE_ERROR', 0,
+                        'resource incomplete: got %d of %d bytes' % (done, total))
+            return done
+
+        try:
+            return self._open_resource(resource_url, consume, offset, validator=validator)
+        except YNoteError, e:
+            if not offset or e.error_code != 416:
+                raise
+            # the range starts at or beyond the end: the file is complete
+            # only if it has the size of the whole resource.
+            first, total = _parse_content_range(e.content_range)
+            if total == offset:
+                return offset
+            f.seek(0)
+            f.truncate()
+            return self._download_to_file(resource_url, f, 0, None, chunk_size, progress, opened)
+
+    def _fetch_resource_to(self, resource_url, dest_dir):
+        '''download a resource into "dest_dir" unless it is there, return its path.'''
+        path = os.path.join(dest_dir, _resource_name(resource_url))
+        if not os.path.exists(path):
+            # a partial download left by a crash is resumed.
+            self.download_resource_to(resource_url, path, resume=True)
+        return path
+
+    def get_note_with_resources(self, path, dest_dir=None, max_workers=8):
+        '''
+        get a note and download the resources embedded in it on
+        "max_workers" threads, return (note, resources, errors) where
+        "resources" is an OrderedDict from url to the data, or to the path
+        of the file in "dest_dir" if it is given, and "errors" maps the urls
+        that failed to their errors. Each download starts as soon as its url
+        is found in the content. Files already in "dest_dir" are not
+        downloaded again.
+        '''
+        note = self.get_note(path)
+        if dest_dir is not None and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        pool = futures.WorkerPool(max_workers)
+        try:
+            fs = collections.OrderedDict()
+            for url in _iter_resource_urls(note.content):
+                if dest_dir is None:
+                    fs[url] = pool.submit(self.download_resource, url)
+                else:
+                    fs[url] = pool.submit(self._fetch_resource_to, url, dest_dir)
+            resources = collections.OrderedDict()
+            errors = {}
+            for url, f in fs.items():
+                try:
+                    resources[url] = f.result()
+                except Exception, e:
+                    errors[url] = e
+            return note, resources, errors
+        finally:
+            pool.shutdown(wait=False, cancel=True)
+
     def download_resource(self, resource_url):
         '''download a resource file with specified url, return as a string.'''
-        res = _do_get(resource_url, None, self.consumer, self.access_token)
-        return res
+        if self.resource_cache is not None:
+            view = self.resource_cache.fetch(self, resource_url)
+            if view is not None:
+                try:
+                    return view[:]
+                finally:
+                    if hasattr(view, 'close'):
+                        view.close()
+
+        return self._read(('resource', resource_url), self._request, oauth2.HTTP_GET, resource_url,
+                None, None, self.access_token)
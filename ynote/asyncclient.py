@@ -0,0 +1,709 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Asynchronous client for Youdao Note API.
+
+Requests are signed in the calling thread and then driven by a single
+asyncore event loop thread, so hundreds of them can be in flight at once.
+Every API method returns a futures.Future immediately.
+'''
+
+import asyncore
+import collections
+import select
+import socket
+import sys
+import threading
+import time
+import urlparse
+
+import ynote, oauth2, connection, futures, codec
+
+# size of the buffers used to send and receive data.
+_BUF_SIZE = 64 * 1024
+
+if hasattr(select, 'poll'):
+    _poll = asyncore.poll2
+else:
+    _poll = asyncore.poll
+
+
+class _Waker(asyncore.dispatcher):
+    '''loopback socket pair used to wake the event loop from other threads.'''
+
+    def __init__(self, map):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self._writer = socket.create_connection(server.getsockname())
+        reader, addr = server.accept()
+        server.close()
+        asyncore.dispatcher.__init__(self, reader, map)
+
+    def wake(self):
+        '''make the next poll return.'''
+        try:
+            self._writer.send('x')
+        except socket.error:
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._writer.close()
+
+
+class _EventLoop:
+    '''asyncore loop running in a background thread.'''
+
+    def __init__(self):
+        '''init the loop, the thread is started with the first call.'''
+        self.map = {}
+        # called after each poll, returns the seconds until it is due again.
+        self.tick = None
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._waker = None
+        self._closed = False
+
+    def call_soon(self, fn, *args):
+        '''run fn(*args) in the loop thread.'''
+        self._lock.acquire()
+        try:
+            if self._closed:
+                raise RuntimeError('event loop is closed')
+            if self._thread is None:
+                self._waker = _Waker(self.map)
+                self._thread = threading.Thread(target=self._run, name='ynote-asyncclient')
+                self._thread.daemon = True
+                self._thread.start()
+            self._calls.append((fn, args))
+        finally:
+            self._lock.release()
+        self._waker.wake()
+
+    def close(self):
+        '''stop the loop and close all its sockets.'''
+        self._lock.acquire()
+        try:
+            self._closed = True
+            thread = self._thread
+        finally:
+            self._lock.release()
+        if thread is not None:
+            self._waker.wake()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _run(self):
+        '''loop thread: poll sockets and run scheduled calls.'''
+        wait = 1.0
+        while not self._closed:
+            _poll(wait, self.map)
+            while self._calls:
+                fn, args = self._calls.popleft()
+                fn(*args)
+            wait = 1.0
+            if self.tick is not None:
+                # the tick says how soon it wants to run again.
+                wait = min(wait, self.tick())
+        for obj in self.map.values():
+            obj.close()
+
+
+class _ResponseParser:
+    '''incremental parser of http/1.1 responses.'''
+
+    def __init__(self, no_body=False):
+        '''init the parser, "no_body" is set for HEAD requests.'''
+        self.status = None
+        self.reason = ''
+        self.headers = {}
+        self.done = False
+        self.will_close = False
+        self._no_body = no_body
+        self._buf = ''
+        self._body = []
+        self._state = 'status'
+        self._remaining = 0
+
+    def body(self):
+        '''get the received body.'''
+        return ''.join(self._body)
+
+    def _line(self):
+        '''take a line from the buffer, None if it is incomplete.'''
+        i = self._buf.find('\r\n')
+        if i < 0:
+            return None
+        line, self._buf = self._buf[:i], self._buf[i+2:]
+        return line
+
+    def _take(self):
+        '''take body bytes from the buffer, at most the remaining count.'''
+        data = self._buf[:self._remaining]
+        self._buf = self._buf[len(data):]
+        self._remaining -= len(data)
+        self._body.append(data)
+
+    def _end_headers(self):
+        '''choose how the body is delimited.'''
+        if 100 <= self.status < 200:
+            buf = self._buf
+            self.__init__(self._no_body)
+            self._buf = buf
+            return
+        conn = self.headers.get('connection', '').lower()
+        self.will_close = conn == 'close' or (self._http10 and conn != 'keep-alive')
+        if self._no_body or self.status in (204, 304):
+            self.done = True
+        elif 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            self._state = 'chunk-size'
+        elif 'content-length' in self.headers:
+            self._remaining = int(self.headers['content-length'])
+            self._state = 'body'
+            self.done = self._remaining == 0
+        else:
+            self._state = 'close'
+            self.will_close = True
+
+    def feed(self, data):
+        '''feed received data, return True once the response is complete.'''
+        self._buf += data
+        while not self.done:
+            state = self._state
+            if state == 'body' or state == 'chunk-data':
+                if not self._buf:
+                    break
+                self._take()
+                if self._remaining == 0:
+                    if state == 'body':
+                        self.done = True
+                    else:
+                        self._state = 'chunk-end'
+                continue
+            elif state == 'close':
+                self._body.append(self._buf)
+                self._buf = ''
+                break
+
+            line = self._line()
+            if line is None:
+                break
+            if state == 'status':
+                version, status, self.reason = (line.split(' ', 2) + [''])[:3]
+                self.status = int(status)
+                self._http10 = version == 'HTTP/1.0'
+                self._state = 'headers'
+            elif state == 'headers':
+                if line:
+                    name, value = line.split(':', 1)
+                    self.headers[name.strip().lower()] = value.strip()
+                else:
+                    self._end_headers()
+            elif state == 'chunk-size':
+                self._remaining = int(line.split(';')[0], 16)
+                self._state = 'chunk-data' if self._remaining else 'trailer'
+            elif state == 'chunk-end':
+                self._state = 'chunk-size'
+            elif state == 'trailer':
+                self.done = not line
+        return self.done
+
+    def feed_eof(self):
+        '''the peer closed the connection, return True if that ends the response.'''
+        if self._state == 'close':
+            self.done = True
+        return self.done
+
+
+class _Job:
+    '''an http request waiting for its response.'''
+
+    def __init__(self, request, parse, future, idempotent=True):
+        '''init with a signed urllib2.Request and the parser of the result.'''
+        self.method = request.get_method()
+        self.url = request.get_full_url()
+        self.body = request.get_data()
+        self.headers = dict(request.header_items())
+        self.parse = parse
+        self.future = future
+        self.idempotent = idempotent
+        self.redirects = 0
+
+
+class _Connection(asyncore.dispatcher):
+    '''keep-alive http connection that sends one request at a time.'''
+
+    def __init__(self, transport, key):
+        '''open a connection to the host denoted by "key".'''
+        asyncore.dispatcher.__init__(self, map=transport.loop.map)
+        self.transport = transport
+        self.key = key
+        self.job = None
+        self.reused = False
+        self.deadline = None
+        self._out = ''
+        self._pos = 0
+        self._body = None
+        self._parser = None
+        self._received = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(key[1:])
+        except:
+            # the socket is in the map already.
+            self.close()
+            raise
+
+    def start(self, job, path):
+        '''send the request of "job".'''
+        scheme, host, port = self.key
+        if port != 80:
+            host = '%s:%d' % (host, port)
+        lines = ['%s %s HTTP/1.1' % (job.method, path), 'Host: %s' % host]
+        for name, value in job.headers.items():
+            if name.lower() not in ('host', 'connection', 'content-length'):
+                lines.append('%s: %s' % (name, value))
+
+        body = job.body
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        lines.append('Connection: keep-alive')
+        self._out = '\r\n'.join(lines) + '\r\n\r\n'
+        if isinstance(body, basestring):
+            self._out += body
+            body = None
+        self._pos = 0
+        self._body = body
+
+        self.job = job
+        self._parser = _ResponseParser(job.method == 'HEAD')
+        self._received = False
+        if self.transport.timeout is not None:
+            self.deadline = time.time() + self.transport.timeout
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        if self.connecting:
+            return True
+        return self.job is not None and (self._pos < len(self._out) or self._body is not None)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        if self._pos >= len(self._out) and self._body is not None:
+            self._out = self._body.read(_BUF_SIZE)
+            self._pos = 0
+            if not self._out:
+                self._body = None
+        if self._pos < len(self._out):
+            self._pos += self.send(buffer(self._out, self._pos))
+
+    def handle_read(self):
+        data = self.recv(_BUF_SIZE)
+        if not data or self.job is None:
+            return
+        self._received = True
+        if self._parser.feed(data):
+            self._complete()
+
+    def _complete(self):
+        '''the response has been received.'''
+        job, parser = self.job, self._parser
+        self.job = self._parser = None
+        self.deadline = None
+        self.transport._response(self, job, parser)
+
+    def handle_close(self):
+        if self.job is not None and self._parser.feed_eof():
+            self._complete()
+            return
+        self.close()
+        job, self.job = self.job, None
+        if job is None:
+            return
+        # a reused keep-alive connection may have been dropped by the server,
+        # but a request that is not idempotent may have been handled.
+        if self.reused and not self._received and job.idempotent and connection._rewind(job.body):
+            self.transport._start(job)
+        else:
+            self.transport._failed(job, (socket.error, socket.error('connection closed'), None))
+
+    def handle_error(self):
+        exc_info = sys.exc_info()
+        self.close()
+        job, self.job = self.job, None
+        if job is not None:
+            self.transport._failed(job, exc_info)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self.transport._discard(self)
+
+
+class _Transport:
+    '''
+    sends requests on the event loop, at most "max_in_flight" at a time,
+    the rest wait in a queue.
+    '''
+
+    def __init__(self, max_in_flight, timeout):
+        '''init with the concurrency limit and the timeout of a request.'''
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.in_flight = 0
+        self.loop = _EventLoop()
+        self.loop.tick = self._check_timeouts
+        self._pending = collections.deque()
+        self._idle = {}
+
+    def submit(self, request, parse, idempotent=True):
+        '''queue a signed request, return a Future of parse(body).'''
+        future = futures.Future()
+        self.loop.call_soon(self._enqueue, _Job(request, parse, future, idempotent))
+        return future
+
+    def close(self):
+        '''stop the event loop.'''
+        self.loop.close()
+
+    def _enqueue(self, job):
+        self._pending.append(job)
+        self._dispatch()
+
+    def _dispatch(self):
+        '''start waiting requests while there are free slots.'''
+        while self._pending and self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            self._start(self._pending.popleft())
+
+    def _start(self, job):
+        '''send a request on an idle or new connection.'''
+        conn = None
+        try:
+            key, path = connection._split_url(job.url)
+            if key[0] != 'http':
+                raise ValueError('unsupported url scheme: %s' % key[0])
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+            else:
+                conn = _Connection(self, key)
+            conn.start(job, path)
+        except Exception:
+            exc_info = sys.exc_info()
+            if conn is not None:
+                conn.close()
+            self._failed(job, exc_info)
+
+    def _discard(self, conn):
+        '''forget a closed connection.'''
+        idle = self._idle.get(conn.key)
+        if idle and conn in idle:
+            idle.remove(conn)
+
+    def _release(self, conn, will_close):
+        '''keep a connection for the next request to the same host.'''
+        if will_close:
+            conn.close()
+        else:
+            conn.reused = True
+            idle = self._idle.setdefault(conn.key, [])
+            if len(idle) < self.max_in_flight:
+                idle.append(conn)
+            else:
+                conn.close()
+
+    def _response(self, conn, job, parser):
+        '''handle a complete response.'''
+        self._release(conn, parser.will_close)
+        location = parser.headers.get('location')
+        if parser.status in connection._REDIRECT_CODES and location:
+            job.url = urlparse.urljoin(job.url, location)
+            if job.redirects >= connection.MAX_REDIRECTS:
+                error = connection.RedirectError(parser.status, 'too many redirects', job.url)
+            elif parser.status == 307 and not connection._rewind(job.body):
+                error = connection.RedirectError(parser.status, 'cannot send the request body again', job.url)
+            else:
+                job.redirects += 1
+                if parser.status != 307:
+                    job.method, job.body = 'GET', None
+                    for name in job.headers.keys():
+                        if name.lower().startswith('content-'):
+                            del job.headers[name]
+                self._start(job)
+                return
+            self._failed(job, (connection.RedirectError, error, None))
+            return
+
+        self.in_flight -= 1
+        try:
+            body = connection.decode_body(parser.body(), parser.headers.get('content-encoding'))
+            if parser.status == 500:
+                raise ynote._parse_api_error(body)
+            elif parser.status >= 400:
+                raise ynote.YNoteError('HTTP_ERROR', parser.status, parser.reason)
+            result = job.parse(body)
+        except Exception:
+            job.future.set_exc_info()
+        else:
+            job.future.set_result(result)
+        self._dispatch()
+
+    def _failed(self, job, exc_info):
+        '''finish a request with an error.'''
+        self.in_flight -= 1
+        job.future.set_exception(exc_info[1], exc_info)
+        self._dispatch()
+
+    def _check_timeouts(self):
+        '''
+        fail the requests that have run longer than the timeout, return the
+        seconds until the next deadline.
+        '''
+        wait = 1.0
+        if self.timeout is None:
+            return wait
+        now = time.time()
+        for conn in self.loop.map.values():
+            deadline = getattr(conn, 'deadline', None)
+            if deadline is None or conn.job is None:
+                continue
+            if deadline < now:
+                job, conn.job = conn.job, None
+                conn.close()
+                self._failed(job, (socket.timeout, socket.timeout('timed out'), None))
+            else:
+                wait = min(wait, deadline - now)
+        return wait
+
+
+def _identity(body):
+    return body
+
+def _parse_path(body):
+    return codec.loads(body)['path']
+
+def _parse_notebooks(body):
+    return codec.load_array(body, ynote.Notebook)
+
+
+class AsyncYNoteClient:
+    """
+    Asynchronous API client for Youdao Note. It has the methods of
+    YNoteClient, but each of them returns a futures.Future at once.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, max_in_flight=64, timeout=None, coalesce=True):
+        '''
+        init with consumer key and consumer secret. At most "max_in_flight"
+        requests are sent at the same time, "timeout" is the number of
+        seconds a request may take. If "coalesce" is set, identical reads
+        made while one is running share its Future.
+        '''
+        self.consumer = oauth2.Consumer(consumer_key, consumer_secret)
+        self.access_token = None
+        self.request_token = None
+        self.single_flight = futures.SingleFlight(ynote._copy_result) if coalesce else None
+        self._transport = _Transport(max_in_flight, timeout)
+
+    def close(self):
+        '''stop the event loop of the client.'''
+        self._transport.close()
+
+    def _request(self, request_type, url, params, parse, token, progress=None, idempotent=True):
+        '''
+        sign a request and queue it, return a Future of parse(body).
+        "idempotent" is False for requests that must not be sent again.
+        '''
+        req_builder = oauth2.RequestBuilder(request_type, url, params)
+        req_builder.progress = progress
+        req = req_builder.build_signed_request(self.consumer, token)
+        if ynote.COMPRESS:
+            req.add_header('Accept-encoding', connection.ACCEPT_ENCODING)
+        return self._transport.submit(req, parse, idempotent)
+
+    def _read(self, key, fn, *args):
+        '''call fn(*args) for a Future, shared with concurrent reads of the same key.'''
+        if self.single_flight is None:
+            return fn(*args)
+        return self.single_flight.submit(key, fn, *args)
+
+    def _write(self, parse=_identity):
+        '''wrap the parser of a write, so that reads made after it make new requests.'''
+        if self.single_flight is None:
+            return parse
+        def parse_write(body):
+            self.single_flight.forget()
+            return parse(body)
+        return parse_write
+
+    def _post(self, path, params, parse=_identity, idempotent=True):
+        return self._request(oauth2.HTTP_POST_URLENCODED, ynote.BASE_URL+path, params, parse,
+                self.access_token, idempotent=idempotent)
+
+    def _post_multipart(self, path, params, parse=_identity, progress=None, idempotent=True):
+        return self._request(oauth2.HTTP_POST_MULTIPART, ynote.BASE_URL+path, params, parse,
+                self.access_token, progress, idempotent)
+
+    def grant_request_token(self, callback_url):
+        '''get request token(store in self.request_token), future of authorization url.'''
+        params = {'oauth_callback':callback_url or 'oob'}
+
+        def parse(body):
+            res_dict = ynote._parse_urlencoded(body)
+            self.request_token = oauth2.Token(res_dict['oauth_token'], res_dict['oauth_token_secret'])
+            auth_url = ynote.BASE_URL + 'oauth/authorize?oauth_token=' + self.request_token.key
+            if callback_url:
+                auth_url += '&oauth_callback=' + callback_url
+            return auth_url
+
+        return self._request(oauth2.HTTP_GET, ynote.BASE_URL+'oauth/request_token', params, parse, None)
+
+    def grant_access_token(self, verifier):
+        '''get access token(store in self.access_token).'''
+        params = {
+            'oauth_token':self.request_token.key,
+            'oauth_verifier':verifier
+        }
+
+        def parse(body):
+            res_dict = ynote._parse_urlencoded(body)
+            self.access_token = oauth2.Token(res_dict['oauth_token'], res_dict['oauth_token_secret'])
+
+        return self._request(oauth2.HTTP_GET, ynote.BASE_URL+'oauth/access_token', params, parse,
+                self.request_token)
+
+    def set_access_token(self, token_key, token_secret):
+        '''set the access token'''
+        self.access_token = oauth2.Token(token_key, token_secret)
+
+    def get_access_token(self):
+        '''get current access token as key,secret'''
+        if self.access_token:
+            return self.access_token.key, self.access_token.secret
+        else:
+            return "", ""
+
+    def get_user(self):
+        '''get user information, future of a User object.'''
+        return self._read(('user',), self._request, oauth2.HTTP_GET, ynote.BASE_URL+'yws/open/user/get.json',
+                None, lambda body: ynote.User(codec.loads(body)), self.access_token)
+
+    def get_notebooks(self):
+        '''get all notebooks, future of a list of Notebook objects.'''
+        return self._read(('notebooks',), self._post, 'yws/open/notebook/all.json', None, _parse_notebooks)
+
+    def get_note_paths(self, book_path):
+        '''get path of all notes in a notebook, future of a list of path strings.'''
+        return self._read(('note_paths', book_path), self._post, 'yws/open/notebook/list.json',
+                {'notebook':book_path}, codec.loads)
+
+    def create_notebook(self, name, create_time=None):
+        '''create a notebook with specified name, future of its path.'''
+        params = {'name':name}
+        if create_time:
+            params['create_time'] = create_time
+        return self._post('yws/open/notebook/create.json', params, self._write(_parse_path),
+                idempotent=False)
+
+    def delete_notebook(self, path):
+        '''delete a notebook with specified path.'''
+        return self._post('yws/open/notebook/delete.json', {'notebook':path}, self._write())
+
+    def get_note(self, path):
+        '''get a note with specified path, future of a Note object.'''
+        return self._read(('note', path), self._post, 'yws/open/note/get.json', {'path':path},
+                lambda body: ynote.Note(codec.loads(body)))
+
+    def create_note(self, book_path, note):
+        '''create a note in a notebook with information specified in "note", future of its path.'''
+        params = {
+            'source':note.source,
+            'author':note.author,
+            'title':note.title,
+            'content':note.content,
+            'notebook':book_path
+        }
+        return self._post_multipart('yws/open/note/create.json', params, self._write(_parse_path),
+                idempotent=False)
+
+    def create_note_with_attributes(self, book_path, content, **kw):
+        '''create a note with attributes given by parameters, future of its path.'''
+        params = {'notebook':book_path, 'content':content}
+        for name in ('source', 'author', 'title', 'create_time'):
+            if name in kw:
+                params[name] = kw[name]
+        return self._post_multipart('yws/open/note/create.json', params, self._write(_parse_path),
+                idempotent=False)
+
+    def update_note(self, note, modify_time=None):
+        '''
+        update the note with information in "note", future of True. Only
+        the fields changed since the note was loaded are sent; if none has
+        changed, nothing is sent and the future is done at once with False.
+        '''
+        fields = note.changed_fields()
+        if not fields:
+            future = futures.Future()
+            future.set_result(False)
+            return future
+        params = dict(fields)
+        params['path'] = note.path
+        if modify_time:
+            params['modify_time'] = modify_time
+
+        def parse(body):
+            note.mark_clean(fields)
+            return True
+        return self._post_multipart('yws/open/note/update.json', params, self._write(parse))
+
+    def update_note_attributes(self, note_path, **kw):
+        '''update the some attributes(given by kw) of the note.'''
+        params = {'path':note_path}
+        for name in ('source', 'author', 'title', 'content', 'modify_time'):
+            if name in kw:
+                params[name] = kw[name]
+        return self._post_multipart('yws/open/note/update.json', params, self._write())
+
+    def move_note(self, note_path, book_path):
+        '''move note to the notebook with path denoted by "book_path", future of the new path.'''
+        params = {
+            'path':note_path,
+            'notebook':book_path
+        }
+        return self._post('yws/open/note/move.json', params, self._write(_parse_path),
+                idempotent=False)
+
+    def delete_note(self, note_path):
+        '''delete a note with specified path.'''
+        return self._post('yws/open/note/delete.json', {'path':note_path}, self._write())
+
+    def share_note(self, note_path):
+        '''share a note with specified path, future of the shared url.'''
+        return self._post('yws/open/share/publish.json', {'path':note_path},
+                lambda body: ynote._fix_url(codec.loads(body)['url']))
+
+    def upload_resource(self, res_file, progress=None):
+        '''upload a file as a resource, future of a Resource object.'''
+        return self._post_multipart('yws/open/resource/upload.json', {'file':res_file},
+                lambda body: ynote.Resource(codec.loads(body)), progress, False)
+
+    def download_resource(self, resource_url):
+        '''download a resource file with specified url, future of its content.'''
+        return self._read(('resource', resource_url), self._request, oauth2.HTTP_GET, resource_url,
+                None, _identity, self.access_token)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Bulk import of notes with attachments into Youdao Note.
+'''
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import hashlib
+import os
+import re
+import threading
+
+import ynote, futures
+
+# fields of a note spec passed on to create_note_with_attributes.
+_NOTE_FIELDS = ('source', 'author', 'title', 'create_time')
+
+_PLACEHOLDER_RE = re.compile(r'\{\{resource:(\d+)\}\}')
+
+
+def read_specs(f):
+    '''yield the note specs of a JSON-lines file object, skipping blank lines.'''
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _spec_id(spec):
+    '''get the id of a spec, derived from its fields if it has none.'''
+    if spec.get('id') is not None:
+        return unicode(spec['id'])
+    return hashlib.sha1(json.dumps(spec, sort_keys=True)).hexdigest()
+
+def _render(content, resources):
+    '''
+    put the resource tags into the content: "{{resource:N}}" is replaced by
+    the tag of attachment N, and the attachments not referenced are
+    appended in order.
+    '''
+    tags = [ynote.Resource({'url':url, 'src':icon}).to_resource_tag() for url, icon in resources]
+    used = set()
+
+    def replace(match):
+        i = int(match.group(1))
+        if i >= len(tags):
+            return match.group()
+        used.add(i)
+        return tags[i]
+    content = _PLACEHOLDER_RE.sub(replace, content or '')
+    return content + ''.join([tag for i, tag in enumerate(tags) if i not in used])
+
+
+class Importer:
+    '''
+    Imports note specs: dictionaries with the "content" of a note, its
+    "title", "author", "source" and "create_time", the "notebook" to put it
+    in(the default one of the importer if it is missing), the local file
+    paths of its "attachments" and an "id" that names it across runs.
+    Attachments are uploaded on "max_uploads" threads, and notes are
+    created on "max_workers" threads.
+
+    Progress is appended to the "checkpoint" file, so a run that was
+    stopped can be started again with the same specs: notes already
+    created are skipped and uploaded attachments are not uploaded again.
+    A note whose creation was cut off is looked for in its notebook before
+    it is created again.
+    '''
+
+    def __init__(self, client, checkpoint=None, notebook=None, max_workers=8, max_uploads=8,
+                 sync=False):
+        '''
+        init with the YNoteClient that creates the notes. "notebook" is the
+        default notebook path, the default notebook of the user if None.
+        If "sync" is set, the checkpoint is flushed to the disk after each
+        write.
+        '''
+        self.client = client
+        self.checkpoint = checkpoint
+        self.notebook = notebook
+        self.max_workers = max_workers
+        self.max_uploads = max_uploads
+        self.sync = sync
+        self._state = {}
+        self._lock = threading.Lock()
+        self._journal = None
+        if checkpoint is not None:
+            self._open_checkpoint(checkpoint)
+
+    def _open_checkpoint(self, path):
+        '''load the progress of earlier runs, then rewrite the file compacted.'''
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line of a stopped run may be cut short.
+                        continue
+                    self._state.setdefault(record.pop('id'), {}).update(record)
+            finally:
+                f.close()
+
+        tmp = path + '.tmp'
+        self._journal = open(tmp, 'wb')
+        for id, state in self._state.items():
+            if 'path' in state:
+                # the uploads of a created note are no longer needed.
+                state = {'path':state['path']}
+                self._state[id] = state
+            self._log(id, state)
+        self._journal.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        self._journal = open(path, 'ab')
+
+    def _log(self, id, record):
+        '''append a record of a spec to the checkpoint, holding the lock.'''
+        if self._journal is None:
+            return
+        record = dict(record)
+        record['id'] = id
+        self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        if self.sync:
+            os.fsync(self._journal.fileno())
+
+    def _update(self, id, **record):
+        '''record the progress of a spec.'''
+        self._lock.acquire()
+        try:
+            self._state.setdefault(id, {}).update(record)
+            self._log(id, record)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        '''close the checkpoint file.'''
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def run(self, specs):
+        '''
+        import the specs, an iterable of dictionaries or a JSON-lines file
+        object, return statistics of the run as a dictionary. The specs
+        that failed are listed in stats['errors'] by id and are tried
+        again by the next run.
+        '''
+        if hasattr(specs, 'read'):
+            specs = read_specs(specs)
+        stats = {
+            'notes_created':0,
+            'notes_skipped':0,
+            'notes_recovered':0,
+            'resources_uploaded':0,
+            'errors':{},
+        }
+        if self.notebook is None:
+            self.notebook = self.client.get_user().default_notebook
+        self._recover(stats)
+
+        upload_pool = futures.WorkerPool(self.max_uploads)
+        pool = futures.WorkerPool(self.max_workers)
+        # specs are read as the workers take them, so few are held at once.
+        window = threading.Semaphore(self.max_workers * 2)
+        try:
+            for spec in specs:
+                window.acquire()
+                future = pool.submit(self._import, spec, upload_pool, stats)
+                future.add_done_callback(lambda f: window.release())
+            for i in range(self.max_workers * 2):
+                window.acquire()
+        finally:
+            pool.shutdown()
+            upload_pool.shutdown()
+        return stats
+
+    def _count(self, stats, name, n=1):
+        self._lock.acquire()
+        try:
+            stats[name] += n
+        finally:
+            self._lock.release()
+
+    def _recover(self, stats):
+        '''
+        find the notes whose creation was cut off by a stopped run among the
+        notes of their notebooks that no spec created.
+        '''
+        pending = {}
+        known = set()
+        for id, state in self._state.items():
+            if 'path' in state:
+                known.add(state['path'])
+            elif 'creating' in state:
+                # specs with the same content each claim a note of their own.
+                pending.setdefault(state['creating'], {}).setdefault(state['digest'], []).append(id)
+
+        for book_path, digests in pending.items():
+            try:
+                paths = [p for p in self.client.get_note_paths(book_path) if p not in known]
+            except ynote.YNoteError:
+                continue
+            for path, note, error in self.client.get_notes(paths, self.max_workers, False):
+                if error is not None:
+                    continue
+                ids = digests.get(note.content_hash())
+                if ids:
+                    id = ids.pop(0)
+                    self._update(id, path=note.path)
+                    stats['notes_recovered'] += 1
+
+    def _upload(self, file_path):
+        '''upload an attachment, return [url, icon] of the resource.'''
+        f = open(file_path, 'rb')
+        try:
+            resource = self.client.upload_resource(f)
+        finally:
+            f.close()
+        return [resource.url, resource.icon]
+
+    def _import(self, spec, upload_pool, stats):
+        '''worker thread: upload the attachments of a spec and create its note.'''
+        id = _spec_id(spec)
+        try:
+            self._lock.acquire()
+            try:
+                state = dict(self._state.get(id, {}))
+            finally:
+                self._lock.release()
+            if 'path' in state:
+                self._count(stats, 'notes_skipped')
+                return state['path']
+
+            resources = state.get('resources')
+            if resources is None:
+                fs = [upload_pool.submit(self._upload, p) for p in spec.get('attachments', [])]
+                resources = [f.result() for f in fs]
+                self._count(stats, 'resources_uploaded', len(resources))
+                if resources:
+                    self._update(id, resources=resources)
+
+            book_path = spec.get('notebook') or self.notebook
+            content = _render(spec.get('content'), resources)
+            fields = dict([(k, spec[k]) for k in _NOTE_FIELDS if spec.get(k) is not None])
+            self._update(id, creating=book_path, digest=ynote._content_hash(content))
+            path = self.client.create_note_with_attributes(book_path, content, **fields)
+            self._update(id, path=path)
+            self._count(stats, 'notes_created')
+            return path
+        except Exception, e:
+            self._lock.acquire()
+            try:
+                stats['errors'][id] = e
+            finally:
+                self._lock.release()
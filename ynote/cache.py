@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+In-memory caches for Youdao Note client SDK.
+'''
+
+import collections
+import copy
+import threading
+import time
+
+
+class LRUCache:
+    '''
+    Thread-safe mapping with a bounded number of entries, evicting the least
+    recently used one. Entries remember when they were stored.
+    '''
+
+    def __init__(self, max_size=1024, ttl=None):
+        '''init with the maximum number of entries and their time to live.'''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get_entry(self, key):
+        '''get (value, stored_time) even if expired, None if missing.'''
+        self._lock.acquire()
+        try:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data[key] = entry
+            return entry
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        '''get a value that has not expired.'''
+        entry = self.get_entry(key)
+        if entry is None:
+            return default
+        if self.ttl is not None and time.time() - entry[1] > self.ttl:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, stored_time=None):
+        '''store a value, return the list of (key, value) evicted for it.'''
+        if stored_time is None:
+            stored_time = time.time()
+        evicted = []
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = (value, stored_time)
+            while len(self._data) > self.max_size:
+                k, entry = self._data.popitem(last=False)
+                evicted.append((k, entry[0]))
+            self.evictions += len(evicted)
+        finally:
+            self._lock.release()
+        return evicted
+
+    def touch(self, key):
+        '''mark an entry as stored now.'''
+        self._lock.acquire()
+        try:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], time.time())
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        '''remove an entry, return its value.'''
+        self._lock.acquire()
+        try:
+            entry = self._data.pop(key, None)
+        finally:
+            self._lock.release()
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        '''remove all entries.'''
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+
+# results of MetadataCache lookups.
+MISS = 0
+HIT = 1
+STALE = 2
+
+
+class MetadataCache:
+    '''
+    Cache of notebooks, note path lists and notes for YNoteClient.
+
+    Entries live for "ttl" seconds. After that, note path lists and notes
+    whose notebook is known stay valid as long as the notebook list, fetched
+    again after they were stored, shows the same modify_time and notes_num
+    for their notebook: one get_notebooks call revalidates all of them.
+    '''
+
+    def __init__(self, max_notes=1024, max_lists=256, ttl=60):
+        '''init with the cache sizes and the time to live of the entries.'''
+        self.ttl = ttl
+        self.notes = LRUCache(max_notes, ttl)
+        self.note_paths = LRUCache(max_lists, ttl)
+        self.revalidations = 0
+        self._notebooks = None
+        self._notebooks_time = 0
+        self._stamps = {}
+        self._book_of = {}
+        self._lock = threading.RLock()
+
+    def _fresh(self, stored_time):
+        return time.time() - stored_time <= self.ttl
+
+    def _lookup(self, lru, key, book_path):
+        '''find an entry, return (value, HIT|STALE|MISS).'''
+        entry = lru.get_entry(key)
+        if entry is None:
+            return None, MISS
+        value, stored_time = entry
+        if self._fresh(stored_time):
+            lru.hits += 1
+            return value, HIT
+        if book_path is None or book_path not in self._stamps:
+            lru.pop(key)
+            lru.misses += 1
+            return None, MISS
+        if self._notebooks is not None and self._fresh(self._notebooks_time) \
+                and self._notebooks_time >= stored_time:
+            # the notebook has been checked since the entry was stored.
+            lru.touch(key)
+            lru.hits += 1
+            self.revalidations += 1
+            return value, HIT
+        return None, STALE
+
+    def get_notebooks(self):
+        '''get the cached notebooks, None if missing or expired.'''
+        self._lock.acquire()
+        try:
+            if self._notebooks is None or not self._fresh(self._notebooks_time):
+                return None
+            return [copy.copy(book) for book in self._notebooks]
+        finally:
+            self._lock.release()
+
+    def put_notebooks(self, books):
+        '''store the notebooks, dropping what belongs to modified notebooks.'''
+        self._lock.acquire()
+        try:
+            stamps = dict([(b.path, (b.modify_time, b.notes_num)) for b in books])
+            for path, stamp in self._stamps.items():
+                if stamps.get(path) != stamp:
+                    self._drop_book(path)
+            self._stamps = stamps
+            self._notebooks = [copy.copy(book) for book in books]
+            self._notebooks_time = time.time()
+        finally:
+            self._lock.release()
+
+    def get_note_paths(self, book_path):
+        '''get the cached paths of a notebook, return (paths, HIT|STALE|MISS).'''
+        self._lock.acquire()
+        try:
+            paths, state = self._lookup(self.note_paths, book_path, book_path)
+            if paths is not None:
+                paths = list(paths)
+            return paths, state
+        finally:
+            self._lock.release()
+
+    def put_note_paths(self, book_path, paths):
+        '''store the paths of the notes in a notebook.'''
+        self._lock.acquire()
+        try:
+            self._forget_paths(self.note_paths.pop(book_path, []))
+            for path in paths:
+                self._book_of[path] = book_path
+            for book, old_paths in self.note_paths.set(book_path, list(paths)):
+                self._forget_paths(old_paths)
+        finally:
+            self._lock.release()
+
+    def get_note(self, path):
+        '''get a cached note, return (note, HIT|STALE|MISS).'''
+        self._lock.acquire()
+        try:
+            note, state = self._lookup(self.notes, path, self._book_of.get(path))
+            if note is not None:
+                note = copy.copy(note)
+            return note, state
+        finally:
+            self._lock.release()
+
+    def put_note(self, note):
+        '''store a note.'''
+        self._lock.acquire()
+        try:
+            self.notes.set(note.path, copy.copy(note))
+        finally:
+            self._lock.release()
+
+    def _forget_paths(self, paths):
+        '''forget which notebook the paths belong to.'''
+        for path in paths:
+            self._book_of.pop(path, None)
+
+    def _drop_book(self, book_path):
+        '''drop the path list and the notes of a notebook.'''
+        paths = self.note_paths.pop(book_path, [])
+        for path in paths:
+            self.notes.pop(path)
+        self._forget_paths(paths)
+        self._stamps.pop(book_path, None)
+
+    def invalidate_notebooks(self):
+        '''make the next get_notebooks call ask the server.'''
+        self._lock.acquire()
+        try:
+            self._notebooks = None
+        finally:
+            self._lock.release()
+
+    def invalidate_book(self, book_path):
+        '''drop the path list of a notebook.'''
+        self._lock.acquire()
+        try:
+            self._forget_paths(self.note_paths.pop(book_path, []))
+            self._notebooks = None
+        finally:
+            self._lock.release()
+
+    def invalidate_note(self, path, list_changed=False):
+        '''
+        drop a note, and the path list of its notebook if "list_changed"
+        is set because the note was moved or deleted.
+        '''
+        self._lock.acquire()
+        try:
+            self.notes.pop(path)
+            book_path = self._book_of.get(path)
+            if list_changed and book_path is not None:
+                self.invalidate_book(book_path)
+            self._notebooks = None
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''drop everything.'''
+        self._lock.acquire()
+        try:
+            self.notes.clear()
+            self.note_paths.clear()
+            self._notebooks = None
+            self._stamps = {}
+            self._book_of = {}
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        '''get cache statistics as a dictionary.'''
+        return {
+            'note_hits':self.notes.hits,
+            'note_misses':self.notes.misses,
+            'list_hits':self.note_paths.hits,
+            'list_misses':self.note_paths.misses,
+            'revalidations':self.revalidations,
+            'evictions':self.notes.evictions + self.note_paths.evictions,
+        }
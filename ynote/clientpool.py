@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Clients of many Youdao Note accounts sharing one transport.
+'''
+
+import threading
+import weakref
+
+import ynote, oauth2, connection, futures, limiter
+
+
+class _Tenant:
+    '''
+    the concurrency limiter of one account: a fair slot first, then a token
+    of the shared rate limiter, so that the rate is shared in turn as well.
+    '''
+
+    def __init__(self, clients, key):
+        self.clients = clients
+        self.key = key
+
+    def acquire(self):
+        self.clients.scheduler.acquire(self.key)
+        if self.clients.rate_limiter is not None:
+            self.clients.rate_limiter.acquire()
+
+    def release(self, latency, overloaded=False):
+        self.clients.scheduler.release(self.key)
+
+
+class AccountClient(ynote.YNoteClient):
+    '''
+    YNoteClient of one account of a ClientPool. It holds the access token
+    and its own hooks, and shares everything else with the pool; it has no
+    cache or store.
+    '''
+
+    def __init__(self, clients, token):
+        '''init with the owning ClientPool and the oauth2.Token of the account.'''
+        # the rate limiter is taken by _Tenant, after the fair slot.
+        ynote.YNoteClient.__init__(self, clients.consumer.key, clients.consumer.secret,
+                pool=clients.pool, retry_policy=clients.retry_policy,
+                concurrency_limiter=_Tenant(clients, token.key), coalesce=False)
+        self.clients = clients
+        self.consumer = clients.consumer
+        self.single_flight = clients.single_flight
+        self.access_token = token
+
+    def _hooks(self):
+        '''get the hooks of the pool, then those of this account.'''
+        return self.clients.hooks + self.hooks
+
+    def _read(self, key, fn, *args):
+        '''call fn(*args), sharing the call with concurrent reads of this account.'''
+        if self.single_flight is None:
+            return fn(*args)
+        return self.single_flight.do((self.access_token.key,) + key, fn, *args)
+
+    def _forget_reads(self):
+        '''after a write, let later reads of this account make new requests.'''
+        if self.single_flight is not None:
+            self.single_flight.forget(prefix=(self.access_token.key,))
+
+
+class ClientPool:
+    '''
+    Clients of many accounts of one consumer. They share the connection
+    pool, the retry policy, the rate limiter, the coalescing of reads and
+    the hooks, and a limiter.FairScheduler lets at most "max_in_flight"
+    requests run at once, at most "account_limit" of one account if it is
+    given, so a busy account cannot starve the others.
+    '''
+
+    def __init__(self, consumer_key, consumer_secret, pool=None, max_in_flight=16, account_limit=None,
+                 retry_policy=None, rate_limiter=None, coalesce=True):
+        '''
+        init with consumer key and consumer secret. "pool" is the
+        connection.ConnectionPool of all the accounts, a new one is created
+        if it is not given. "rate_limiter" is an optional
+        limiter.TokenBucket of all the accounts.
+        '''
+        self.consumer = oauth2.Consumer(consumer_key, consumer_secret)
+        self.pool = pool if pool is not None else connection.ConnectionPool(max_in_flight)
+        self.scheduler = limiter.FairScheduler(max_in_flight, account_limit)
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.single_flight = futures.SingleFlight(ynote._copy_result) if coalesce else None
+        self.hooks = []
+        self._clients = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def client(self, token_key, token_secret):
+        '''
+        get the AccountClient of an access token. The same one is returned
+        while it is in use, and it is dropped once it is not.
+        '''
+        self._lock.acquire()
+        try:
+            client = self._clients.get(token_key)
+            if client is None or client.access_token.secret != token_secret:
+                client = AccountClient(self, oauth2.Token(token_key, token_secret))
+                self._clients[token_key] = client
+            return client
+        finally:
+            self._lock.release()
+
+    def add_hook(self, hook):
+        '''call hook(event) with an instrument.RequestEvent after every request of every account.'''
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        '''stop calling a hook.'''
+        self.hooks.remove(hook)
+
+    def close(self):
+        '''close the idle connections.'''
+        self.pool.close()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+JSON codec of Youdao Note client SDK. The fastest backend installed is used:
+ujson, then simplejson, then the json module of the standard library.
+'''
+
+import codecs
+
+try:
+    import json as _stdjson
+except ImportError:
+    import simplejson as _stdjson
+
+# backends in the order they are preferred.
+BACKENDS = ('ujson', 'simplejson', 'json')
+
+# bytes read at a time from a response decoded incrementally.
+CHUNK_SIZE = 16 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+backend = None
+loads = None
+dumps = None
+_decoder = None
+
+
+def use(name):
+    '''
+    use the backend "name" from BACKENDS, raise ImportError if it is not
+    installed. The incremental decoder uses simplejson or json, since
+    ujson cannot decode a prefix of a document.
+    '''
+    global backend, loads, dumps, _decoder
+    module = __import__(name)
+    if hasattr(module, 'JSONDecoder'):
+        decoder = module.JSONDecoder()
+    else:
+        decoder = _stdjson.JSONDecoder()
+    backend, loads, dumps, _decoder = name, module.loads, module.dumps, decoder
+
+for _name in BACKENDS:
+    try:
+        use(_name)
+        break
+    except ImportError:
+        pass
+
+
+def _chunks(source):
+    '''yield the text of a string or a file-like object, a chunk at a time.'''
+    if isinstance(source, basestring):
+        yield source
+        return
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_array(source, convert=None):
+    '''
+    decode a JSON array from a string or a file-like object, yielding its
+    elements one at a time, or convert(element) if "convert" is given. A
+    file is read as the elements are needed, so neither the whole body
+    nor all the decoded elements are held at once.
+    '''
+    decoder = _decoder
+    chunks = _chunks(source)
+    # a chunk may end in the middle of a character.
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    pos = 0
+    eof = False
+    started = False
+    # a failed decode is tried again only once the buffer has doubled, so
+    # an element larger than a chunk is not decoded again at every chunk.
+    need = 0
+
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+
+        if pos < len(buf) and (len(buf) - pos >= need or eof):
+            c = buf[pos]
+            if not started:
+                if c != '[':
+                    raise ValueError('expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if c == ']':
+                return
+            if c == ',':
+                pos += 1
+                continue
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                value, end = None, None
+            if end is not None and not eof and c not in '{["':
+                # a number or literal cut by the end of a chunk decodes as a
+                # shorter one: it is complete only once "," or "]" follows.
+                after = end
+                while after < len(buf) and buf[after] in _WHITESPACE:
+                    after += 1
+                if after == len(buf) or buf[after] not in ',]':
+                    end = None
+            if end is not None:
+                pos = end
+                need = 0
+                if convert is not None:
+                    value = convert(value)
+                yield value
+                continue
+            need = 2 * (len(buf) - pos)
+        elif eof:
+            raise ValueError('unterminated JSON array')
+
+        # keep what is left of the buffer, then read more.
+        buf = buf[pos:]
+        pos = 0
+        try:
+            chunk = chunks.next()
+        except StopIteration:
+            chunk = ''
+            eof = True
+        if isinstance(chunk, unicode):
+            buf += chunk
+        else:
+            buf += text.decode(chunk, eof)
+
+def load_array(source, convert=None):
+    '''decode a JSON array like iter_array, return the elements as a list.'''
+    return list(iter_array(source, convert))
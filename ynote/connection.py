@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Keep-alive HTTP connection pool for Youdao Note client SDK.
+'''
+
+import httplib
+import select
+import socket
+import StringIO
+import threading
+import time
+import urlparse
+import zlib
+
+# http status codes that make the pool follow the Location header.
+_REDIRECT_CODES = (301, 302, 303, 307)
+
+# redirects followed for one request.
+MAX_REDIRECTS = 5
+
+# content codings a compressed request accepts.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# bytes read at a time from a compressed body.
+_CHUNK_SIZE = 16 * 1024
+
+
+def _split_url(url):
+    '''split an url into (pool key, request path).'''
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower() or 'http'
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return (scheme, parts.hostname, port), path
+
+
+def _dropped(conn):
+    '''
+    tell whether the server has closed an idle connection: an idle socket
+    that is readable has hit the end or holds data nobody asked for.
+    '''
+    if conn.sock is None:
+        return True
+    try:
+        # select cannot watch a descriptor beyond FD_SETSIZE, poll can.
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(conn.sock, select.POLLIN | select.POLLPRI)
+            return bool(poller.poll(0))
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+class RedirectError(StandardError):
+    '''
+    a redirect that was not followed: there were too many, or a 307 asked
+    to send again a request body that cannot be read again.
+    '''
+
+    def __init__(self, status, message, url):
+        StandardError.__init__(self, '%s: %s' % (message, url))
+        self.status = status
+        self.url = url
+
+
+def _rewind(body):
+    '''get a request body ready to be sent again, return False if impossible.'''
+    if body is None or isinstance(body, basestring):
+        return True
+    reset = getattr(body, 'reset', None)
+    return reset is not None and reset()
+
+
+class PooledResponse:
+    '''
+    http response that gives its connection back to the pool once the body
+    has been read completely.
+    '''
+
+    def __init__(self, pool, key, conn, resp):
+        '''init with the owning pool and an httplib response.'''
+        self.status = resp.status
+        self.reason = resp.reason
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+    def getheader(self, name, default=None):
+        '''get a response header.'''
+        return self._resp.getheader(name, default)
+
+    def getheaders(self):
+        '''get all response headers as a list of (name, value).'''
+        return self._resp.getheaders()
+
+    def read(self, amt=None):
+        '''read at most "amt" bytes of the body, or all of it.'''
+        if self._conn is None:
+            return ''
+        try:
+            data = self._resp.read(amt)
+        except:
+            self._release(False)
+            raise
+        if amt is None or not data or self._resp.isclosed():
+            self._release(True)
+        return data
+
+    def close(self):
+        '''close the response, dropping the connection if the body is unread.'''
+        self._release(self._resp.isclosed())
+
+    def _release(self, reusable):
+        '''return the connection to the pool, or close it.'''
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if reusable and not self._resp.will_close:
+            self._pool._put(self._key, conn)
+        else:
+            conn.close()
+
+
+class DecodingResponse:
+    '''
+    http response whose body is decompressed as it is read, according to
+    its Content-Encoding. A body that turns out not to be compressed is
+    passed through as it is. Other attributes are those of the response.
+    '''
+
+    def __init__(self, resp, encoding, counter=None):
+        '''
+        init with a response and its content coding. "counter" is called
+        with the bytes received and the bytes decoded as they are read.
+        '''
+        self._resp = resp
+        self._counter = counter
+        self.encoding = (encoding or '').strip().lower()
+        self.compressed_bytes = 0
+        self.decoded_bytes = 0
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._decomp = zlib.decompressobj()
+        else:
+            self._decomp = None
+        self._started = False
+        self._buf = ''
+        self._eof = False
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+    def _decompress(self, data, max_length):
+        '''decompress some data, falling back when the body is not what it claims.'''
+        try:
+            out = self._decomp.decompress(data, max_length)
+        except zlib.error:
+            if self._started:
+                raise
+            if self.encoding == 'deflate':
+                # some servers send raw deflate data without the zlib header.
+                self._decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+                self.encoding = 'raw-deflate'
+                return self._decompress(data, max_length)
+            # not compressed at all.
+            self._decomp = None
+            out = data
+        self._started = True
+        return out
+
+    def _fill(self, amt):
+        '''decode until "amt" bytes are buffered, or the whole body if amt is None.'''
+        while not self._eof and (amt is None or len(self._buf) < amt):
+            data = self._decomp.unconsumed_tail if self._decomp is not None else ''
+            received = 0
+            if not data:
+                data = self._resp.read(_CHUNK_SIZE)
+                received = len(data)
+            if not data:
+                out = self._decomp.flush() if self._decomp is not None else ''
+                self._eof = True
+            elif self._decomp is None:
+                out = data
+            else:
+                out = self._decompress(data, amt - len(self._buf) if amt is not None else 0)
+            self._buf += out
+            self.compressed_bytes += received
+            self.decoded_bytes += len(out)
+            if self._counter is not None:
+                self._counter(received, len(out))
+
+    def read(self, amt=None):
+        '''read at most "amt" decoded bytes of the body, or all of it.'''
+        if self._decomp is None and not self._started and not self._buf:
+            # an identity body needs no buffering.
+            data = self._resp.read(amt) if amt is not None else self._resp.read()
+            self.compressed_bytes += len(data)
+            self.decoded_bytes += len(data)
+            if self._counter is not None:
+                self._counter(len(data), len(data))
+            return data
+        self._fill(amt)
+        if amt is None:
+            data, self._buf = self._buf, ''
+        else:
+            data, self._buf = self._buf[:amt], self._buf[amt:]
+        return data
+
+    def close(self):
+        '''close the response.'''
+        self._resp.close()
+
+
+def decode_body(body, encoding):
+    '''decompress a whole body according to its Content-Encoding.'''
+    if not encoding:
+        return body
+    return DecodingResponse(StringIO.StringIO(body), encoding).read()
+
+
+class ConnectionPool:
+    '''
+    Thread-safe pool of keep-alive http connections, keyed by
+    (scheme, host, port).
+    '''
+
+    def __init__(self, max_size=8, idle_timeout=60, timeout=None):
+        '''
+        init the pool. "max_size" is the number of idle connections kept for
+        each host, "idle_timeout" is the number of seconds an idle connection
+        may stay in the pool, "timeout" is the socket timeout.
+        '''
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_conn(self, key):
+        '''create a connection for the key.'''
+        scheme, host, port = key
+        if scheme == 'https':
+            conn_cls = httplib.HTTPSConnection
+        else:
+            conn_cls = httplib.HTTPConnection
+        if self.timeout is None:
+            return conn_cls(host, port)
+        return conn_cls(host, port, timeout=self.timeout)
+
+    def _get(self, key):
+        '''take an idle connection for the key, or create one.'''
+        now = time.time()
+        stale = []
+        conn = None
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                c, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout and not _dropped(c):
+                    conn = c
+                    break
+                stale.append(c)
+            if conn is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self._lock.release()
+
+        for c in stale:
+            c.close()
+        if conn is None:
+            return self._new_conn(key), False
+        return conn, True
+
+    def _put(self, key, conn):
+        '''give a connection back to the pool.'''
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((conn, time.time()))
+                conn = None
+        finally:
+            self._lock.release()
+
+        if conn is not None:
+            conn.close()
+
+    def prewarm(self, url, count=1):
+        '''open "count" connections to the host of "url" ahead of time.'''
+        key, path = _split_url(url)
+        for i in range(count):
+            conn = self._new_conn(key)
+            conn.connect()
+            self._put(key, conn)
+
+    def evict_idle(self):
+        '''close the connections that have been idle for too long.'''
+        deadline = time.time() - self.idle_timeout
+        stale = []
+        self._lock.acquire()
+        try:
+            for key, idle in self._idle.items():
+                stale.extend([c for c, t in idle if t < deadline])
+                self._idle[key] = [(c, t) for c, t in idle if t >= deadline]
+        finally:
+            self._lock.release()
+
+        for c in stale:
+            c.close()
+        return len(stale)
+
+    def close(self):
+        '''close all idle connections.'''
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+
+        for conns in idle.values():
+            for c, t in conns:
+                c.close()
+
+    def stats(self):
+        '''get pool statistics as a dictionary.'''
+        self._lock.acquire()
+        try:
+            return {
+                'hits':self.hits,
+                'misses':self.misses,
+                'idle':sum([len(v) for v in self._idle.values()]),
+                'bytes_received':self.bytes_received,
+                'bytes_decoded':self.bytes_decoded,
+            }
+        finally:
+            self._lock.release()
+
+    def _send(self, method, url, body, headers, idempotent=True):
+        '''send a single request, return a PooledResponse.'''
+        key, path = _split_url(url)
+        while True:
+            conn, reused = self._get(key)
+            sent = False
+            try:
+                conn.request(method, path, body, headers)
+                sent = True
+                resp = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                # the server may have dropped an idle keep-alive connection,
+                # so a failure on a reused one is retried on a fresh one. A
+                # request that was sent may have been handled: it is sent
+                # again only if it is idempotent, and never after a timeout.
+                if (reused and not isinstance(e, socket.timeout) and (idempotent or not sent)
+                        and _rewind(body)):
+                    continue
+                raise
+            return PooledResponse(self, key, conn, resp)
+
+    def _count(self, received, decoded):
+        '''add to the byte counters of compressed responses.'''
+        self._lock.acquire()
+        try:
+            self.bytes_received += received
+            self.bytes_decoded += decoded
+        finally:
+            self._lock.release()
+
+    def urlopen(self, method, url, body=None, headers=None, max_redirects=MAX_REDIRECTS, compress=False,
+                idempotent=True):
+        '''
+        send a request through a pooled connection, following at most
+        "max_redirects" redirects, or raise RedirectError, return a
+        PooledResponse whose body must be read or closed. If
+        "compress" is set, a compressed body is asked for and the response
+        is a DecodingResponse, counted in the pool's byte counters. A
+        request that is not "idempotent" is not sent again once it may
+        have reached the server.
+        '''
+        headers = dict(headers or {})
+        if compress:
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+        for i in range(max_redirects + 1):
+            resp = self._send(method, url, body, headers, idempotent)
+            location = resp.getheader('location')
+            if resp.status not in _REDIRECT_CODES or not location:
+                if compress:
+                    return DecodingResponse(resp, resp.getheader('content-encoding'), self._count)
+                return resp
+
+            resp.read()
+            url = urlparse.urljoin(url, location)
+            if i == max_redirects:
+                raise RedirectError(resp.status, 'too many redirects', url)
+            if resp.status == 307:
+                # the same request goes to the new url.
+                if not _rewind(body):
+                    raise RedirectError(resp.status, 'cannot send the request body again', url)
+            else:
+                method, body = 'GET', None
+                for name in headers.keys():
+                    if name.lower().startswith('content-'):
+                        del headers[name]
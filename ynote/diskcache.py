@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Size-bounded on-disk cache of downloaded resources.
+'''
+
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+# suffix of the files being written.
+_TMP_SUFFIX = '.tmp'
+
+# temporary files older than this many seconds were left by a crash.
+_TMP_MAX_AGE = 3600
+
+
+def _replace(src, dst):
+    '''rename "src" over "dst".'''
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+class ResourceCache:
+    '''
+    Cache of resources in the directory "directory", keyed by url, holding
+    at most "max_bytes" bytes. The least recently used files are evicted
+    first. Files are written under a temporary name and renamed, so several
+    processes can share the directory, and hits are read through mmap.
+    '''
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        '''init with the cache directory and its byte budget.'''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._total = self._scan()[0]
+
+    def _path(self, url):
+        '''get the file path for an url.'''
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def _scan(self):
+        '''
+        list the cached files, return (total_bytes, [(mtime, size, path)])
+        and remove stale temporary files on the way.
+        '''
+        now = time.time()
+        total = 0
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(_TMP_SUFFIX):
+                if now - st.st_mtime > _TMP_MAX_AGE:
+                    self._unlink(path)
+                continue
+            total += st.st_size
+            files.append((st.st_mtime, st.st_size, path))
+        return total, files
+
+    def _unlink(self, path):
+        '''remove a file that another process may have removed already.'''
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _evict(self):
+        '''remove the least recently used files until the budget is met.'''
+        total, files = self._scan()
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if self._unlink(path):
+                self.evictions += 1
+            total -= size
+        self._total = total
+
+    def _count(self, name):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def _open(self, url):
+        '''map a cached file, None if it is not there.'''
+        path = self._path(url)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            # touching the file keeps it at the recent end of the LRU order.
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def open(self, url):
+        '''
+        get a read-only mmap of a cached resource, None on a miss. The
+        caller closes the map.
+        '''
+        view = self._open(url)
+        self._count('misses' if view is None else 'hits')
+        return view
+
+    def path(self, url):
+        '''get the file path of a cached resource, None on a miss.'''
+        path = self._path(url)
+        if os.path.exists(path):
+            return path
+        return None
+
+    def put_from(self, url, write):
+        '''
+        cache a resource whose data is written by write(file_object), return
+        its size.
+        '''
+        fd, tmp = tempfile.mkstemp(suffix=_TMP_SUFFIX, dir=self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                write(f)
+            finally:
+                f.close()
+            size = os.path.getsize(tmp)
+            _replace(tmp, self._path(url))
+        except:
+            self._unlink(tmp)
+            raise
+
+        self._lock.acquire()
+        try:
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+        finally:
+            self._lock.release()
+        return size
+
+    def put(self, url, data):
+        '''cache a resource given as a string.'''
+        return self.put_from(url, lambda f: f.write(data))
+
+    def fetch(self, client, url):
+        '''get a mmap of a resource, downloading it through "client" on a miss.'''
+        view = self._open(url)
+        if view is not None:
+            self._count('hits')
+            return view
+
+        self._count('misses')
+        self.put_from(url, lambda f: client.download_resource_to(url, f, resume=False))
+        return self._open(url)
+
+    def remove(self, url):
+        '''drop a cached resource.'''
+        self._unlink(self._path(url))
+
+    def stats(self):
+        '''get cache statistics as a dictionary.'''
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'bytes':self._total,
+        }
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Export of a Youdao Note account to a tar or zip archive.
+
+usage: python -m ynote.export [options] > backup.tar
+'''
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import collections
+import optparse
+import os
+import Queue
+import struct
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+
+import ynote, futures
+from sync import _safe_name, _note_to_dict
+
+FORMATS = ('tar', 'tgz', 'zip')
+
+MANIFEST_NAME = 'manifest.json'
+
+# resources larger than this are spooled to a temporary file.
+_SPOOL_SIZE = 1 << 20
+
+# bytes copied at a time into the archive.
+_COPY_SIZE = 64 * 1024
+
+
+class _Output:
+    '''write-only file that counts what is written, for zipfile on a pipe.'''
+
+    def __init__(self, f):
+        self.f = f
+        self.written = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.written += len(data)
+
+    def tell(self):
+        return self.written
+
+    def flush(self):
+        self.f.flush()
+
+
+class _TarWriter:
+    def __init__(self, f, compress):
+        self.tar = tarfile.open(fileobj=f, mode='w|gz' if compress else 'w|',
+                format=tarfile.PAX_FORMAT)
+        self.mtime = int(time.time())
+
+    def add(self, name, f, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = self.mtime
+        self.tar.addfile(info, f)
+
+    def close(self):
+        self.tar.close()
+
+
+class _ZipWriter:
+    '''
+    zip archive written to a pipe. zipfile can only write a member to a
+    pipe from memory, so members are streamed here the way writestr writes
+    them, with the crc and sizes in a data descriptor after the data, and
+    zipfile writes the central directory.
+    '''
+
+    def __init__(self, f):
+        self.zip = zipfile.ZipFile(_Output(f), 'w', zipfile.ZIP_DEFLATED, True)
+        self.date_time = time.localtime()[:6]
+
+    def add(self, name, f, size):
+        info = zipfile.ZipInfo(name, self.date_time)
+        info.external_attr = 0644 << 16
+        info.flag_bits |= 0x08
+        info.file_size = size
+        # notes compress well, resources are mostly compressed already.
+        if name.endswith('.json'):
+            info.compress_type = zipfile.ZIP_DEFLATED
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        else:
+            info.compress_type = zipfile.ZIP_STORED
+            compressor = None
+        zip, out = self.zip, self.zip.fp
+        info.header_offset = out.tell()
+        zip._writecheck(info)
+        zip._didModify = True
+        zip64 = size > zipfile.ZIP64_LIMIT
+        out.write(info.FileHeader(zip64))
+
+        crc = file_size = compress_size = 0
+        while True:
+            data = f.read(_COPY_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            if compressor is not None:
+                data = compressor.compress(data)
+            compress_size += len(data)
+            out.write(data)
+        if compressor is not None:
+            data = compressor.flush()
+            compress_size += len(data)
+            out.write(data)
+        if not zip64 and compress_size > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile('compressed size of %s would require ZIP64 extensions' % name)
+
+        info.CRC = crc & 0xffffffff
+        info.file_size = file_size
+        info.compress_size = compress_size
+        out.write(struct.pack('<LLQQ' if zip64 else '<LLLL', zipfile._DD_SIGNATURE,
+                info.CRC, info.compress_size, info.file_size))
+        zip.filelist.append(info)
+        zip.NameToInfo[name] = info
+
+    def close(self):
+        self.zip.close()
+
+
+class Exporter:
+    '''
+    Writes every notebook, note and resource of an account into an archive
+    as they are fetched on "max_workers" threads. At most "window" fetches
+    are waiting to be written at a time; resources larger than 1 MB wait in
+    temporary files, so the memory used does not grow with the account.
+
+    The archive holds:
+    - notebooks/<notebook>/<note>.json, one per note, with its fields and content;
+    - resources/<sha1 of the url>, one per resource;
+    - manifest.json last, the index of the notebooks, notes and resources,
+      and of the items that could not be fetched.
+    '''
+
+    def __init__(self, client, max_workers=8, window=32):
+        '''init with the YNoteClient of the account.'''
+        self.client = client
+        self.max_workers = max_workers
+        self.window = window
+
+    def export(self, f, format='tar'):
+        '''
+        export the account to the writable file object "f", which need not
+        be seekable, in one of FORMATS. return statistics of the export as
+        a dictionary; items that failed are in stats['errors'].
+        '''
+        if format not in FORMATS:
+            raise ValueError('unknown archive format: %s' % format)
+        if format == 'zip':
+            archive = _ZipWriter(f)
+        else:
+            archive = _TarWriter(f, format == 'tgz')
+        stats = {
+            'notebooks':0,
+            'notes':0,
+            'resources':0,
+            'bytes':0,
+            'errors':{},
+        }
+        try:
+            manifest = self._export(archive, stats)
+            data = json.dumps(manifest, indent=1, sort_keys=True)
+            archive.add(MANIFEST_NAME, _StringFile(data), len(data))
+        finally:
+            archive.close()
+        return stats
+
+    def _export(self, archive, stats):
+        '''write the notes and resources, return the manifest.'''
+        books = self.client.get_notebooks()
+        manifest = {
+            'exported_at':int(time.time()),
+            'notebooks':[],
+            'resources':{},
+            'errors':{},
+        }
+        notes_by_path = {}
+
+        def note_paths():
+            for book in books:
+                try:
+                    paths = self.client.get_note_paths(book.path)
+                except Exception, e:
+                    manifest['errors'][book.path] = str(e)
+                    stats['errors'][book.path] = e
+                    continue
+                entry = book.to_dict()
+                entry['dir'] = 'notebooks/' + _safe_name(book.path)
+                entry['notes'] = []
+                manifest['notebooks'].append(entry)
+                stats['notebooks'] += 1
+                for path in paths:
+                    notes_by_path[path] = entry
+                    yield path
+        paths = note_paths()
+
+        pool = futures.WorkerPool(self.max_workers)
+        done = Queue.Queue()
+        urls = collections.deque()
+        seen = set()
+        pending = 0
+        try:
+            while True:
+                # resources first, so that notes do not pile up their urls.
+                while pending < self.window:
+                    if urls:
+                        url = urls.popleft()
+                        future = pool.submit(self._fetch_resource, url)
+                        key = ('resource', url)
+                    else:
+                        path = next(paths, None)
+                        if path is None:
+                            break
+                        future = pool.submit(self.client.get_note, path)
+                        key = ('note', path)
+                    future.add_done_callback(lambda f, key=key: done.put((key, f)))
+                    pending += 1
+                if not pending:
+                    break
+
+                (kind, name), future = done.get()
+                pending -= 1
+                try:
+                    result = future.result()
+                except Exception, e:
+                    manifest['errors'][name] = str(e)
+                    stats['errors'][name] = e
+                    continue
+                if kind == 'note':
+                    for url in self._write_note(archive, notes_by_path.pop(name), result, stats):
+                        if url not in seen:
+                            seen.add(url)
+                            urls.append(url)
+                else:
+                    manifest['resources'][name] = self._write_resource(archive, name, result, stats)
+        finally:
+            pool.shutdown(wait=False, cancel=True)
+        return manifest
+
+    def _fetch_resource(self, url):
+        '''worker thread: download a resource, return (file, size).'''
+        spool = tempfile.SpooledTemporaryFile(_SPOOL_SIZE)
+        try:
+            size = self.client.download_resource_to(url, spool)
+        except:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, size
+
+    def _write_note(self, archive, book_entry, note, stats):
+        '''write a note and list it in its notebook, return the urls of its resources.'''
+        urls = ynote._find_resource_urls(note.content)
+        name = '%s/%s.json' % (book_entry['dir'], _safe_name(note.path))
+        data = json.dumps(_note_to_dict(note))
+        archive.add(name, _StringFile(data), len(data))
+        book_entry['notes'].append({
+            'path':note.path,
+            'title':note.title,
+            'file':name,
+            'modify_time':note.modify_time,
+            'resources':urls,
+        })
+        stats['notes'] += 1
+        stats['bytes'] += len(data)
+        return urls
+
+    def _write_resource(self, archive, url, (spool, size), stats):
+        '''write a downloaded resource, return its member name.'''
+        name = 'resources/' + ynote._resource_name(url)
+        try:
+            archive.add(name, spool, size)
+        finally:
+            spool.close()
+        stats['resources'] += 1
+        stats['bytes'] += size
+        return name
+
+
+class _StringFile:
+    '''file object over a string, read once.'''
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self.data = self.data, ''
+        else:
+            data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]',
+            description='export a Youdao Note account to a tar or zip archive')
+    parser.add_option('--consumer-key', help='consumer key')
+    parser.add_option('--consumer-secret', help='consumer secret')
+    parser.add_option('--token', help='access token as KEY:SECRET')
+    parser.add_option('--base-url', help='API base url')
+    parser.add_option('-f', '--format', choices=FORMATS, default='tar', help=', '.join(FORMATS))
+    parser.add_option('-o', '--output', default='-', help='archive file, - for stdout')
+    parser.add_option('-w', '--workers', type='int', default=8, help='concurrent requests')
+    options, args = parser.parse_args()
+    if not (options.consumer_key and options.consumer_secret and options.token):
+        parser.error('--consumer-key, --consumer-secret and --token are required')
+
+    if options.base_url:
+        ynote.BASE_URL = options.base_url
+    client = ynote.YNoteClient(options.consumer_key, options.consumer_secret)
+    client.set_access_token(*options.token.split(':', 1))
+
+    if options.output == '-':
+        out = sys.stdout
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.setmode(out.fileno(), os.O_BINARY)
+    else:
+        out = open(options.output, 'wb')
+    try:
+        stats = Exporter(client, options.workers).export(out, options.format)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print >>sys.stderr, '%d notebooks, %d notes, %d resources, %d bytes, %d errors' % (
+            stats['notebooks'], stats['notes'], stats['resources'], stats['bytes'], len(stats['errors']))
+    if stats['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Local stand-in for the Youdao Note API, for tests and benchmarks.
+
+It serves the endpoints YNoteClient uses from memory, checks the OAuth
+signature of every request, and can add latency and fail requests on
+purpose. Point the SDK at it with ynote.BASE_URL = server.base_url.
+'''
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import BaseHTTPServer
+import SocketServer
+import binascii
+import cgi
+import hashlib
+import hmac
+import random
+import re
+import socket
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+import oauth2
+
+_AUTH_PARAM_RE = re.compile(r'(\w+)="([^"]*)"')
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+_DOWNLOAD_PREFIX = 'yws/open/resource/download/'
+
+
+class FakeAPIError(Exception):
+    '''error answered as a Youdao Note API error(http status 500).'''
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+        Exception.__init__(self, message)
+
+
+def _new_id():
+    return binascii.b2a_hex(hashlib.sha1(repr(random.random())).digest()[:8]).upper()
+
+def _signature(method, url, items, consumer_secret, token_secret):
+    '''compute an HMAC-SHA1 signature the way oauth2.RequestBuilder does.'''
+    normalized = urllib.urlencode(sorted(items), True).replace('+', '%20')
+    base_string = '&'.join([oauth2._escape(method), oauth2._escape(url), oauth2._escape(normalized)])
+    key = '%s&%s' % (oauth2._escape(consumer_secret), oauth2._escape(token_secret or ''))
+    return binascii.b2a_base64(hmac.new(key, base_string, hashlib.sha1).digest())[:-1]
+
+def _parse_multipart(body, boundary):
+    '''parse a multipart/form-data body into a dictionary of field values.'''
+    params = {}
+    for part in body.split('--' + boundary)[1:-1]:
+        head, value = part[2:-2].split('\r\n\r\n', 1)
+        disposition, options = cgi.parse_header(head.split('\r\n')[0].split(':', 1)[1])
+        params[options['name']] = value
+    return params
+
+def _compress(body, encoding):
+    '''compress a body with gzip, deflate or raw-deflate(deflate without the zlib header).'''
+    if encoding == 'gzip':
+        c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'raw-deflate':
+        c = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    else:
+        c = zlib.compressobj(6)
+    return c.compress(body) + c.flush()
+
+def _as_unicode(items):
+    '''decode utf-8 values, as the client holds them before signing.'''
+    result = []
+    for k, v in items:
+        try:
+            result.append((k, v.decode('utf-8')))
+        except UnicodeDecodeError:
+            result.append((k, v))
+    return result
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''request handler of FakeServer.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately: do not let Nagle's
+        # algorithm hold the body back until the headers are acknowledged.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _send(self, status, body, content_type='application/json', headers=()):
+        encoding = self.server.fake.compress
+        if (encoding and content_type == 'application/json'
+                and encoding.split('-')[-1] in self.headers.get('accept-encoding', '')):
+            body = _compress(body, encoding)
+            headers = tuple(headers) + (('Content-Encoding', encoding.split('-')[-1]),)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        # large bodies are written in pieces, without copies.
+        for i in xrange(0, len(body), 256 * 1024):
+            self.wfile.write(buffer(body, i, 256 * 1024))
+
+    def _read_params(self):
+        '''read the request body, return (params, signed_items).'''
+        content_type, options = cgi.parse_header(self.headers.get('content-type', ''))
+        if self.command == 'GET':
+            query = urlparse.urlsplit(self.path).query
+            params = dict(urlparse.parse_qsl(query, True))
+            return params, []
+        body = self.rfile.read(int(self.headers.get('content-length') or 0))
+        if content_type == 'multipart/form-data':
+            return _parse_multipart(body, options['boundary']), []
+        items = urlparse.parse_qsl(body, True)
+        return dict(items), items
+
+    def _handle(self, method):
+        server = self.server.fake
+        path = urlparse.urlsplit(self.path).path.lstrip('/')
+        try:
+            params, signed_items = self._read_params()
+        except Exception:
+            self._send(400, 'bad request', 'text/plain')
+            return
+
+        try:
+            status = server._inject(path)
+            if status is not None:
+                if status in (301, 302, 303, 307):
+                    self._send(status, '', 'text/plain', [('Location', self.path)])
+                elif status == 500:
+                    self._send(500, json.dumps({'error':'500', 'message':'injected failure'}))
+                else:
+                    self._send(status, 'injected failure', 'text/plain')
+                return
+
+            # the authorize page is opened by the user's browser, unsigned.
+            oauth = {}
+            if path != 'oauth/authorize':
+                oauth = self._check_signature(method, path, signed_items)
+            result = server._dispatch(method, path, params, oauth, self.headers)
+        except FakeAPIError, e:
+            self._send(500, json.dumps({'error':str(e.code), 'message':e.message}))
+            return
+        finally:
+            server._leave()
+
+        if isinstance(result, tuple):
+            self._send(*result)
+        elif isinstance(result, str):
+            self._send(200, result, 'text/plain')
+        else:
+            self._send(200, json.dumps(result))
+
+    def _check_signature(self, method, path, signed_items):
+        '''check the OAuth signature, return the oauth parameters.'''
+        server = self.server.fake
+        header = self.headers.get('authorization', '')
+        if not header.startswith('OAuth '):
+            raise FakeAPIError(207, 'missing oauth authorization')
+        oauth = dict([(k, urllib.unquote(v)) for k, v in _AUTH_PARAM_RE.findall(header)])
+        if oauth.get('oauth_consumer_key') != server.consumer_key:
+            raise FakeAPIError(207, 'unknown consumer key')
+
+        token_secret = None
+        if path != 'oauth/request_token':
+            token_secret = server._token_secret(oauth.get('oauth_token'))
+            if token_secret is None:
+                raise FakeAPIError(207, 'unknown or expired token')
+
+        items = [(k, v) for k, v in oauth.items() if k != 'oauth_signature']
+        items += [(k, v) for k, v in signed_items if not k.startswith('oauth_')]
+        url = 'http://%s/%s' % (self.headers.get('host', ''), path)
+        expected = oauth.get('oauth_signature', '')
+        # the client signs unicode and byte string values differently.
+        for candidate in (items, _as_unicode(items)):
+            if _signature(method, url, candidate, server.consumer_secret, token_secret) == expected:
+                return oauth
+        raise FakeAPIError(207, 'signature check failed')
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeServer:
+    '''
+    In-memory Youdao Note server on a local port. "latency" seconds, plus a
+    random delay of up to "jitter" seconds, are added to every response, and
+    a fraction "fail_rate" of the requests is answered with "fail_status".
+    Requests beyond "max_in_flight" at the same time are answered with 429.
+    JSON responses are compressed with "compress"('gzip', 'deflate' or
+    'raw-deflate') when the request accepts it; by default they are not.
+
+    An access token is issued up front as self.access_token, and the usual
+    request token, authorize and access token flow works too; authorizing
+    is automatic.
+    '''
+
+    def __init__(self, consumer_key='key', consumer_secret='secret', host='127.0.0.1', port=0,
+                 latency=0, jitter=0, fail_rate=0.0, fail_status=503, max_in_flight=None,
+                 compress=None):
+        '''init with the accepted consumer and the failure settings, not yet serving.'''
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.max_in_flight = max_in_flight
+        self.compress = compress
+        self.in_flight = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._failures = []
+        self._request_tokens = {}
+        self._access_tokens = {}
+        self._notebooks = {}
+        self._notes = {}
+        self._resources = {}
+        self._etags = {}
+        self._server = _HTTPServer((host, port), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+        self.base_url = 'http://%s:%d/' % self._server.server_address[:2]
+        self.access_token = self.issue_access_token()
+        self.default_notebook = self.add_notebook('default')
+
+    def start(self):
+        '''serve on a daemon thread, return self.'''
+        self._thread = threading.Thread(target=self._server.serve_forever, name='ynote-fakeserver')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''stop serving and close the socket.'''
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def fail_next(self, count=1, status=503, endpoint=None):
+        '''
+        answer the next "count" requests(to "endpoint" only, if given) with
+        "status". 500 is sent as an API error, a redirect status redirects
+        to the same url.
+        '''
+        self._lock.acquire()
+        try:
+            self._failures.extend([(endpoint, status)] * count)
+        finally:
+            self._lock.release()
+
+    def _inject(self, path):
+        '''count a request and apply the latency, return a failure status or None.'''
+        self._lock.acquire()
+        try:
+            endpoint = _DOWNLOAD_PREFIX.rstrip('/') if path.startswith(_DOWNLOAD_PREFIX) else path
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.in_flight += 1
+            if self.max_in_flight is not None and self.in_flight > self.max_in_flight:
+                return 429
+            status = None
+            for i, (failing, fail_status) in enumerate(self._failures):
+                if failing is None or failing == endpoint:
+                    status = fail_status
+                    del self._failures[i]
+                    break
+        finally:
+            self._lock.release()
+
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if status is None and self.fail_rate and random.random() < self.fail_rate:
+            status = self.fail_status
+        return status
+
+    def _leave(self):
+        '''count a request as finished.'''
+        self._lock.acquire()
+        try:
+            self.in_flight -= 1
+        finally:
+            self._lock.release()
+
+    def issue_access_token(self):
+        '''create an access token, return it as an oauth2.Token.'''
+        token = oauth2.Token(_new_id(), _new_id())
+        self._access_tokens[token.key] = token.secret
+        return token
+
+    def _token_secret(self, key):
+        if key in self._access_tokens:
+            return self._access_tokens[key]
+        if key in self._request_tokens:
+            return self._request_tokens[key][0]
+        return None
+
+    def _locked(self, fn, *args, **kw):
+        '''call fn holding the lock.'''
+        self._lock.acquire()
+        try:
+            return fn(*args, **kw)
+        finally:
+            self._lock.release()
+
+    def authorize(self, request_token_key):
+        '''approve a request token as the user would, return the verifier.'''
+        return self._locked(self._authorize, request_token_key)
+
+    def add_notebook(self, name, create_time=None):
+        '''create a notebook directly, return its path.'''
+        return self._locked(self._add_notebook, name, create_time)
+
+    def add_note(self, book_path, content='', **kw):
+        '''create a note directly, return its path.'''
+        return self._locked(self._add_note, book_path, content, **kw)
+
+    def add_resource(self, data):
+        '''store a resource directly, return its download url.'''
+        return self._locked(self._add_resource, data)
+
+    def _authorize(self, request_token_key):
+        secret, verifier = self._request_tokens[request_token_key]
+        if verifier is None:
+            verifier = _new_id()
+            self._request_tokens[request_token_key] = (secret, verifier)
+        return verifier
+
+    def _add_notebook(self, name, create_time=None):
+        now = int(time.time() * 1000)
+        path = '/' + _new_id()
+        self._notebooks[path] = {
+            'path':path,
+            'name':name,
+            'create_time':int(create_time or now),
+            'modify_time':now,
+            'notes':[],
+        }
+        return path
+
+    def _add_note(self, book_path, content='', **kw):
+        now = int(time.time() * 1000)
+        book = self._book(book_path)
+        path = '%s/%s' % (book_path, _new_id())
+        self._notes[path] = {
+            'path':path,
+            'title':kw.get('title', ''),
+            'author':kw.get('author', ''),
+            'source':kw.get('source', ''),
+            'create_time':int(kw.get('create_time') or now),
+            'modify_time':now,
+            'content':content,
+        }
+        book['notes'].append(path)
+        book['modify_time'] = now
+        return path
+
+    def _add_resource(self, data):
+        url = self.base_url + _DOWNLOAD_PREFIX + _new_id()
+        self._resources[url] = data
+        return url
+
+    def _note(self, path):
+        note = self._notes.get(path)
+        if note is None:
+            raise FakeAPIError(223, 'note does not exist')
+        return note
+
+    def _book(self, path):
+        book = self._notebooks.get(path)
+        if book is None:
+            raise FakeAPIError(224, 'notebook does not exist')
+        return book
+
+    def _dispatch(self, method, path, params, oauth, headers):
+        '''run an endpoint, return a json-able result, a string or (status, body, type, headers).'''
+        if path.startswith(_DOWNLOAD_PREFIX):
+            return self._download(path, headers)
+        handler = getattr(self, '_api_' + re.sub(r'\W', '_', path[:-5] if path.endswith('.json') else path), None)
+        if handler is None:
+            return 404, 'no such endpoint', 'text/plain', ()
+        self._lock.acquire()
+        try:
+            return handler(params, oauth)
+        finally:
+            self._lock.release()
+
+    def _api_oauth_request_token(self, params, oauth):
+        key, secret = _new_id(), _new_id()
+        self._request_tokens[key] = (secret, None)
+        return 'oauth_token=%s&oauth_token_secret=%s&oauth_callback_confirmed=true' % (key, secret)
+
+    def _api_oauth_authorize(self, params, oauth):
+        if params.get('oauth_token') not in self._request_tokens:
+            raise FakeAPIError(207, 'unknown request token')
+        return 'oauth_verifier=%s' % self._authorize(params['oauth_token'])
+
+    def _api_oauth_access_token(self, params, oauth):
+        entry = self._request_tokens.get(oauth.get('oauth_token'))
+        if entry is None or entry[1] is None or entry[1] != oauth.get('oauth_verifier'):
+            raise FakeAPIError(207, 'request token not authorized')
+        del self._request_tokens[oauth['oauth_token']]
+        token = self.issue_access_token()
+        return 'oauth_token=%s&oauth_token_secret=%s' % (token.key, token.secret)
+
+    def _api_yws_open_user_get(self, params, oauth):
+        used = sum([len(data) for data in self._resources.values()])
+        return {
+            'id':'fake',
+            'user':'fake@example.com',
+            'total_size':1 << 30,
+            'used_size':used,
+            'register_time':0,
+            'last_login_time':int(time.time() * 1000),
+            'last_modify_time':max([b['modify_time'] for b in self._notebooks.values()] or [0]),
+            'default_notebook':self.default_notebook,
+        }
+
+    def _book_dict(self, book):
+        return {
+            'path':book['path'],
+            'name':book['name'],
+            'notes_num':len(book['notes']),
+            'create_time':book['create_time'],
+            'modify_time':book['modify_time'],
+        }
+
+    def _api_yws_open_notebook_all(self, params, oauth):
+        return [self._book_dict(b) for b in self._notebooks.values()]
+
+    def _api_yws_open_notebook_list(self, params, oauth):
+        return list(self._book(params.get('notebook'))['notes'])
+
+    def _api_yws_open_notebook_create(self, params, oauth):
+        return {'path':self._add_notebook(params.get('name', ''), params.get('create_time'))}
+
+    def _api_yws_open_notebook_delete(self, params, oauth):
+        book = self._book(params.get('notebook'))
+        for path in book['notes']:
+            del self._notes[path]
+        del self._notebooks[book['path']]
+        return {}
+
+    def _api_yws_open_note_get(self, params, oauth):
+        note = dict(self._note(params.get('path')))
+        note['size'] = len(note['content'])
+        return note
+
+    def _api_yws_open_note_create(self, params, oauth):
+        kw = dict([(k, params[k]) for k in ('title', 'author', 'source', 'create_time') if k in params])
+        return {'path':self._add_note(params.get('notebook'), params.get('content', ''), **kw)}
+
+    def _api_yws_open_note_update(self, params, oauth):
+        note = self._note(params.get('path'))
+        for k in ('title', 'author', 'source', 'content'):
+            if k in params:
+                note[k] = params[k]
+        note['modify_time'] = int(params.get('modify_time') or time.time() * 1000)
+        self._notebooks[note['path'].rsplit('/', 1)[0]]['modify_time'] = note['modify_time']
+        return {}
+
+    def _api_yws_open_note_move(self, params, oauth):
+        note = self._note(params.get('path'))
+        book = self._book(params.get('notebook'))
+        old_book = self._notebooks[note['path'].rsplit('/', 1)[0]]
+        if old_book is book:
+            return {'path':note['path']}
+        new_path = '%s/%s' % (book['path'], note['path'].rsplit('/', 1)[1])
+        old_book['notes'].remove(note['path'])
+        del self._notes[note['path']]
+        note['path'] = new_path
+        self._notes[new_path] = note
+        book['notes'].append(new_path)
+        return {'path':new_path}
+
+    def _api_yws_open_note_delete(self, params, oauth):
+        note = self._note(params.get('path'))
+        self._notebooks[note['path'].rsplit('/', 1)[0]]['notes'].remove(note['path'])
+        del self._notes[note['path']]
+        return {}
+
+    def _api_yws_open_share_publish(self, params, oauth):
+        self._note(params.get('path'))
+        return {'url':self.base_url + 'share/' + _new_id()}
+
+    def _api_yws_open_resource_upload(self, params, oauth):
+        if 'file' not in params:
+            raise FakeAPIError(226, 'no file uploaded')
+        url = self._add_resource(params['file'])
+        return {'url':url, 'src':url + '/icon'}
+
+    def _etag(self, url, data):
+        '''get the ETag of a resource, computed again if its data was replaced.'''
+        cached = self._etags.get(url)
+        if cached is None or cached[0] is not data:
+            cached = (data, '"%s"' % hashlib.sha1(data).hexdigest()[:16])
+            self._etags[url] = cached
+        return cached[1]
+
+    def _download(self, path, headers):
+        '''serve a resource, honouring Range and If-Range headers.'''
+        url = self.base_url + path
+        data = self._resources.get(url)
+        if data is None:
+            raise FakeAPIError(225, 'resource does not exist')
+        etag = ('ETag', self._etag(url, data))
+        match = _RANGE_RE.match(headers.get('range', '').strip())
+        if_range = headers.get('if-range')
+        if match is None or (if_range is not None and if_range != etag[1]):
+            return 200, data, 'application/octet-stream', (etag,)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        if start >= len(data):
+            return 416, '', 'text/plain', (('Content-Range', 'bytes */%d' % len(data)), etag)
+        end = min(end, len(data) - 1)
+        return (206, data[start:end + 1], 'application/octet-stream',
+                (('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data))), etag))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Futures for the asynchronous parts of Youdao Note client SDK.
+'''
+
+import Queue
+import sys
+import threading
+
+
+class Future:
+    '''result of a call that completes later, possibly in another thread.'''
+
+    def __init__(self):
+        '''init an unfinished future.'''
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        '''return True if the call has finished.'''
+        return self._done
+
+    def _wait(self, timeout):
+        '''wait for the call to finish, raise RuntimeError on timeout.'''
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise RuntimeError('future not done after %s seconds' % timeout)
+        finally:
+            self._cond.release()
+
+    def result(self, timeout=None):
+        '''wait for the call and return its result, or raise its error.'''
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        '''wait for the call and return its error, None if it succeeded.'''
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        '''call fn(future) once the call has finished.'''
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._cond.release()
+        self._call(fn)
+
+    def _call(self, fn):
+        '''run a callback, an error in it must not break the caller.'''
+        try:
+            fn(self)
+        except Exception:
+            pass
+
+    def _finish(self, result, exc_info):
+        '''store the outcome and wake up the waiters.'''
+        self._cond.acquire()
+        try:
+            if self._done:
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+        for fn in callbacks:
+            self._call(fn)
+
+    def set_result(self, result):
+        '''finish the future with a result.'''
+        self._finish(result, None)
+
+    def set_exception(self, exc, exc_info=None):
+        '''finish the future with an error.'''
+        if exc_info is None or exc_info[1] is not exc:
+            exc_info = (exc.__class__, exc, None)
+        self._finish(None, exc_info)
+
+    def set_exc_info(self):
+        '''finish the future with the error being handled.'''
+        exc_info = sys.exc_info()
+        self.set_exception(exc_info[1], exc_info)
+
+
+def as_completed(fs):
+    '''yield the futures in "fs" as they finish.'''
+    fs = list(fs)
+    finished = Queue.Queue()
+    for f in fs:
+        f.add_done_callback(finished.put)
+    for i in range(len(fs)):
+        yield finished.get()
+
+
+class WorkerPool:
+    '''pool of at most "max_workers" threads running submitted calls.'''
+
+    def __init__(self, max_workers):
+        '''init the pool, threads are started as calls are submitted.'''
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kw):
+        '''run fn(*args, **kw) on a worker thread, return a Future.'''
+        future = Future()
+        self._lock.acquire()
+        try:
+            if self._shutdown:
+                raise RuntimeError('worker pool is shut down')
+            self._queue.put((future, fn, args, kw))
+            if len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._work, name='ynote-worker')
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+        finally:
+            self._lock.release()
+        return future
+
+    def _work(self):
+        '''worker thread: run calls until told to stop.'''
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kw = item
+            try:
+                result = fn(*args, **kw)
+            except:
+                future.set_exc_info()
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, cancel=False):
+        '''
+        stop the workers once the queued calls are done, or drop the queued
+        calls first if "cancel" is set.
+        '''
+        self._lock.acquire()
+        try:
+            self._shutdown = True
+            threads = list(self._threads)
+        finally:
+            self._lock.release()
+
+        if cancel:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is not None:
+                    item[0].set_exception(RuntimeError('call cancelled'))
+        for t in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                if t is not threading.current_thread():
+                    t.join()
+
+
+class SingleFlight:
+    '''
+    Coalesces identical calls: while a call for a key is running, callers
+    of the same key wait for it and share its result or error instead of
+    making their own call.
+    '''
+
+    def __init__(self, copy=None):
+        '''
+        init with no calls running. If "copy" is given, the callers that
+        joined a call get copy(result) rather than the caller that made it,
+        so that none of them sees the others change a mutable result.
+        '''
+        self.copy = copy
+        self.calls = 0
+        self.coalesced = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        '''get (future, is_leader) for a key, starting a new call if none runs.'''
+        self._lock.acquire()
+        try:
+            future = self._futures.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._futures[key] = Future()
+            self.calls += 1
+            return future, True
+        finally:
+            self._lock.release()
+
+    def _leave(self, key, future):
+        '''stop sharing a finished call, later callers start a new one.'''
+        self._lock.acquire()
+        try:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+        finally:
+            self._lock.release()
+
+    def do(self, key, fn, *args, **kw):
+        '''call fn(*args, **kw) unless a call for "key" runs already, return its result.'''
+        future, leader = self._join(key)
+        if leader:
+            try:
+                result = fn(*args, **kw)
+            except:
+                self._leave(key, future)
+                future.set_exc_info()
+            else:
+                self._leave(key, future)
+                future.set_result(result)
+        result = future.result()
+        if not leader and self.copy is not None:
+            result = self.copy(result)
+        return result
+
+    def submit(self, key, fn, *args, **kw):
+        '''
+        like do, for a fn that returns a Future: return a Future shared by
+        the callers of "key".
+        '''
+        future, leader = self._join(key)
+        if not leader:
+            if self.copy is None:
+                return future
+            return self._copied(future)
+
+        def done(inner):
+            self._leave(key, future)
+            if inner._exc_info is not None:
+                future.set_exception(inner._exc_info[1], inner._exc_info)
+            else:
+                future.set_result(inner._result)
+        try:
+            fn(*args, **kw).add_done_callback(done)
+        except:
+            self._leave(key, future)
+            future.set_exc_info()
+        return future
+
+    def _copied(self, future):
+        '''get a Future of a copy of the result of "future".'''
+        copied = Future()
+
+        def done(inner):
+            if inner._exc_info is not None:
+                copied.set_exception(inner._exc_info[1], inner._exc_info)
+                return
+            try:
+                result = self.copy(inner._result)
+            except:
+                copied.set_exc_info()
+            else:
+                copied.set_result(result)
+        future.add_done_callback(done)
+        return copied
+
+    def forget(self, key=None, prefix=None):
+        '''
+        let the next callers of "key", or of every key if it is None, start
+        a new call even if one is running, e.g. after a write. If "prefix"
+        is given, only the tuple keys that start with it are forgotten.
+        '''
+        self._lock.acquire()
+        try:
+            if prefix is not None:
+                n = len(prefix)
+                for k in [k for k in self._futures if k[:n] == prefix]:
+                    del self._futures[k]
+            elif key is None:
+                self._futures.clear()
+            else:
+                self._futures.pop(key, None)
+        finally:
+            self._lock.release()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Request instrumentation for Youdao Note client SDK.
+
+A hook is any callable registered with YNoteClient.add_hook; it is called
+with a RequestEvent after every API request. Nothing is measured while no
+hook is registered.
+'''
+
+import bisect
+import BaseHTTPServer
+import threading
+import time
+import urlparse
+
+# request phases, in order.
+PHASES = ('sign', 'encode', 'network', 'parse', 'total')
+
+# upper bounds(seconds) of the histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _endpoint(url):
+    '''get the API endpoint of an url, without ids that vary per call.'''
+    path = urlparse.urlsplit(url).path.lstrip('/')
+    if path.startswith('yws/open/resource/download'):
+        return 'yws/open/resource/download'
+    if path.endswith('.json') or path.startswith('oauth/'):
+        return path
+    return 'other'
+
+
+class RequestEvent:
+    '''measurements of one API request.'''
+
+    def __init__(self, method, url):
+        '''start measuring a request.'''
+        self.method = method
+        self.url = url
+        self.endpoint = _endpoint(url)
+        self.timings = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.status = None
+        self.retries = 0
+        self.error = None
+        self.start_time = time.time()
+
+    def finish(self):
+        '''stop measuring, the total time goes to timings['total'].'''
+        self.timings['total'] = time.time() - self.start_time
+
+
+class _Histogram:
+    '''cumulative histogram of durations.'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, q):
+        '''estimate the q-th percentile(0-100) as the upper bound of a bucket.'''
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class HistogramCollector:
+    '''
+    Hook that keeps histograms of the phase timings of each endpoint, along
+    with request, error, retry and byte counts.
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        '''init with the upper bounds of the histogram buckets.'''
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._requests = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        '''record a RequestEvent.'''
+        self._lock.acquire()
+        try:
+            for phase, value in event.timings.items():
+                key = (event.endpoint, phase)
+                hist = self._histograms.get(key)
+                if hist is None:
+                    hist = self._histograms[key] = _Histogram(self.buckets)
+                hist.observe(value)
+
+            status = event.status if event.status is not None else 'error'
+            key = (event.endpoint, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, value in (('bytes_sent', event.bytes_sent),
+                                ('bytes_received', event.bytes_received),
+                                ('bytes_decoded', event.bytes_decoded),
+                                ('retries', event.retries),
+                                ('errors', int(event.error is not None))):
+                key = (event.endpoint, name)
+                self._counters[key] = self._counters.get(key, 0) + value
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        '''forget everything recorded.'''
+        self._lock.acquire()
+        try:
+            self._histograms.clear()
+            self._requests.clear()
+            self._counters.clear()
+        finally:
+            self._lock.release()
+
+    def percentile(self, endpoint, phase, q):
+        '''estimate the q-th percentile of a phase of an endpoint, in seconds.'''
+        hist = self._histograms.get((endpoint, phase))
+        if hist is None:
+            return None
+        return hist.percentile(q)
+
+    def summary(self):
+        '''
+        get {endpoint: {phase: {'count', 'mean', 'p50', 'p99'}}} for the
+        recorded timings.
+        '''
+        self._lock.acquire()
+        try:
+            result = {}
+            for (endpoint, phase), hist in self._histograms.items():
+                result.setdefault(endpoint, {})[phase] = {
+                    'count':hist.count,
+                    'mean':hist.sum / hist.count,
+                    'p50':hist.percentile(50),
+                    'p99':hist.percentile(99),
+                }
+            return result
+        finally:
+            self._lock.release()
+
+    def to_prometheus(self, prefix='ynote'):
+        '''render the collected data in the Prometheus text format.'''
+        lines = []
+        self._lock.acquire()
+        try:
+            lines.append('# TYPE %s_request_seconds histogram' % prefix)
+            for (endpoint, phase), hist in sorted(self._histograms.items()):
+                labels = 'endpoint="%s",phase="%s"' % (endpoint, phase)
+                seen = 0
+                for bound, n in zip(self.buckets + (float('inf'),), hist.counts):
+                    seen += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_request_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, le, seen))
+                lines.append('%s_request_seconds_sum{%s} %r' % (prefix, labels, hist.sum))
+                lines.append('%s_request_seconds_count{%s} %d' % (prefix, labels, hist.count))
+
+            lines.append('# TYPE %s_requests_total counter' % prefix)
+            for (endpoint, status), n in sorted(self._requests.items()):
+                lines.append('%s_requests_total{endpoint="%s",status="%s"} %d' % (prefix, endpoint, status, n))
+
+            for name in ('bytes_sent', 'bytes_received', 'bytes_decoded', 'retries', 'errors'):
+                lines.append('# TYPE %s_request_%s_total counter' % (prefix, name))
+                for (endpoint, counter), n in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append('%s_request_%s_total{endpoint="%s"} %d' % (prefix, name, endpoint, n))
+        finally:
+            self._lock.release()
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_exporter(collector, port, host=''):
+    '''
+    serve collector.to_prometheus() over http on a daemon thread, return
+    the server. Call server.shutdown() to stop it.
+    '''
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = collector.to_prometheus()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='ynote-exporter')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Client-side rate and concurrency limiters of Youdao Note client SDK.
+'''
+
+import collections
+import threading
+import time
+
+
+class TokenBucket:
+    '''
+    Rate limiter that lets "rate" requests per second through on average,
+    with bursts of up to "burst" requests. Callers are served in the order
+    they arrive.
+    '''
+
+    def __init__(self, rate, burst=None):
+        '''init with the rate per second and the burst size.'''
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens=1):
+        '''take tokens if they are available now, return False otherwise.'''
+        self._lock.acquire()
+        try:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+        finally:
+            self._lock.release()
+
+    def acquire(self, tokens=1):
+        '''take tokens, waiting until they are available, return the seconds waited.'''
+        self._lock.acquire()
+        try:
+            self._refill()
+            # the tokens are taken at once, so later callers queue behind.
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        finally:
+            self._lock.release()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AIMDLimiter:
+    '''
+    Concurrency limiter that adapts its limit to the server: the limit grows
+    by one for every "limit" requests that succeed quickly, and is multiplied
+    by "backoff" when a request fails from overload or the smoothed latency
+    climbs above "tolerance" times the lowest latency seen, or above
+    "latency_target" seconds if it is given. It shrinks at most once for the
+    requests in flight at the same time.
+    '''
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64, backoff=0.5,
+                 tolerance=2.0, latency_target=None):
+        '''init with the starting limit and its bounds.'''
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.decreases = 0
+        self.min_latency = None
+        self.latency = None
+        self._last_decrease = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        '''wait for a free slot and take it.'''
+        self._cond.acquire()
+        try:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        finally:
+            self._cond.release()
+
+    def _congested(self, latency):
+        '''update the latency estimates, return True if they show congestion.'''
+        if self.latency is None:
+            self.latency = self.min_latency = latency
+            return False
+        self.latency += (latency - self.latency) * 0.1
+        if latency < self.min_latency:
+            self.min_latency = latency
+        else:
+            # let the baseline follow a network that got slower for good.
+            self.min_latency += (self.latency - self.min_latency) * 0.01
+        if self.latency_target is not None:
+            return self.latency > self.latency_target
+        return self.latency > self.min_latency * self.tolerance
+
+    def release(self, latency, overloaded=False):
+        '''
+        give a slot back, with the latency of the request in seconds and
+        whether it failed from overload.
+        '''
+        now = time.time()
+        self._cond.acquire()
+        try:
+            self.in_flight -= 1
+            # the latency of a failed request says nothing about the queueing.
+            if overloaded or self._congested(latency):
+                if now - latency >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+
+class FairScheduler:
+    '''
+    Concurrency limiter shared by several tenants: at most "limit" requests
+    run at a time, and at most "tenant_limit" of one tenant if it is given.
+    When slots are taken, the waiting tenants get the free ones in turn, so
+    a tenant with many requests waiting does not hold back the others.
+    '''
+
+    def __init__(self, limit=16, tenant_limit=None):
+        '''init with the number of requests that may run at once.'''
+        self.limit = limit
+        self.tenant_limit = tenant_limit
+        self.in_flight = 0
+        self._running = {}
+        # waiting tenants in turn order, each with its waiters in order.
+        self._waiting = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _may_run(self, tenant):
+        return self.tenant_limit is None or self._running.get(tenant, 0) < self.tenant_limit
+
+    def _start(self, tenant):
+        self.in_flight += 1
+        self._running[tenant] = self._running.get(tenant, 0) + 1
+
+    def acquire(self, tenant):
+        '''wait for a slot for "tenant" and take it.'''
+        self._lock.acquire()
+        try:
+            if self.in_flight < self.limit and tenant not in self._waiting and self._may_run(tenant):
+                self._start(tenant)
+                return
+            waiter = threading.Event()
+            self._waiting.setdefault(tenant, collections.deque()).append(waiter)
+        finally:
+            self._lock.release()
+        # the slot is taken for us before we are woken.
+        waiter.wait()
+
+    def release(self, tenant):
+        '''give the slot of "tenant" back, waking the next tenant in turn.'''
+        self._lock.acquire()
+        try:
+            self.in_flight -= 1
+            running = self._running[tenant] - 1
+            if running:
+                self._running[tenant] = running
+            else:
+                del self._running[tenant]
+            self._grant()
+        finally:
+            self._lock.release()
+
+    def _grant(self):
+        '''hand free slots to the waiting tenants in turn, holding the lock.'''
+        while self.in_flight < self.limit:
+            for tenant in self._waiting:
+                if self._may_run(tenant):
+                    break
+            else:
+                return
+            waiters = self._waiting.pop(tenant)
+            waiter = waiters.popleft()
+            if waiters:
+                # back to the end of the turn.
+                self._waiting[tenant] = waiters
+            self._start(tenant)
+            waiter.set()
+
+    def waiting(self):
+        '''get the number of waiting requests of each tenant.'''
+        self._lock.acquire()
+        try:
+            return dict([(tenant, len(waiters)) for tenant, waiters in self._waiting.items()])
+        finally:
+            self._lock.release()
@@ -9,17 +9,32 @@ OAuth2 module for Youdao Note client SDK.
 '''
 
 import binascii
+import hashlib
+import os
 import time
 import random
 import urllib
 import urllib2
 import hmac
 import collections
+import re
 
+# characters urllib.quote(s, safe='~') escapes, and those it escapes with safe=''.
+_ESCAPED_RE = re.compile(r'[^A-Za-z0-9_.~-]')
+_QUOTED_RE = re.compile(r'[^A-Za-z0-9_.-]')
+_QUOTED = dict([(chr(i), '%%%02X' % i) for i in range(256)])
+
+def _quote_char(match):
+    return _QUOTED[match.group()]
 
 def _escape(s):
     """Special replacement."""
-    return urllib.quote(s, safe='~')
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    # most strings need no escaping: leave them as they are.
+    if _ESCAPED_RE.search(s) is None:
+        return s
+    return _ESCAPED_RE.sub(_quote_char, s)
 
 def _generate_timestamp():
     """Get seconds since epoch (UTC)."""
@@ -27,7 +42,7 @@ def _generate_timestamp():
 
 def _generate_nonce(length=15):
     """Generate pseudorandom number."""
-    return ''.join([str(random.randint(0, 9)) for i in range(length)])
+    return '%0*d' % (length, random.randrange(10 ** length))
 
 def _encode_urlencoded(params):
     '''build urlencoded body.'''
@@ -46,25 +61,163 @@ def _encode_urlencoded(params):
         
     return '&'.join(args)
 
-def _encode_multipart(params):
-    '''build a multipart/-data body with randomly generated boundary.'''
-    boundary = '----------%s' % hex(int(time.time() * 1000))
-    data = []
-    for k, v in params.iteritems():
-        data.append('--%s' % boundary)
-        if hasattr(v, 'read'):
-            # file-like object:
-            filename = getattr(v, 'name', '')
-            data.append('Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (k, filename))
-            data.append(v.read() if v else "")
+# size of the chunks read from files while streaming a multipart body.
+CHUNK_SIZE = 64 * 1024
+
+class UploadFile:
+    '''
+    File part of a multipart body: a file-like object, or an iterable of
+    byte strings whose total size is given.
+    '''
+
+    def __init__(self, source, size=None, filename=None):
+        '''init with the data source, its size and the file name.'''
+        self.source = source
+        if filename is None:
+            filename = getattr(source, 'name', '')
+        self.filename = filename
+        # optional hashlib object fed with the data as it is read.
+        self.hash = None
+        self._offset = None
+
+        if hasattr(source, 'read'):
+            try:
+                self._offset = source.tell()
+            except (AttributeError, IOError):
+                pass
+            if size is None:
+                size = self._file_size()
+        if size is None:
+            raise ValueError('size of the upload source is unknown')
+        self.size = size
+
+    def _file_size(self):
+        '''get the number of bytes left in a file-like source.'''
+        try:
+            return os.fstat(self.source.fileno()).st_size - (self._offset or 0)
+        except (AttributeError, IOError, OSError):
+            pass
+        if self._offset is None:
+            return None
+        self.source.seek(0, os.SEEK_END)
+        size = self.source.tell() - self._offset
+        self.source.seek(self._offset)
+        return size
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        '''yield the data in chunks of at most "chunk_size" bytes.'''
+        if hasattr(self.source, 'read'):
+            chunks = iter(lambda: self.source.read(chunk_size), '')
         else:
-            data.append('Content-Disposition: form-data; name="%s"\r\n' % k)
-            if v:
-                data.append(v.encode('utf-8') if isinstance(v, unicode) else v)
+            chunks = self.source
+
+        for chunk in chunks:
+            if self.hash is not None:
+                self.hash.update(chunk)
+            yield chunk
+
+    def rewind(self):
+        '''go back to the start of the data, return False if impossible.'''
+        if self._offset is None:
+            return False
+        self.source.seek(self._offset)
+        if self.hash is not None:
+            self.hash = hashlib.new(self.hash.name)
+        return True
+
+
+class MultipartBody:
+    '''
+    multipart/form-data body that is read as a stream, so files are sent in
+    chunks instead of being loaded into memory. The length is known up front.
+    '''
+
+    def __init__(self, params, boundary, chunk_size=CHUNK_SIZE, progress=None):
+        '''
+        init with the form fields. "progress" is called as
+        progress(bytes_sent, total_bytes) while the body is read.
+        '''
+        self.boundary = boundary
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._parts = []
+        for k, v in params.iteritems():
+            if hasattr(v, 'read'):
+                v = UploadFile(v)
+            if isinstance(v, UploadFile):
+                head = 'Content-Disposition: form-data; name="%s"; filename="%s"' % (k, v.filename)
+            else:
+                head = 'Content-Disposition: form-data; name="%s"' % k
+                if not v:
+                    v = ''
+                elif isinstance(v, unicode):
+                    v = v.encode('utf-8')
+                else:
+                    v = str(v)
+            if isinstance(head, unicode):
+                head = head.encode('utf-8')
+            self._parts.append(('--%s\r\n%s\r\n\r\n' % (boundary, head), v))
+        self._tail = '--%s--\r\n' % boundary
+
+        self.sent = 0
+        self.length = len(self._tail)
+        for head, v in self._parts:
+            size = v.size if isinstance(v, UploadFile) else len(v)
+            self.length += len(head) + size + 2
+        self.reset()
+
+    def __len__(self):
+        return self.length
+
+    def _segments(self):
+        '''yield the body as a sequence of strings.'''
+        for head, v in self._parts:
+            yield head
+            if isinstance(v, UploadFile):
+                for chunk in v.chunks(self.chunk_size):
+                    yield chunk
             else:
-                data.append("")
-    data.append('--%s--\r\n' % boundary)
-    return '\r\n'.join(data), boundary
+                yield v
+            yield '\r\n'
+        yield self._tail
+
+    def reset(self):
+        '''restart the body from the beginning, return False if impossible.'''
+        for head, v in self._parts:
+            if isinstance(v, UploadFile) and not v.rewind() and self.sent:
+                return False
+        self._iter = self._segments()
+        self._buf = ''
+        self.sent = 0
+        return True
+
+    def read(self, size=-1):
+        '''read at most "size" bytes of the body.'''
+        if size is None or size < 0:
+            size = self.length
+        while len(self._buf) < size:
+            try:
+                self._buf += self._iter.next()
+            except StopIteration:
+                break
+        data, self._buf = self._buf[:size], self._buf[size:]
+        if data:
+            self.sent += len(data)
+            if self.progress:
+                self.progress(self.sent, self.length)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+
+def _encode_multipart(params, chunk_size=CHUNK_SIZE, progress=None):
+    '''build a streaming multipart/form-data body with randomly generated boundary.'''
+    boundary = '----------%s' % hex(int(time.time() * 1000))
+    return MultipartBody(params, boundary, chunk_size, progress), boundary
 
 
 class Consumer:
@@ -102,6 +255,9 @@ class RequestBuilder(dict):
         '''init request builder'''
         self.request_type = request_type
         self.url = url
+        self.progress = None
+        # dictionary that receives the 'sign' and 'encode' durations, if set.
+        self.timings = None
 
         if extra_params is not None:
             self.update(extra_params)
@@ -163,13 +319,21 @@ class RequestBuilder(dict):
         if not body_params:
             return ''
 
-        return _encode_multipart(body_params)
+        return _encode_multipart(body_params, progress=self.progress)
 
     def build_signed_request(self, consumer, token):
         '''
         build a request signed by consumer and token, return request as instance of urllib2.Request.
         '''
-        self._sign(consumer, token)
+        timings = self.timings
+        if timings is not None:
+            start = time.time()
+
+        auth_header = get_signer(consumer, token).sign(self)
+
+        if timings is not None:
+            signed = time.time()
+            timings['sign'] = signed - start
         
         if self.request_type == HTTP_GET:
             req = urllib2.Request(self.url, None)
@@ -181,8 +345,11 @@ class RequestBuilder(dict):
             body, boundary = self._get_multipart_body_boundary()
             req = urllib2.Request(self.url, body)
             req.add_header('Content-Type', 'multipart/form-data; boundary=%s; charset=UTF-8' % boundary)
+            req.add_header('Content-Length', str(len(body)))
         
-        req.add_header('Authorization', self._get_auth_header())
+        req.add_header('Authorization', auth_header)
+        if timings is not None:
+            timings['encode'] = time.time() - signed
         return req
 
 
@@ -210,13 +377,92 @@ class SignatureMethod_HMAC_SHA1:
         """calculate the signature for the request builder."""
         key, base_string = cls._signing_base(request, consumer, token)
 
-        # HMAC object.
-        try:
-            import hashlib # 2.5
-            hashed = hmac.new(key, base_string, hashlib.sha1)
-        except ImportError:
-            import sha # Deprecated
-            hashed = hmac.new(key, base_string, sha)
+        hashed = hmac.new(key, base_string, hashlib.sha1)
 
         # Calculate the digest base 64.
         return binascii.b2a_base64(hashed.digest())[:-1]
+
+
+class Signer:
+    '''
+    Signs requests for one consumer and token. The escaped secrets, the
+    keyed HMAC state and the escaped fixed OAuth parameters are computed
+    once, so signing a request only hashes its base string.
+    '''
+
+    def __init__(self, consumer, token=None):
+        '''init with the consumer and the token, which may be None.'''
+        self._keys = _signer_keys(consumer, token)
+        key = '%s&' % _escape(consumer.secret)
+        fixed = [('oauth_consumer_key', consumer.key)]
+        if token:
+            key += _escape(token.secret)
+            fixed.append(('oauth_token', token.key))
+        fixed.append(('oauth_version', '1.0'))
+        fixed.append(('oauth_signature_method', SignatureMethod_HMAC_SHA1.name))
+        self._hmac = hmac.new(key, digestmod=hashlib.sha1)
+        # (name, normalized parameter) to sign, and the header fields.
+        self._fixed = [(k, _normalize(k, v)) for k, v in fixed]
+        self._fixed_header = ', '.join(['%s="%s"' % (k, _escape(str(v))) for k, v in fixed])
+        # fields of the request that the signer sets itself.
+        self._own = set([k for k, v in fixed] + ['oauth_timestamp', 'oauth_nonce', 'oauth_signature'])
+        self._escaped_urls = {}
+
+    def matches(self, consumer, token):
+        '''tell whether the signer is still the one of consumer and token.'''
+        return self._keys == _signer_keys(consumer, token)
+
+    def _escape_url(self, url):
+        escaped = self._escaped_urls.get(url)
+        if escaped is None:
+            escaped = _escape(url)
+            if len(self._escaped_urls) < 256:
+                self._escaped_urls[url] = escaped
+        return escaped
+
+    def sign(self, request):
+        '''sign a RequestBuilder, return its Authorization header.'''
+        timestamp = str(_generate_timestamp())
+        nonce = _generate_nonce()
+        # same parameters as RequestBuilder.get_normalized_parameters.
+        params = self._fixed + [('oauth_timestamp', 'oauth_timestamp=' + timestamp),
+                                ('oauth_nonce', 'oauth_nonce=' + nonce)]
+        header = [self._fixed_header, 'oauth_timestamp="%s", oauth_nonce="%s"' % (timestamp, nonce)]
+        urlencoded = request.request_type == HTTP_POST_URLENCODED
+        for k, v in request.iteritems():
+            if k.startswith('oauth_'):
+                if k in self._own:
+                    continue
+                header.append('%s="%s"' % (k, _escape(str(v))))
+            elif not urlencoded:
+                continue
+            params.append((k, _normalize(k, v)))
+        params.sort()
+
+        base_string = '%s&%s&%s' % (_get_method(request.request_type), self._escape_url(request.url),
+                _escape('&'.join([p for k, p in params])))
+        hashed = self._hmac.copy()
+        hashed.update(base_string)
+        signature = binascii.b2a_base64(hashed.digest())[:-1]
+        header.append('oauth_signature="%s"' % _escape(signature))
+        return 'OAuth ' + ', '.join(header)
+
+
+def _normalize(k, v):
+    '''encode one parameter as RequestBuilder.get_normalized_parameters does.'''
+    if type(k) is str and type(v) is str:
+        return '%s=%s' % (_QUOTED_RE.sub(_quote_char, k), _QUOTED_RE.sub(_quote_char, v))
+    return urllib.urlencode([(k, v)], True).replace('+', '%20')
+
+def _signer_keys(consumer, token):
+    if token:
+        return consumer.key, consumer.secret, token.key, token.secret
+    return consumer.key, consumer.secret
+
+def get_signer(consumer, token=None):
+    '''get the Signer of consumer and token, made once and kept on the token(or the consumer).'''
+    holder = token if token else consumer
+    signer = getattr(holder, '_signer', None)
+    if signer is None or not signer.matches(consumer, token):
+        signer = holder._signer = Signer(consumer, token)
+    return signer
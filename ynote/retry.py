@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Retry policy of Youdao Note client SDK.
+'''
+
+import httplib
+import random
+import socket
+import urllib2
+
+# statuses that mean the request was turned away before it was handled.
+REFUSED_STATUSES = (429, 503)
+
+# statuses that mean the request may or may not have been handled.
+GATEWAY_STATUSES = (502, 504)
+
+
+def _is_network_error(error):
+    return isinstance(error, (socket.error, httplib.HTTPException, urllib2.URLError))
+
+def is_overload(error):
+    '''tell whether an error is a sign that the server is overloaded.'''
+    if getattr(error, 'error_type', None) == 'HTTP_ERROR':
+        return error.error_code in REFUSED_STATUSES or error.error_code in GATEWAY_STATUSES
+    return isinstance(error, socket.timeout)
+
+
+class RetryPolicy:
+    '''
+    Decides which failed requests are sent again, and how long to wait
+    first. Throttled and unavailable responses(429, 503) are always retried.
+    Gateway errors and network errors are retried only for idempotent
+    requests, since the server may have handled them already. API errors
+    are never retried.
+
+    The wait before retry n(counted from 0) is a random time between 0 and
+    min(max_backoff, backoff * 2**n), or the Retry-After the server sent.
+    '''
+
+    def __init__(self, max_retries=3, backoff=0.2, max_backoff=10.0, jitter=True):
+        '''init with the number of retries and the backoff in seconds.'''
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def should_retry(self, error, attempt, idempotent=True):
+        '''tell whether a request that failed with "error" on retry "attempt" may be sent again.'''
+        if attempt >= self.max_retries:
+            return False
+        if getattr(error, 'error_type', None) == 'HTTP_ERROR':
+            if error.error_code in REFUSED_STATUSES:
+                return True
+            return idempotent and error.error_code in GATEWAY_STATUSES
+        return idempotent and _is_network_error(error)
+
+    def delay(self, attempt, retry_after=None):
+        '''get the number of seconds to wait before retry "attempt".'''
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Local SQLite store of notebooks, notes and resources with full-text search.
+'''
+
+import sqlite3
+import threading
+
+import ynote
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notebooks (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    notes_num INTEGER,
+    create_time INTEGER,
+    modify_time INTEGER
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    notebook TEXT,
+    title TEXT,
+    author TEXT,
+    source TEXT,
+    size INTEGER,
+    create_time INTEGER,
+    modify_time INTEGER,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_notebook ON notes (notebook);
+CREATE INDEX IF NOT EXISTS notes_modify_time ON notes (modify_time);
+CREATE TABLE IF NOT EXISTS resources (
+    url TEXT PRIMARY KEY,
+    icon TEXT
+);
+'''
+
+# external content index kept in step with the notes table by triggers.
+_FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING %s(title, content, content="notes");
+CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(docid, title, content) VALUES (new.id, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_bd BEFORE DELETE ON notes BEGIN
+    DELETE FROM notes_fts WHERE docid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_bu BEFORE UPDATE ON notes BEGIN
+    DELETE FROM notes_fts WHERE docid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE ON notes BEGIN
+    INSERT INTO notes_fts(docid, title, content) VALUES (new.id, new.title, new.content);
+END;
+'''
+
+_NOTE_COLUMNS = 'path, title, author, source, size, create_time, modify_time, content'
+
+_HEADER_COLUMNS = 'path, title, author, source, size, create_time, modify_time'
+
+
+def _notebook_of(path):
+    '''get the path of the notebook a note path is in.'''
+    return path.rsplit('/', 1)[0] or None
+
+def _row_to_note(row, loader=None):
+    '''
+    convert a row of _NOTE_COLUMNS to a Note object, or a row of
+    _HEADER_COLUMNS to a note header whose content is loaded by "loader".
+    '''
+    columns = _HEADER_COLUMNS if loader else _NOTE_COLUMNS
+    return ynote.Note(dict(zip(columns.split(', '), row)), loader)
+
+
+class NoteStore:
+    '''
+    Notebooks, notes and resources saved in SQLite, with a full-text index
+    over note titles and contents. Pass it to YNoteClient as "store" to fill
+    it from the data the client fetches.
+    '''
+
+    def __init__(self, path=':memory:'):
+        '''open or create the database at "path".'''
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript(_SCHEMA)
+        self.fts = self._create_index()
+
+    def _create_index(self):
+        '''create the full-text index, return False if sqlite lacks FTS.'''
+        for module in ('fts4', 'fts3'):
+            try:
+                self._db.executescript(_FTS_SCHEMA % module)
+                return True
+            except sqlite3.OperationalError:
+                pass
+        return False
+
+    def close(self):
+        '''close the database.'''
+        self._db.close()
+
+    def _execute(self, sql, args=(), many=False):
+        '''run a statement in a transaction.'''
+        self._lock.acquire()
+        try:
+            if many:
+                self._db.executemany(sql, args)
+            else:
+                self._db.execute(sql, args)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def _query(self, sql, args=()):
+        '''run a query, return all rows.'''
+        self._lock.acquire()
+        try:
+            return self._db.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def put_notebooks(self, books):
+        '''save Notebook objects.'''
+        self._execute('INSERT OR REPLACE INTO notebooks VALUES (?, ?, ?, ?, ?)',
+                [(b.path, b.name, b.notes_num, b.create_time, b.modify_time) for b in books],
+                many=True)
+
+    def put_note_paths(self, book_path, paths):
+        '''record which notebook the notes with "paths" are in.'''
+        self._execute('UPDATE notes SET notebook = ? WHERE path = ?',
+                [(book_path, path) for path in paths], many=True)
+
+    def put_note(self, note, book_path=None):
+        '''
+        save a Note object in notebook "book_path", the notebook its path
+        is in if None.
+        '''
+        if book_path is None:
+            book_path = _notebook_of(note.path)
+        # an update in place, not INSERT OR REPLACE, so the index triggers fire.
+        values = (note.title, note.author, note.source, note.size,
+                note.create_time, note.modify_time, note.content)
+        self._lock.acquire()
+        try:
+            cursor = self._db.execute('UPDATE notes SET title = ?, author = ?, source = ?, size = ?, '
+                    'create_time = ?, modify_time = ?, content = ?, notebook = COALESCE(?, notebook) '
+                    'WHERE path = ?', values + (book_path, note.path))
+            if cursor.rowcount == 0:
+                self._db.execute('INSERT INTO notes (title, author, source, size, create_time, '
+                        'modify_time, content, notebook, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        values + (book_path, note.path))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def update_note_attributes(self, path, **kw):
+        '''change some fields(given by kw) of a saved note.'''
+        names = [k for k in ('title', 'author', 'source', 'content', 'modify_time') if k in kw]
+        if names:
+            self._execute('UPDATE notes SET %s WHERE path = ?' % ', '.join(['%s = ?' % k for k in names]),
+                    tuple([kw[k] for k in names]) + (path,))
+
+    def put_resource(self, resource):
+        '''save a Resource object.'''
+        self._execute('INSERT OR REPLACE INTO resources VALUES (?, ?)', (resource.url, resource.icon))
+
+    def move_note(self, path, new_path, book_path):
+        '''record that a note has moved.'''
+        self._execute('UPDATE notes SET path = ?, notebook = ? WHERE path = ?',
+                (new_path, book_path, path))
+
+    def delete_note(self, path):
+        '''remove a note.'''
+        self._execute('DELETE FROM notes WHERE path = ?', (path,))
+
+    def delete_notebook(self, book_path):
+        '''remove a notebook and its notes.'''
+        self._execute('DELETE FROM notes WHERE notebook = ?', (book_path,))
+        self._execute('DELETE FROM notebooks WHERE path = ?', (book_path,))
+
+    def get_notebooks(self):
+        '''get the saved notebooks as Notebook objects.'''
+        rows = self._query('SELECT path, name, notes_num, create_time, modify_time FROM notebooks')
+        keys = ('path', 'name', 'notes_num', 'create_time', 'modify_time')
+        return [ynote.Notebook(dict(zip(keys, row))) for row in rows]
+
+    def get_note(self, path):
+        '''get a saved note, None if it is not in the store.'''
+        rows = self._query('SELECT %s FROM notes WHERE path = ?' % _NOTE_COLUMNS, (path,))
+        if rows:
+            return _row_to_note(rows[0])
+        return None
+
+    def get_content(self, path):
+        '''get the content of a saved note, None if it is not in the store.'''
+        rows = self._query('SELECT content FROM notes WHERE path = ?', (path,))
+        if rows:
+            return rows[0][0]
+        return None
+
+    def _notes(self, sql, args, headers):
+        '''
+        run a query of notes, with %s standing for the columns. Headers
+        load their content from the store when it is used.
+        '''
+        if headers:
+            rows = self._query(sql % _HEADER_COLUMNS, args)
+            return [_row_to_note(row, self.get_content) for row in rows]
+        return [_row_to_note(row) for row in self._query(sql % _NOTE_COLUMNS, args)]
+
+    def get_resource(self, url):
+        '''get a saved resource, None if it is not in the store.'''
+        rows = self._query('SELECT url, icon FROM resources WHERE url = ?', (url,))
+        if rows:
+            return ynote.Resource({'url':rows[0][0], 'src':rows[0][1]})
+        return None
+
+    def list_notes(self, book_path, headers=False):
+        '''
+        get the saved notes of a notebook, newest first. If "headers" is
+        set, the notes are headers that load their content when it is used.
+        '''
+        return self._notes('SELECT %s FROM notes WHERE notebook = ? ORDER BY modify_time DESC',
+                (book_path,), headers)
+
+    def recent_notes(self, limit=20, since=None, headers=False):
+        '''get the most recently modified notes, modified after "since" if given.'''
+        return self._notes('SELECT %s FROM notes WHERE modify_time > ? ORDER BY modify_time DESC LIMIT ?',
+                (since or -1, limit), headers)
+
+    def search(self, query, limit=20, headers=False):
+        '''
+        find notes whose title or content match "query", newest first.
+        "query" uses the FTS syntax, or is a plain substring when sqlite
+        has no FTS support.
+        '''
+        if self.fts:
+            sql = ('SELECT %s FROM notes WHERE id IN '
+                   '(SELECT docid FROM notes_fts WHERE notes_fts MATCH ?) '
+                   'ORDER BY modify_time DESC LIMIT ?')
+            args = (query, limit)
+        else:
+            sql = ('SELECT %s FROM notes WHERE title LIKE ? OR content LIKE ? '
+                   'ORDER BY modify_time DESC LIMIT ?')
+            pattern = '%' + query + '%'
+            args = (pattern, pattern, limit)
+        return self._notes(sql, args, headers)
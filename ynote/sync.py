@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Incremental mirror of a Youdao Note account in a local directory.
+'''
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import hashlib
+import os
+import re
+import shutil
+
+import ynote
+
+MANIFEST_NAME = '.ynote-manifest.json'
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def _safe_name(path):
+    '''
+    turn a notebook or note path into a file name. A path that cannot be
+    used as it is gets a digest of itself appended, so that two paths
+    never get the same name.
+    '''
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    name = path.strip('/')
+    safe = _UNSAFE_CHARS.sub('_', name)
+    if safe and safe == name:
+        return safe
+    return '%s-%s' % (safe, hashlib.sha1(path).hexdigest()[:12])
+
+def _note_to_dict(note):
+    '''convert a Note object to a dictionary that can be saved as json.'''
+    return {
+        'path':note.path,
+        'title':note.title,
+        'author':note.author,
+        'source':note.source,
+        'size':note.size,
+        'create_time':note.create_time,
+        'modify_time':note.modify_time,
+        'content':note.content,
+    }
+
+def _write_atomic(path, data):
+    '''write a file through a temporary file, so it is never half written.'''
+    tmp = path + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+class Mirror:
+    '''
+    Mirror of an account in the directory "root". Each run fetches only
+    notebooks whose modify_time or notes_num changed, writes the notes that
+    were added or changed, removes the deleted ones and downloads only new
+    resources. Progress is saved in a manifest as the run goes, so a run
+    that crashed continues where it stopped.
+
+    The API has no per-note metadata call, so the notes of a changed
+    notebook are all fetched, but only those whose modify_time or size
+    changed are written.
+    '''
+
+    def __init__(self, client, root, max_workers=8, save_every=50):
+        '''
+        init with a YNoteClient and the mirror directory. Notes are fetched
+        on "max_workers" threads and the manifest is saved every
+        "save_every" notes.
+        '''
+        self.client = client
+        self.root = root
+        self.max_workers = max_workers
+        self.save_every = save_every
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self._unsaved = 0
+
+    def _load_manifest(self):
+        '''load the manifest, or start an empty one.'''
+        if os.path.exists(self.manifest_path):
+            f = open(self.manifest_path, 'rb')
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        return {'notebooks':{}, 'resources':{}}
+
+    def save_manifest(self):
+        '''write the manifest to disk.'''
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        _write_atomic(self.manifest_path, json.dumps(self.manifest))
+        self._unsaved = 0
+
+    def _changed(self):
+        '''count a change, save the manifest every "save_every" changes.'''
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save_manifest()
+
+    def _abspath(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def _remove(self, rel_path):
+        '''remove a mirrored file if it exists.'''
+        path = self._abspath(rel_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def run(self):
+        '''
+        bring the mirror up to date, return statistics of the run as a
+        dictionary. Notes that failed are listed in stats['errors'] and
+        retried by the next run.
+        '''
+        stats = {
+            'notebooks_skipped':0,
+            'notebooks_synced':0,
+            'notebooks_deleted':0,
+            'notes_fetched':0,
+            'notes_written':0,
+            'notes_deleted':0,
+            'resources_downloaded':0,
+            'resources_deleted':0,
+            'errors':{},
+        }
+        books = self.client.get_notebooks()
+        known = self.manifest['notebooks']
+
+        for book in books:
+            entry = known.get(book.path)
+            stamp = [book.modify_time, book.notes_num]
+            if entry is not None and entry.get('stamp') == stamp:
+                stats['notebooks_skipped'] += 1
+                continue
+            self._sync_notebook(book, stamp, stats)
+
+        book_paths = set([book.path for book in books])
+        for book_path in known.keys():
+            if book_path not in book_paths:
+                self._delete_notebook(book_path, stats)
+
+        if not stats['errors']:
+            self._collect_resources(stats)
+        self.save_manifest()
+        return stats
+
+    def _sync_notebook(self, book, stamp, stats):
+        '''sync the notes of a notebook whose stamp has changed.'''
+        known = self.manifest['notebooks']
+        entry = known.setdefault(book.path, {'notes':{}})
+        entry['name'] = book.name
+        old_dir, entry['dir'] = entry.get('dir'), _safe_name(book.path)
+        notes = entry['notes']
+        if entry.get('target') != stamp:
+            # a new version of the notebook: every note must be checked.
+            entry['target'] = stamp
+            for note_entry in notes.values():
+                note_entry.pop('checked', None)
+
+        paths = self.client.get_note_paths(book.path)
+        for path in set(notes.keys()) - set(paths):
+            self._remove(notes.pop(path)['file'])
+            stats['notes_deleted'] += 1
+            self._changed()
+
+        # notes checked before a crash against the same version are skipped.
+        todo = [p for p in paths if not notes.get(p, {}).get('checked')]
+        failed = False
+        for path, note, error in self.client.get_notes(todo, self.max_workers, False):
+            if error is not None:
+                stats['errors'][path] = error
+                failed = True
+                continue
+            stats['notes_fetched'] += 1
+            if not self._store_note(entry, note, stats):
+                failed = True
+            self._changed()
+
+        if not failed:
+            entry['stamp'] = stamp
+            for note_entry in notes.values():
+                note_entry.pop('checked', None)
+            if old_dir is not None and old_dir != entry['dir']:
+                # its notes have moved to the new directory.
+                try:
+                    os.rmdir(self._abspath(old_dir))
+                except OSError:
+                    pass
+            stats['notebooks_synced'] += 1
+        self.save_manifest()
+
+    def _store_note(self, book_entry, note, stats):
+        '''
+        write a note if it is new or changed, and fetch its new resources,
+        return False if a resource could not be fetched.
+        '''
+        notes = book_entry['notes']
+        old = notes.get(note.path)
+        rel_path = os.path.join(book_entry['dir'], _safe_name(note.path) + '.json')
+        if (old is None or old['file'] != rel_path or old['modify_time'] != note.modify_time
+                or old['size'] != note.size):
+            dir_path = self._abspath(book_entry['dir'])
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            _write_atomic(self._abspath(rel_path), json.dumps(_note_to_dict(note)))
+            if old is not None and old['file'] != rel_path:
+                # named by an older version of the mirror.
+                self._remove(old['file'])
+            stats['notes_written'] += 1
+
+        urls = ynote._find_resource_urls(note.content)
+        complete = True
+        for url in urls:
+            try:
+                self._fetch_resource(url, stats)
+            except Exception, e:
+                stats['errors'][url] = e
+                complete = False
+        notes[note.path] = {
+            'file':rel_path,
+            'modify_time':note.modify_time,
+            'size':note.size,
+            'resources':urls,
+            'checked':complete,
+        }
+        return complete
+
+    def _fetch_resource(self, url, stats):
+        '''download a resource unless the mirror already has it.'''
+        resources = self.manifest['resources']
+        if url in resources:
+            return
+        rel_path = os.path.join('resources', ynote._resource_name(url))
+        path = self._abspath(rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # a partial download left by a crash is resumed.
+        self.client.download_resource_to(url, path, resume=True)
+        resources[url] = rel_path
+        stats['resources_downloaded'] += 1
+
+    def _delete_notebook(self, book_path, stats):
+        '''remove a notebook that no longer exists.'''
+        entry = self.manifest['notebooks'].pop(book_path)
+        for note_entry in entry['notes'].values():
+            self._remove(note_entry['file'])
+            stats['notes_deleted'] += 1
+        dir_path = self._abspath(entry.get('dir', _safe_name(book_path)))
+        if os.path.isdir(dir_path):
+            shutil.rmtree(dir_path)
+        stats['notebooks_deleted'] += 1
+        self._changed()
+
+    def _collect_resources(self, stats):
+        '''remove the resources no mirrored note refers to any more.'''
+        used = set()
+        for entry in self.manifest['notebooks'].values():
+            for note_entry in entry['notes'].values():
+                used.update(note_entry.get('resources', []))
+        resources = self.manifest['resources']
+        for url in resources.keys():
+            if url not in used:
+                self._remove(resources.pop(url))
+                stats['resources_deleted'] += 1
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Content-addressed cache of uploaded resources.
+'''
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+import ynote, oauth2
+
+HASH_NAME = 'sha256'
+
+
+class UploadCache:
+    '''
+    Persistent map from the hash of uploaded data to the Resource it became.
+    Pass it to YNoteClient as "upload_cache" and uploading the same bytes
+    again returns the saved Resource without any network traffic.
+
+    Entries older than "max_age" seconds are checked with a tiny download of
+    the resource before they are used, and uploaded again if it is gone.
+    '''
+
+    def __init__(self, path=':memory:', max_age=None):
+        '''open or create the cache database at "path".'''
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                'digest TEXT PRIMARY KEY, url TEXT, icon TEXT, checked_time REAL)')
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def close(self):
+        '''close the database.'''
+        self._db.close()
+
+    def _key(self, digest, size):
+        return '%s:%s:%d' % (HASH_NAME, digest, size)
+
+    def get(self, digest, size):
+        '''get (Resource, checked_time) for uploaded data, None if unknown.'''
+        self._lock.acquire()
+        try:
+            row = self._db.execute('SELECT url, icon, checked_time FROM uploads WHERE digest = ?',
+                    (self._key(digest, size),)).fetchone()
+        finally:
+            self._lock.release()
+        if row is None:
+            return None
+        return ynote.Resource({'url':row[0], 'src':row[1]}), row[2]
+
+    def put(self, digest, size, resource):
+        '''remember the Resource that uploaded data became.'''
+        self._lock.acquire()
+        try:
+            self._db.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)',
+                    (self._key(digest, size), resource.url, resource.icon, time.time()))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def remove(self, digest, size):
+        '''forget uploaded data.'''
+        self._lock.acquire()
+        try:
+            self._db.execute('DELETE FROM uploads WHERE digest = ?', (self._key(digest, size),))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def _lookup(self, client, digest, size):
+        '''find a usable Resource for the data, checking it if it is stale.'''
+        entry = self.get(digest, size)
+        if entry is None:
+            return None
+        resource, checked_time = entry
+        if self.max_age is not None and time.time() - checked_time > self.max_age:
+            if not client._resource_exists(resource.url):
+                self.remove(digest, size)
+                return None
+            self.put(digest, size, resource)
+        return resource
+
+    def upload(self, client, res_file, progress=None):
+        '''
+        upload a file through "client" unless the same data has been
+        uploaded before, return the Resource.
+        '''
+        if not isinstance(res_file, oauth2.UploadFile):
+            res_file = oauth2.UploadFile(res_file)
+
+        if res_file.rewind():
+            # seekable data is hashed first, so a hit costs no upload at all.
+            h = hashlib.new(HASH_NAME)
+            for chunk in res_file.chunks():
+                h.update(chunk)
+            res_file.rewind()
+            digest = h.hexdigest()
+            resource = self._lookup(client, digest, res_file.size)
+            if resource is not None:
+                self.hits += 1
+                return resource
+            self.misses += 1
+            resource = client._upload_resource(res_file, progress)
+        else:
+            # a stream can be read once: hash it while it is uploaded.
+            self.misses += 1
+            res_file.hash = hashlib.new(HASH_NAME)
+            resource = client._upload_resource(res_file, progress)
+            digest = res_file.hash.hexdigest()
+
+        self.put(digest, res_file.size, resource)
+        return resource
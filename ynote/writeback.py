@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = "1.0b"
+__author__ = "Li Chuan (daniellee0219@gmail.com)"
+
+'''
+Write-behind queue of note mutations for Youdao Note client SDK.
+'''
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import collections
+import os
+import threading
+import time
+
+import ynote, futures
+
+# fields of a note an update may change.
+_NOTE_FIELDS = ('source', 'author', 'title', 'content', 'modify_time')
+
+# what _recover returns for a mutation the server has not seen.
+_NOT_DONE = object()
+
+
+class _Mutation:
+    '''a queued create, update, move or delete.'''
+
+    def __init__(self, id, op, key, args):
+        self.id = id
+        self.op = op
+        self.key = key
+        self.args = args
+        self.due = 0
+        self.started = False
+        # started by a run that stopped before it knew the outcome.
+        self.unconfirmed = False
+        # the futures of every call this mutation stands for.
+        self.futures = [futures.Future()]
+        # called once the mutation has been sent, before the futures are done.
+        self.on_sent = []
+
+    def run(self, client):
+        '''send the mutation through a YNoteClient.'''
+        args = self.args
+        if self.op == 'create':
+            return client.create_note_with_attributes(args['notebook'], args['content'], **args['fields'])
+        elif self.op == 'update':
+            return client.update_note_attributes(args['path'], **args['fields'])
+        elif self.op == 'move':
+            return client.move_note(args['path'], args['notebook'])
+        elif self.op == 'delete':
+            return client.delete_note(args['path'])
+        raise ValueError('unknown mutation: %s' % self.op)
+
+
+class WriteQueue:
+    '''
+    Queue of note mutations sent in the background by a YNoteClient. Each
+    mutation waits "delay" seconds before it is sent, and updates of a note
+    that are still waiting merge into one call. Mutations of the same note
+    are sent one at a time in the order they were queued, at most
+    "max_workers" notes at a time.
+
+    Every method returns a futures.Future of the result the client method
+    would return. When "journal" names a file, queued mutations are written
+    to it and those not sent yet are queued again when the queue is opened
+    after a crash.
+
+    A mutation is journaled as started before it is sent. One that was
+    started but not known to be done when the queue stopped is checked
+    against the server before it is sent again: a create is taken as done
+    if its notebook has a note with its title and content that no other
+    create claimed, a move or delete if the note is no longer at its path.
+    self.recovered counts those found done.
+
+    A note that is moved gets a new path: queue its later mutations with the
+    path the move returns.
+    '''
+
+    def __init__(self, client, journal=None, delay=1.0, max_workers=4, sync=False):
+        '''
+        init with the YNoteClient that sends the mutations. If "sync" is
+        set, the journal is flushed to the disk after each write.
+        '''
+        self.client = client
+        self.delay = delay
+        self.max_workers = max_workers
+        self.sync = sync
+        self.merged = 0
+        self.sent = 0
+        self.errors = 0
+        self.recovered = 0
+        self._claimed = set()
+        self._queues = collections.OrderedDict()
+        self._in_flight = 0
+        self._flushing = 0
+        self._next_id = 1
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._pool = futures.WorkerPool(max_workers)
+        self._journal = None
+        if journal is not None:
+            self._open_journal(journal)
+        self._thread = threading.Thread(target=self._run, name='ynote-writeback')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open_journal(self, path):
+        '''replay the mutations left in a journal, then rewrite it compacted.'''
+        mutations = collections.OrderedDict()
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line of a crashed run may be cut short.
+                        continue
+                    if record.get('done'):
+                        mutations.pop(record['id'], None)
+                    elif record.get('started'):
+                        if record['id'] in mutations:
+                            mutations[record['id']].unconfirmed = True
+                    elif record['id'] in mutations:
+                        mutations[record['id']].args['fields'].update(record['args']['fields'])
+                    else:
+                        mutations[record['id']] = _Mutation(record['id'], record['op'],
+                                record['key'], record['args'])
+            finally:
+                f.close()
+
+        tmp = path + '.tmp'
+        self._journal = open(tmp, 'wb')
+        for m in mutations.values():
+            self._queues.setdefault(m.key, collections.deque()).append(m)
+            self._log({'id':m.id, 'op':m.op, 'key':m.key, 'args':m.args})
+            if m.unconfirmed:
+                self._log({'id':m.id, 'started':True})
+            self._next_id = max(self._next_id, m.id + 1)
+        self._journal.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        self._journal = open(path, 'ab')
+
+    def _log(self, record):
+        '''append a record to the journal, holding the lock.'''
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        if self.sync:
+            os.fsync(self._journal.fileno())
+
+    def _add(self, op, key, args, on_sent=None):
+        '''
+        queue a mutation of the note "key"(a new one if None), return its
+        Future. on_sent() is called once it has been sent.
+        '''
+        self._cond.acquire()
+        try:
+            if self._closed:
+                raise RuntimeError('write queue is closed')
+            if key is None:
+                key = 'new:%d' % self._next_id
+            queue = self._queues.setdefault(key, collections.deque())
+            last = queue[-1] if queue else None
+
+            if op == 'update' and last is not None and last.op == 'update' and not last.started:
+                last.args['fields'].update(args['fields'])
+                if on_sent is not None:
+                    last.on_sent.append(on_sent)
+                last.due = time.time() + self.delay
+                self.merged += 1
+                self._log({'id':last.id, 'op':op, 'key':key, 'args':args})
+                return last.futures[0]
+
+            m = _Mutation(self._next_id, op, key, args)
+            if on_sent is not None:
+                m.on_sent.append(on_sent)
+            self._next_id += 1
+            m.due = time.time() + self.delay
+            if op == 'delete':
+                # waiting updates of a deleted note need not be sent.
+                while queue and queue[-1].op == 'update' and not queue[-1].started:
+                    superseded = queue.pop()
+                    m.futures.extend(superseded.futures)
+                    self.merged += 1
+                    self._log({'id':superseded.id, 'done':True})
+            queue.append(m)
+            self._log({'id':m.id, 'op':op, 'key':key, 'args':args})
+            self._cond.notify_all()
+            return m.futures[0]
+        finally:
+            self._cond.release()
+
+    def create_note_with_attributes(self, book_path, content, **kw):
+        '''queue the creation of a note, future of its path.'''
+        fields = dict([(k, kw[k]) for k in ('source', 'author', 'title', 'create_time') if k in kw])
+        return self._add('create', None, {'notebook':book_path, 'content':content, 'fields':fields})
+
+    def create_note(self, book_path, note):
+        '''queue the creation of a note with information specified in "note", future of its path.'''
+        return self.create_note_with_attributes(book_path, note.content,
+                source=note.source, author=note.author, title=note.title)
+
+    def update_note_attributes(self, note_path, **kw):
+        '''queue an update of some attributes(given by kw) of the note.'''
+        fields = dict([(k, kw[k]) for k in _NOTE_FIELDS if k in kw])
+        return self._add('update', note_path, {'path':note_path, 'fields':fields})
+
+    def update_note(self, note, modify_time=None):
+        '''
+        queue an update of the fields of "note" changed since it was loaded
+        or last sent. Nothing is queued if none has changed, and the future
+        is done at once with False. The fields count as changed until the
+        update has been sent.
+        '''
+        fields = note.changed_fields()
+        if not fields:
+            future = futures.Future()
+            future.set_result(False)
+            return future
+        kw = dict(fields)
+        if modify_time:
+            kw['modify_time'] = modify_time
+        return self._add('update', note.path, {'path':note.path, 'fields':kw},
+                lambda: note.mark_clean(fields))
+
+    def move_note(self, note_path, book_path):
+        '''queue a move of the note, future of its new path.'''
+        return self._add('move', note_path, {'path':note_path, 'notebook':book_path})
+
+    def delete_note(self, note_path):
+        '''queue the deletion of a note.'''
+        return self._add('delete', note_path, {'path':note_path})
+
+    def pending(self):
+        '''get the number of mutations not sent yet or still being sent.'''
+        self._cond.acquire()
+        try:
+            return sum([len(queue) for queue in self._queues.values()])
+        finally:
+            self._cond.release()
+
+    def flush(self, timeout=None):
+        '''
+        send every queued mutation now and wait until they are done, return
+        False if "timeout" seconds passed first. The results are in the
+        futures returned when they were queued.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        self._cond.acquire()
+        try:
+            self._flushing += 1
+            self._cond.notify_all()
+            while self._queues:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+        finally:
+            self._flushing -= 1
+            self._cond.release()
+
+    def close(self, timeout=None):
+        '''flush the queue and stop the background thread.'''
+        flushed = self.flush(timeout)
+        self._cond.acquire()
+        try:
+            self._closed = True
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        self._thread.join()
+        self._pool.shutdown(wait=flushed)
+        if self._journal is not None:
+            self._journal.close()
+        return flushed
+
+    def _run(self):
+        '''background thread: start the mutations that are due.'''
+        self._cond.acquire()
+        try:
+            while not self._closed:
+                now = time.time()
+                next_due = None
+                for queue in self._queues.values():
+                    m = queue[0]
+                    if m.started:
+                        continue
+                    if m.due > now and not self._flushing:
+                        next_due = m.due if next_due is None else min(next_due, m.due)
+                        continue
+                    if self._in_flight >= self.max_workers:
+                        break
+                    m.started = True
+                    # a replay must not send it again blindly: it may be handled.
+                    self._log({'id':m.id, 'started':True})
+                    self._in_flight += 1
+                    self._pool.submit(self._send, m)
+
+                if next_due is None:
+                    self._cond.wait()
+                else:
+                    self._cond.wait(max(next_due - now, 0.001))
+        finally:
+            self._cond.release()
+
+    def _recover(self, m):
+        '''
+        find out whether an unconfirmed mutation was handled, return its
+        result if it was, _NOT_DONE if it was not.
+        '''
+        client = self.client
+        args = m.args
+        if m.op == 'create':
+            digest = ynote._content_hash(args['content'])
+            title = args['fields'].get('title')
+            paths = client.get_note_paths(args['notebook'])
+            for path, note, error in client.get_notes(paths, ordered=False):
+                if error is not None or note.content_hash() != digest:
+                    continue
+                if title is not None and note.title != title:
+                    continue
+                self._cond.acquire()
+                try:
+                    if path in self._claimed:
+                        continue
+                    self._claimed.add(path)
+                finally:
+                    self._cond.release()
+                return path
+        elif m.op in ('move', 'delete'):
+            book_path = args['path'].rsplit('/', 1)[0]
+            if args['path'] not in client.get_note_paths(book_path):
+                # the path a move gave the note is not known.
+                return None
+        return _NOT_DONE
+
+    def _send(self, m):
+        '''worker thread: send a mutation and resolve its futures.'''
+        recovered = False
+        try:
+            result = _NOT_DONE
+            if m.unconfirmed:
+                result = self._recover(m)
+                recovered = result is not _NOT_DONE
+            if result is _NOT_DONE:
+                result = m.run(self.client)
+            error = None
+        except Exception, e:
+            error = e
+
+        self._cond.acquire()
+        try:
+            queue = self._queues[m.key]
+            queue.popleft()
+            if not queue:
+                del self._queues[m.key]
+            self._in_flight -= 1
+            if recovered:
+                self.recovered += 1
+            elif error is None:
+                self.sent += 1
+            else:
+                self.errors += 1
+            self._log({'id':m.id, 'done':True})
+            if not self._queues and self._journal is not None:
+                # nothing is pending: start the journal afresh.
+                self._journal.seek(0)
+                self._journal.truncate()
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+        if error is None:
+            for fn in m.on_sent:
+                fn()
+        for future in m.futures:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)